@@ -0,0 +1,440 @@
+import math
+import os
+import sqlite3
+import threading
+
+import sketch
+from bootstrap import bootstrap_means
+from lazy_imports import lazy_import
+from storage import (CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, DATA_FOLDER, SUCCESS_SCORES, get_backend,
+                     table_columns)
+
+pd = lazy_import("pandas")
+
+AGGREGATES_DB = os.path.join(DATA_FOLDER, "aggregates.db")
+
+TABLE_KEYS = {CONSENT_CSV: "consent", DEMOGRAPHIC_CSV: "demographics", TASKS_CSV: "tasks", EXIT_CSV: "exit"}
+EXIT_METRICS = ["satisfaction", "difficulty", "confidence"]
+DEMOGRAPHIC_COUNTS = ["gender", "age", "education", "familiarity"]
+
+# Times a rebuild counts the tables again because saves reached the store
+# meanwhile, before it holds off saves while it counts
+REBUILD_ATTEMPTS = 3
+
+
+def _number(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def value_key(value):
+    # How a numeric answer is stored in the "<metric>.values" counters, which
+    # count every distinct answer for the bootstrap intervals
+    return f"{value:g}"
+
+
+def _text(value):
+    # Empty answers read back from CSV as NaN, so they are not counted either
+    if value is None or value == "" or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+
+class AggregateStore:
+    # Running sums and counts behind every number and chart in the Report tab,
+    # kept in a small SQLite database next to the data. apply() is called from
+    # the save path with the records that were just written and updates the
+    # counters in one transaction, so the cost per submission is constant and
+    # several server processes can share the store. report_data() turns the
+    # counters back into the series and frames the report plots.
+    #
+    # Exit and task rows are paired with the demographic answers of the same
+    # participant ID; a row that arrives before its participant's demographics
+    # waits in "unpaired" until they are written.
+
+    # Bump when the tables or their meaning change; older stores are rebuilt
+    SCHEMA_VERSION = 4
+
+    def __init__(self, db_path=AGGREGATES_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            if self.db_path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != self.SCHEMA_VERSION:
+            connection.executescript(f"""
+                DROP TABLE IF EXISTS counters;
+                DROP TABLE IF EXISTS row_counts;
+                DROP TABLE IF EXISTS demo_rows;
+                DROP TABLE IF EXISTS unpaired;
+                DELETE FROM meta;
+                INSERT INTO meta VALUES ('version', '{self.SCHEMA_VERSION}');
+            """)
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS counters (
+                metric TEXT, grp TEXT, sub TEXT, total REAL, n INTEGER,
+                PRIMARY KEY (metric, grp, sub));
+            CREATE TABLE IF NOT EXISTS row_counts (tbl TEXT PRIMARY KEY, n INTEGER);
+            CREATE TABLE IF NOT EXISTS demo_rows (participant_id TEXT PRIMARY KEY, age TEXT, gender TEXT,
+                                                  education TEXT);
+            CREATE TABLE IF NOT EXISTS unpaired (tbl TEXT, pos INTEGER, participant_id TEXT, a TEXT, b TEXT,
+                                                 PRIMARY KEY (tbl, pos));
+            CREATE INDEX IF NOT EXISTS idx_unpaired_participant ON unpaired (participant_id);
+        """)
+
+    def is_built(self):
+        return self._connection().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+    def apply(self, csv_file, records):
+        table = TABLE_KEYS.get(csv_file)
+        if table is None or not records:
+            return
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            start = self._claim_positions(connection, table, len(records))
+            for pos, record in enumerate(records, start):
+                getattr(self, "_apply_" + table)(connection, pos, record)
+            self._bump_generation(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _bump_generation(self, connection):
+        connection.execute("INSERT INTO meta VALUES ('generation', 1) "
+                           "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def generation(self):
+        # Goes up with every change to the counters (a save or a rebuild), in
+        # any process, so a copy of the report can tell whether it is current
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _add(self, connection, metric, grp, sub="", total=0.0, n=1):
+        connection.execute(
+            "INSERT INTO counters VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (metric, grp, sub) DO UPDATE SET total = total + excluded.total, n = n + excluded.n",
+            (metric, grp, sub, total, n))
+
+    def _claim_positions(self, connection, table, count):
+        row = connection.execute("SELECT n FROM row_counts WHERE tbl = ?", (table,)).fetchone()
+        start = row[0] if row else 0
+        connection.execute("INSERT OR REPLACE INTO row_counts VALUES (?, ?)", (table, start + count))
+        return start
+
+    def _apply_consent(self, connection, pos, record):
+        pass
+
+    def _apply_demographics(self, connection, pos, record):
+        for column in DEMOGRAPHIC_COUNTS:
+            value = _text(record.get(column))
+            if value is not None:
+                self._add(connection, "demographics." + column, value)
+        participant_id = _text(record.get("participant_id"))
+        if participant_id is None:
+            return
+        demo = (_text(record.get("age")), _text(record.get("gender")), _text(record.get("education")))
+        connection.execute("INSERT OR REPLACE INTO demo_rows VALUES (?, ?, ?, ?)", (participant_id,) + demo)
+        waiting = connection.execute("SELECT tbl, a, b FROM unpaired WHERE participant_id = ?",
+                                     (participant_id,)).fetchall()
+        for table, a, b in waiting:
+            self._pair(connection, table, (a, b), demo)
+        connection.execute("DELETE FROM unpaired WHERE participant_id = ?", (participant_id,))
+
+    def _apply_exit(self, connection, pos, record):
+        for column in EXIT_METRICS:
+            value = _number(record.get(column))
+            if value is not None:
+                self._add(connection, "exit." + column, "", total=value)
+                self._add(connection, "exit." + column + ".values", "", value_key(value))
+        values = (_number(record.get("difficulty")), _number(record.get("confidence")))
+        self._pair_or_wait(connection, "exit", pos, record, values)
+
+    def _apply_tasks(self, connection, pos, record):
+        task = _text(record.get("task_name"))
+        success = _text(record.get("success"))
+        duration = _number(record.get("duration_seconds"))
+        if success is not None:
+            self._add(connection, "tasks.success", success)
+        if task is not None:
+            # Success rate divides by every row of the task, answered or not
+            self._add(connection, "task.success_score", task, total=SUCCESS_SCORES.get(success, 0.0))
+            self._add(connection, "task.success_values", task, success or "")
+            if success is not None:
+                self._add(connection, "task.answers", task)
+            if duration is not None:
+                self._add(connection, "task.duration", task, total=duration)
+                # One bucket of the task's duration sketch (see sketch.py)
+                self._add(connection, "task.duration_sketch", task, sketch.bucket_key(duration))
+        self._pair_or_wait(connection, "tasks", pos, record, (success, None))
+
+    def _pair_or_wait(self, connection, table, pos, record, values):
+        participant_id = _text(record.get("participant_id"))
+        if participant_id is None:
+            return
+        demo = connection.execute("SELECT age, gender, education FROM demo_rows WHERE participant_id = ?",
+                                  (participant_id,)).fetchone()
+        if demo is None:
+            connection.execute("INSERT OR REPLACE INTO unpaired VALUES (?, ?, ?, ?, ?)",
+                               (table, pos, participant_id) + tuple(values))
+        else:
+            self._pair(connection, table, values, demo)
+
+    def _pair(self, connection, table, values, demo):
+        age, gender, education = demo
+        if table == "exit":
+            difficulty, confidence = (_number(value) for value in values)
+            if age is not None and difficulty is not None:
+                self._add(connection, "difficulty_by_age", age, total=difficulty)
+                self._add(connection, "difficulty_by_age.values", age, value_key(difficulty))
+            if gender is not None and confidence is not None:
+                self._add(connection, "confidence_by_gender", gender, total=confidence)
+                self._add(connection, "confidence_by_gender.values", gender, value_key(confidence))
+        elif table == "tasks":
+            success = values[0]
+            if education is not None and success is not None:
+                self._add(connection, "success_by_education", education, success)
+
+    def counters(self):
+        connection = self._connection()
+        counters = {(metric, grp, sub): (total, n)
+                    for metric, grp, sub, total, n in connection.execute("SELECT * FROM counters")}
+        for table, n in connection.execute("SELECT tbl, n FROM row_counts"):
+            counters[("rows", table, "")] = (0.0, n)
+        return counters
+
+    def row_counts(self):
+        counts = dict.fromkeys(TABLE_KEYS.values(), 0)
+        counts.update(self._connection().execute("SELECT tbl, n FROM row_counts").fetchall())
+        return counts
+
+    def report_data(self):
+        return report_from_counters(self.counters(), self.row_counts())
+
+    def rebuild(self, backend=None, replace=True):
+        # Recompute every counter from the raw tables. Returns the counters that
+        # differ from the stored ones as {key: (stored, rebuilt)}; with replace
+        # the stored aggregates are overwritten by the rebuilt ones.
+        #
+        # Saves keep updating the store while the tables are read. The tables
+        # are read first, then the store is locked; if any save reached the
+        # store in between, the count is thrown away and taken again, so a
+        # save is never both missed by the count and wiped by the replace.
+        # (Every backend updates the store before the saved rows can be read:
+        # under the file's lock, or before the rows are committed.)
+        # After REBUILD_ATTEMPTS the store is locked for the whole count.
+        backend = backend or get_backend()
+        connection = self._connection()
+        for attempt in range(REBUILD_ATTEMPTS + 1):
+            locked_throughout = attempt == REBUILD_ATTEMPTS
+            if locked_throughout:
+                connection.execute("BEGIN IMMEDIATE")
+            try:
+                generation = self.generation()
+                fresh = self._count(backend)
+                if not locked_throughout:
+                    connection.execute("BEGIN IMMEDIATE")
+                    if self.generation() != generation:
+                        connection.execute("ROLLBACK")
+                        continue
+
+                stored, rebuilt = self.counters(), fresh.counters()
+                drift = {key: (stored.get(key), rebuilt.get(key)) for key in stored.keys() | rebuilt.keys()
+                         if not _same(stored.get(key), rebuilt.get(key))}
+                if replace:
+                    source = fresh._connection()
+                    for table in ("counters", "row_counts", "demo_rows", "unpaired"):
+                        rows = source.execute(f"SELECT * FROM {table}").fetchall()
+                        connection.execute(f"DELETE FROM {table}")
+                        if rows:
+                            placeholders = ", ".join("?" for _ in rows[0])
+                            connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+                    connection.execute("INSERT OR REPLACE INTO meta VALUES ('built', datetime('now'))")
+                    self._bump_generation(connection)
+                connection.execute("COMMIT")
+                return drift
+            except BaseException:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+
+    def _count(self, backend):
+        # A new in-memory store holding the counters of the backend's tables
+        fresh = AggregateStore(":memory:")
+        for csv_file in TABLE_KEYS:
+            frame = backend.load(csv_file, table_columns(csv_file, free_text=False))
+            if not frame.empty:
+                records = frame.astype(object).where(frame.notna(), None).to_dict("records")
+                fresh.apply(csv_file, records)
+        return fresh
+
+
+def report_from_counters(counters, rows):
+    # The series and frames the report shows, from counters keyed
+    # (metric, group, sub) -> (total, n) and the row count of every table
+    def mean(metric, grp=""):
+        total, n = counters.get((metric, grp, ""), (0.0, 0))
+        return total / n if n else float("nan")
+
+    def counts(metric, name):
+        values = {grp: n for (m, grp, _), (_, n) in counters.items() if m == metric}
+        series = pd.Series(values, dtype="int64", name="count").rename_axis(name)
+        return series.sort_values(ascending=False, kind="stable")
+
+    def means(metric, name, column):
+        values = {grp: total / n for (m, grp, _), (total, n) in counters.items() if m == metric and n}
+        return pd.Series(values, dtype="float64", name=column).rename_axis(name).sort_index()
+
+    tasks = sorted({grp for (m, grp, _) in counters if m == "task.success_score"})
+    summary = pd.DataFrame({
+        "task_name": tasks,
+        "success_rate": [round(counters[("task.success_score", task, "")][0]
+                               / counters[("task.success_score", task, "")][1] * 100, 1) for task in tasks],
+        "avg_time_sec": [mean("task.duration", task) for task in tasks],
+        "num_participants": [counters.get(("task.answers", task, ""), (0, 0))[1] for task in tasks],
+    })
+
+    sketches = {task: {} for task in tasks}
+    for (m, grp, sub), (_, n) in counters.items():
+        if m == "task.duration_sketch":
+            sketches[grp][sub] = n
+    quantiles = pd.DataFrame([sketch.quantiles(sketches[task], (0.5, 0.9, 0.99)) for task in sketches],
+                             index=pd.Index(list(sketches), name="task_name"), columns=["median", "p90", "p99"])
+    quantiles["timed"] = [sum(sketches[task].values()) for task in sketches]
+    histograms = pd.DataFrame({task: sketch.histogram(sketches[task]) for task in sketches},
+                              columns=list(sketches), dtype="int64").rename_axis("duration")
+
+    def intervals(metric, scale=1.0, score=float):
+        # Bootstrap intervals of the mean per group, from the "<metric>"
+        # counters of every distinct answer; score turns a stored answer into
+        # the number averaged
+        distributions = {}
+        for (m, grp, sub), (_, n) in counters.items():
+            if m == metric:
+                counts = distributions.setdefault(grp, {})
+                counts[score(sub)] = counts.get(score(sub), 0) + n
+        frame = bootstrap_means(distributions)
+        frame[["mean", "low", "high"]] *= scale
+        return frame.sort_index()
+
+    exit_intervals = pd.concat([intervals(f"exit.{column}.values").rename(index={"": column})
+                                for column in EXIT_METRICS]).rename_axis("metric")
+
+    pairs = {(grp, sub): n for (m, grp, sub), (_, n) in counters.items() if m == "success_by_education"}
+    if pairs:
+        success_by_education = pd.Series(pairs).unstack(fill_value=0).astype("int64")
+    else:
+        success_by_education = pd.DataFrame()
+    success_by_education = success_by_education.rename_axis(index="education", columns="success")
+
+    return {
+        "rows": rows,
+        "avg_satisfaction": mean("exit.satisfaction"),
+        "avg_difficulty": mean("exit.difficulty"),
+        "avg_confidence": mean("exit.confidence"),
+        "avg_task_duration": {task: mean("task.duration", task) for task in tasks},
+        # Median, p90 and p99 duration per task (within sketch.RELATIVE_ACCURACY)
+        # and the number of timed rows, then duration histogram bins x tasks
+        "task_duration_quantiles": quantiles,
+        "task_duration_histograms": histograms,
+        "gender_counts": counts("demographics.gender", "gender"),
+        "age_counts": counts("demographics.age", "age"),
+        "education_counts": counts("demographics.education", "education"),
+        "familiarity_counts": counts("demographics.familiarity", "familiarity"),
+        "task_success_counts": counts("tasks.success", "success"),
+        "task_summary": summary,
+        "avg_difficulty_by_age": means("difficulty_by_age", "age", "difficulty"),
+        "avg_confidence_by_gender": means("confidence_by_gender", "gender", "confidence"),
+        "success_by_education": success_by_education,
+        # Mean, low and high bounds of the bootstrap interval (see bootstrap.py)
+        # and n, per exit metric, task and demographic group
+        "exit_intervals": exit_intervals,
+        "success_rate_intervals": intervals("task.success_values", scale=100,
+                                            score=lambda success: SUCCESS_SCORES.get(success, 0.0)),
+        "difficulty_by_age_intervals": intervals("difficulty_by_age.values").rename_axis("age"),
+        "confidence_by_gender_intervals": intervals("confidence_by_gender.values").rename_axis("gender"),
+    }
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a is b
+    return a[1] == b[1] and math.isclose(a[0], b[0], rel_tol=1e-9, abs_tol=1e-9)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_aggregate_store():
+    # The first use builds the store from whatever data already exists
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = AggregateStore()
+                if not store.is_built():
+                    store.rebuild()
+                _store = store
+    return _store
+
+
+def report_to_json(report_data):
+    # report_data() as plain JSON values. Series and frames keep their dtypes
+    # and index and column names, so report_from_json() gives back the same
+    # objects the report was drawn from.
+    if isinstance(report_data, pd.DataFrame):
+        return {"frame": {"index": _index_to_json(report_data.index),
+                          "columns": _index_to_json(report_data.columns),
+                          "dtypes": [str(dtype) for dtype in report_data.dtypes],
+                          "data": [report_data.iloc[:, i].tolist() for i in range(report_data.shape[1])]}}
+    if isinstance(report_data, pd.Series):
+        return {"series": {"index": _index_to_json(report_data.index), "name": report_data.name,
+                           "dtype": str(report_data.dtype), "values": report_data.tolist()}}
+    if isinstance(report_data, dict):
+        return {"dict": {str(key): report_to_json(value) for key, value in report_data.items()}}
+    return report_data.item() if hasattr(report_data, "item") else report_data
+
+
+def report_from_json(value):
+    if not isinstance(value, dict):
+        return value
+    if "frame" in value:
+        frame = value["frame"]
+        data = {i: pd.Series(values, dtype=dtype) for i, (values, dtype) in
+                enumerate(zip(frame["data"], frame["dtypes"]))}
+        result = pd.DataFrame(data, index=pd.RangeIndex(len(frame["index"]["values"])))
+        result.index = _index_from_json(frame["index"])
+        result.columns = _index_from_json(frame["columns"])
+        return result
+    if "series" in value:
+        series = value["series"]
+        return pd.Series(series["values"], index=_index_from_json(series["index"]), name=series["name"],
+                         dtype=series["dtype"])
+    return {key: report_from_json(item) for key, item in value["dict"].items()}
+
+
+def _index_to_json(index):
+    return {"values": index.tolist(), "dtype": str(index.dtype), "name": index.name}
+
+
+def _index_from_json(index):
+    return pd.Index(index["values"], dtype=index["dtype"], name=index["name"])
@@ -0,0 +1,304 @@
+import html
+import io
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import bootstrap
+import sketch
+from aggregates import TABLE_KEYS, EXIT_METRICS, DEMOGRAPHIC_COUNTS, value_key
+from storage import CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, SUCCESS_SCORES
+
+# Columns each table contributes to the report; free-text columns are never parsed
+REPORT_COLUMNS = {
+    CONSENT_CSV: ["participant_id"],
+    DEMOGRAPHIC_CSV: ["participant_id"] + DEMOGRAPHIC_COUNTS,
+    TASKS_CSV: ["participant_id", "task_name", "success", "duration_seconds"],
+    EXIT_CSV: ["participant_id"] + EXIT_METRICS,
+}
+
+# Read size of one chunk handed to a worker
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def read_blocks(path, chunk_bytes=CHUNK_BYTES):
+    # Yield the header line, then blocks of whole CSV records of about
+    # chunk_bytes each. A block only ends on a newline outside quotes, so an
+    # answer containing line breaks is never split between two blocks.
+    with open(path, "rb") as f:
+        yield f.readline()
+        carry = b""
+        while True:
+            data = f.read(chunk_bytes)
+            block = carry + data
+            if not data:
+                if block.strip():
+                    yield block
+                return
+            end = block.rfind(b"\n")
+            while end != -1 and block.count(b'"', 0, end) % 2:
+                end = block.rfind(b"\n", 0, end)
+            if end == -1:
+                carry = block
+                continue
+            yield block[:end + 1]
+            carry = block[end + 1:]
+
+
+def _parse(header, block, columns):
+    wanted = set(columns)
+    frame = pd.read_csv(io.BytesIO(header + block), usecols=lambda column: column in wanted, dtype=str)
+    for column in columns:
+        if column not in frame:
+            frame[column] = None
+    return frame
+
+
+def _add(counters, metric, grp, sub="", total=0.0, n=1):
+    old_total, old_n = counters.get((metric, grp, sub), (0.0, 0))
+    counters[(metric, grp, sub)] = (old_total + total, old_n + n)
+
+
+def _add_counts(counters, metric, series):
+    for grp, n in series.value_counts().items():
+        _add(counters, metric, str(grp), n=int(n))
+
+
+def _add_sums(counters, metric, groups, values):
+    # Sum and count of values per group, skipping rows missing either
+    keep = groups.notna() & values.notna()
+    sums = values[keep].groupby(groups[keep].astype(str)).agg(["sum", "count"])
+    for grp, total, n in sums.itertuples():
+        _add(counters, metric, grp, total=float(total), n=int(n))
+
+
+def _add_pairs(counters, metric, groups, subs):
+    # Count of every (group, sub) pair, skipping rows missing either
+    keep = groups.notna() & subs.notna()
+    for (grp, sub), n in subs[keep].groupby([groups[keep].astype(str), subs[keep]]).size().items():
+        _add(counters, metric, grp, sub, n=int(n))
+
+
+def _value_keys(values):
+    return values.map(value_key, na_action="ignore")
+
+
+def _number(series):
+    return pd.to_numeric(series, errors="coerce")
+
+
+# Latest demographic answers per participant, set in every worker process
+_demographics = None
+
+
+def _init_worker(demographics):
+    global _demographics
+    _demographics = demographics
+
+
+def _paired(frame):
+    # The participant's age, gender and education next to every row
+    return _demographics.reindex(frame["participant_id"]).reset_index(drop=True)
+
+
+def _count_chunk(csv_file, header, block):
+    return _count_frame(csv_file, _parse(header, block, REPORT_COLUMNS[csv_file]))
+
+
+def _read_archive(path, columns):
+    # A compacted (Parquet) partition, shaped like a parsed block
+    frame = pd.read_parquet(path).reindex(columns=columns)
+    return frame.astype(object).where(frame.notna(), None)
+
+
+def _count_archive(csv_file, path):
+    return _count_frame(csv_file, _read_archive(path, REPORT_COLUMNS[csv_file]))
+
+
+def _count_frame(csv_file, frame):
+    # Counters for one block of records, with the same keys and meaning as
+    # AggregateStore.apply() gives them
+    counters = {("rows", TABLE_KEYS[csv_file], ""): (0.0, len(frame))}
+    if csv_file == DEMOGRAPHIC_CSV:
+        for column in DEMOGRAPHIC_COUNTS:
+            _add_counts(counters, "demographics." + column, frame[column])
+    elif csv_file == EXIT_CSV:
+        demo = _paired(frame)
+        for column in EXIT_METRICS:
+            values = _number(frame[column]).dropna()
+            if len(values):
+                _add(counters, "exit." + column, "", total=float(values.sum()), n=len(values))
+            for sub, n in _value_keys(values).value_counts().items():
+                _add(counters, "exit." + column + ".values", "", sub, n=int(n))
+        difficulty, confidence = _number(frame["difficulty"]), _number(frame["confidence"])
+        _add_sums(counters, "difficulty_by_age", demo["age"], difficulty)
+        _add_pairs(counters, "difficulty_by_age.values", demo["age"], _value_keys(difficulty))
+        _add_sums(counters, "confidence_by_gender", demo["gender"], confidence)
+        _add_pairs(counters, "confidence_by_gender.values", demo["gender"], _value_keys(confidence))
+    elif csv_file == TASKS_CSV:
+        task, success = frame["task_name"], frame["success"]
+        _add_counts(counters, "tasks.success", success)
+        # Success rate divides by every row of the task, answered or not
+        _add_sums(counters, "task.success_score", task, success.map(SUCCESS_SCORES).fillna(0.0))
+        _add_counts(counters, "task.answers", task[success.notna()])
+        _add_pairs(counters, "task.success_values", task, success.fillna(""))
+        duration = _number(frame["duration_seconds"])
+        _add_sums(counters, "task.duration", task, duration)
+        _add_pairs(counters, "task.duration_sketch", task, sketch.bucket_keys(duration))
+        _add_pairs(counters, "success_by_education", _paired(frame)["education"], success)
+    return counters
+
+
+def _merge(counters, partial):
+    for key, (total, n) in partial.items():
+        _add(counters, *key, total=total, n=n)
+
+
+def _tasks(csv_file, path, chunk_bytes):
+    # (function, arguments) of the jobs that count one file: one per block of
+    # a CSV, one for a whole Parquet archive (already compressed and columnar)
+    if path.endswith(".parquet"):
+        yield _count_archive, (csv_file, path)
+        return
+    blocks = read_blocks(path, chunk_bytes)
+    header = next(blocks)
+    for block in blocks:
+        yield _count_chunk, (csv_file, header, block)
+
+
+def _load_demographics(paths, chunk_bytes):
+    # participant_id -> latest (age, gender, education); one row per
+    # participant, so this stays small next to the task table
+    columns = ["participant_id", "age", "gender", "education"]
+    latest = []
+    for path in paths:
+        if path.endswith(".parquet"):
+            latest.append(_read_archive(path, columns).dropna(subset=["participant_id"]))
+            continue
+        blocks = read_blocks(path, chunk_bytes)
+        header = next(blocks, b"")
+        for block in blocks:
+            latest.append(_parse(header, block, columns).dropna(subset=["participant_id"]))
+    if not latest:
+        return pd.DataFrame(columns=["age", "gender", "education"], index=pd.Index([], name="participant_id"))
+    frame = pd.concat(latest, ignore_index=True).drop_duplicates("participant_id", keep="last")
+    return frame.set_index("participant_id")
+
+
+def aggregate_tables(paths=None, workers=None, chunk_bytes=CHUNK_BYTES):
+    # Build the report counters from the CSV files without loading any of them
+    # whole: each file is read a block at a time and the blocks are counted in
+    # a pool of worker processes. At most two blocks per worker are in flight,
+    # so memory stays bounded by the block size, not the number of rows.
+    # paths maps each table (CONSENT_CSV, ...) to the file to read, or to a
+    # list of files (the table's partitions, CSV or Parquet).
+    paths = paths or {csv_file: csv_file for csv_file in TABLE_KEYS}
+    paths = {csv_file: [path] if isinstance(path, str) else list(path) for csv_file, path in paths.items()}
+    paths = {csv_file: [path for path in files if os.path.exists(path)] for csv_file, files in paths.items()}
+    workers = workers or os.cpu_count() or 1
+    demographics = _load_demographics(paths.get(DEMOGRAPHIC_CSV, []), chunk_bytes)
+
+    counters = {("rows", table, ""): (0.0, 0) for table in TABLE_KEYS.values()}
+    tasks = (task for csv_file, files in paths.items() for path in files
+             for task in _tasks(csv_file, path, chunk_bytes))
+    if workers == 1:
+        _init_worker(demographics)
+        for function, arguments in tasks:
+            _merge(counters, function(*arguments))
+        return counters
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(demographics,)) as pool:
+        in_flight = deque()
+        for function, arguments in tasks:
+            if len(in_flight) >= 2 * workers:
+                _merge(counters, in_flight.popleft().result())
+            in_flight.append(pool.submit(function, *arguments))
+        while in_flight:
+            _merge(counters, in_flight.popleft().result())
+    return counters
+
+
+def _json_value(value):
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient="split"))
+    if isinstance(value, pd.Series):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def write_report(report_data, out_dir, formats=("html", "json")):
+    # Write the report as report.json and/or a self-contained report.html
+    # (charts load plotly.js from its CDN). Returns the paths written.
+    os.makedirs(out_dir, exist_ok=True)
+    generated = time.strftime("%Y-%m-%d %H:%M:%S")
+    written = []
+    if "json" in formats:
+        path = os.path.join(out_dir, "report.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"generated": generated, **_json_value(report_data)}, f, indent=2)
+        written.append(path)
+    if "html" in formats:
+        path = os.path.join(out_dir, "report.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_html(report_data, generated))
+        written.append(path)
+    return written
+
+
+def render_html(report_data, generated):
+    from charts import report_figures
+
+    def average(value, unit=""):
+        return "n/a" if math.isnan(value) else f"{value:.2f}{unit}"
+
+    rows = report_data["rows"]
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Usability Report</title></head><body>",
+        "<h1>Usability Report - Aggregated Results</h1>",
+        f"<p>Generated {html.escape(generated)} from {rows['consent']} consent, {rows['demographics']} "
+        f"demographic, {rows['tasks']} task and {rows['exit']} exit questionnaire record(s).</p>",
+        "<h2>Exit Questionnaire Averages</h2><ul>",
+    ]
+    intervals = report_data["exit_intervals"]
+    for metric in EXIT_METRICS:
+        text = average(report_data["avg_" + metric])
+        if metric in intervals.index:
+            text += (f" ({bootstrap.CONFIDENCE_LEVEL:.0%} CI {intervals.loc[metric, 'low']:.2f}"
+                     f"-{intervals.loc[metric, 'high']:.2f})")
+        parts.append(f"<li><b>Average {metric.title()}</b>: {text}</li>")
+    for task, duration in report_data["avg_task_duration"].items():
+        parts.append(f"<li><b>Average Task Duration - {html.escape(task)}</b>: "
+                     f"{average(duration, ' Second(s)')}</li>")
+    parts.append("</ul>")
+
+    summary = report_data["task_summary"].copy()
+    summary.columns = ["Task", "Success Rate (%)", "Avg. Completion Time (sec)", "Participants"]
+    success_intervals = report_data["success_rate_intervals"].reindex(summary["Task"])
+    summary.insert(2, "CI Low (%)", success_intervals["low"].to_numpy())
+    summary.insert(3, "CI High (%)", success_intervals["high"].to_numpy())
+    parts.append("<h2>Task Success Rates and Average Completion Times</h2>")
+    parts.append(summary.to_html(index=False, float_format="{:.1f}".format, na_rep="n/a"))
+
+    quantiles = report_data["task_duration_quantiles"].reset_index()
+    quantiles.columns = ["Task", "Median (sec)", "90th Percentile (sec)", "99th Percentile (sec)", "Timed Attempts"]
+    parts.append("<h2>Task Completion Time Percentiles</h2>")
+    parts.append(f"<p>Accurate to within {sketch.RELATIVE_ACCURACY:.0%} of the exact value.</p>")
+    parts.append(quantiles.to_html(index=False, float_format="{:.1f}".format, na_rep="n/a"))
+
+    if rows["exit"]:
+        parts.append("<h2>Charts</h2>")
+        for number, figure in enumerate(report_figures(report_data).values()):
+            parts.append(figure.to_html(full_html=False, include_plotlyjs="cdn" if number == 0 else False))
+    parts.append("</body></html>")
+    return "\n".join(parts)
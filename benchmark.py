@@ -0,0 +1,255 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import storage
+from storage import TABLE_COLUMNS, TASKS_CSV
+
+# Run in a fresh interpreter for each startup measurement: imports the app as
+# a Streamlit server process does, then (unless the mode is "import") builds
+# the first report view the way the Report tab does, either recomputed
+# ("computed") or read back from the saved snapshot ("persisted")
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import hci_project
+from lazy_imports import is_loaded
+result = {"import_seconds": time.perf_counter() - start,
+          "loaded": [name for name in ("pandas", "numpy", "plotly.express", "pyarrow") if is_loaded(name)]}
+if sys.argv[1] != "import":
+    import storage
+    start = time.perf_counter()
+    snapshot = hci_project.load_report_snapshot({}, refresh=sys.argv[1] == "computed")
+    backend = storage.get_backend()
+    for csv_file, rows in snapshot["rows"].items():
+        backend.read_page(csv_file, storage.table_columns(csv_file, free_text=False), limit=25, rows=rows)
+    result["first_report_seconds"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def _stats(seconds):
+    # Latency summary of repeated calls, in milliseconds
+    ordered = sorted(seconds)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _time(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+@contextmanager
+def _working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_benchmark(participants=10000, saves=1000, repeats=5, seed=0, workdir=None):
+    # Time the app's hot paths against a synthetic study of the given size and
+    # return the results as a JSON-serializable dict. Runs in workdir (a fresh
+    # temporary folder by default): the table paths in storage are relative to
+    # the working directory, so the real data/ folder is never touched. Run it
+    # in a fresh process, before anything has opened the real tables.
+    from synthetic import generate_study, sample_records
+
+    results = {
+        "benchmark": "usability-app",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "storage_backend": storage.STORAGE_BACKEND,
+        },
+        "parameters": {"participants": participants, "saves": saves, "repeats": repeats, "seed": seed},
+        "rows": {},
+        "stages": {},
+    }
+    stages = results["stages"]
+
+    with tempfile.TemporaryDirectory() as temporary, _working_directory(workdir or temporary):
+        seconds, written = _time(generate_study, storage.DATA_FOLDER, participants, seed=seed)
+        results["rows"] = {os.path.basename(path): rows for path, rows in written.items()}
+        stages["generate"] = {"seconds": seconds}
+
+        if storage.STORAGE_BACKEND == "sqlite":
+            from sqlite_backend import SqliteBackend
+            seconds, _ = _time(SqliteBackend(storage.SQLITE_DB).import_csvs)
+            stages["sqlite_import"] = {"seconds": seconds}
+
+        # The first save (or report) builds the aggregate store and the search
+        # index from the tables. Timed on their own, so the save timings below
+        # only cover saving.
+        from aggregates import get_aggregate_store
+        from search import get_search_index
+        seconds, _ = _time(get_aggregate_store)
+        stages["aggregates_build"] = {"seconds": seconds}
+        seconds, _ = _time(get_search_index)
+        stages["search_index_build"] = {"seconds": seconds}
+
+        stages["load_from_csv"] = _bench_loads(repeats)
+        stages["record_writer"] = _bench_writers(sample_records(TASKS_CSV, saves, seed=seed + 2))
+        stages["save_to_csv"] = _bench_saves(sample_records(TASKS_CSV, saves, seed=seed + 1))
+        # Reads right after the saves only have the appended rows to parse
+        stages["load_from_csv_after_saves"] = {
+            os.path.basename(csv_file): {"seconds": _time(storage.load_from_csv, csv_file)[0]}
+            for csv_file in TABLE_COLUMNS}
+        stages["report"] = _bench_report(repeats)
+
+        from batch_report import aggregate_tables
+        seconds, _ = _time(aggregate_tables, workers=1)
+        stages["batch_report_aggregation"] = {"seconds": seconds}
+
+        stages["startup"] = _bench_startup(repeats)
+    return results
+
+
+def _bench_loads(repeats):
+    backend = storage.get_backend()
+    loads = {}
+    for csv_file in TABLE_COLUMNS:
+        table = {}
+        for free_text in (False, True):
+            if isinstance(backend, storage.CsvBackend):
+                backend.cache.clear()
+            cold, frame = _time(storage.load_from_csv, csv_file, free_text=free_text)
+            warm = [_time(storage.load_from_csv, csv_file, free_text=free_text)[0] for _ in range(repeats)]
+            table["with_free_text" if free_text else "without_free_text"] = {
+                "cold_seconds": cold,
+                "warm": _stats(warm),
+                "memory_mb": frame.memory_usage(deep=True).sum() / 1e6,
+            }
+        loads[os.path.basename(csv_file)] = table
+    return loads
+
+
+def _bench_writers(records):
+    # Appending one record at a time to a scratch copy of the tasks table: the
+    # RecordWriter the save path uses, against the one-row DataFrame.to_csv
+    # it replaced. File writes only; no aggregate or index updates.
+    columns = TABLE_COLUMNS[TASKS_CSV]
+    writer = storage.RecordWriter()
+    timings = {}
+    for name in ("dataframe_to_csv", "record_writer"):
+        path = os.path.join(storage.DATA_FOLDER, f"bench_{name}.csv")
+        timings[name] = []
+        for record in records:
+            start = time.perf_counter()
+            if name == "dataframe_to_csv":
+                pd.DataFrame([record], columns=columns).to_csv(path, mode="a", header=not os.path.exists(path),
+                                                               index=False)
+            else:
+                writer.write_many(path, [record], table=TASKS_CSV)
+            timings[name].append(time.perf_counter() - start)
+        os.remove(path)
+    results = {name: _stats(seconds) for name, seconds in timings.items()}
+    results["speedup"] = results["dataframe_to_csv"]["p50_ms"] / results["record_writer"]["p50_ms"]
+    return results
+
+
+def _bench_saves(records):
+    # Write-behind: how long the script thread waits per save, then how long
+    # until everything is on disk (with the aggregate and index updates)
+    results = {}
+    half = len(records) // 2
+    start = time.perf_counter()
+    submit = [_time(storage.save_to_csv, record, TASKS_CSV)[0] for record in records[:half]]
+    storage.flush_writes()
+    total = time.perf_counter() - start
+    results["write_behind"] = {"submit": _stats(submit), "records_per_second": half / total}
+
+    # Synchronous: the full write path on the calling thread
+    write_behind, storage.WRITE_BEHIND = storage.WRITE_BEHIND, False
+    try:
+        start = time.perf_counter()
+        synchronous = [_time(storage.save_to_csv, record, TASKS_CSV)[0] for record in records[half:]]
+        total = time.perf_counter() - start
+    finally:
+        storage.WRITE_BEHIND = write_behind
+    results["synchronous"] = {"save": _stats(synchronous),
+                              "records_per_second": (len(records) - half) / total}
+    return results
+
+
+def _bench_report(repeats):
+    # The Report tab's work, stage by stage: the snapshot (row counts and the
+    # aggregates), the charts (built, then from the figure cache) and the first
+    # page of every raw table
+    from aggregates import get_aggregate_store
+    from charts import report_figures, _figure_cache
+
+    backend = storage.get_backend()
+    report = {}
+    end_to_end = []
+    for attempt in range(repeats):
+        if isinstance(backend, storage.CsvBackend):
+            backend.cache.clear()
+        _figure_cache.clear()
+        stage = {}
+        stage["row_counts"], rows = _time(lambda: {csv_file: backend.count(csv_file) for csv_file in TABLE_COLUMNS})
+        stage["report_data"], report_data = _time(get_aggregate_store().report_data)
+        stage["figures_built"], _ = _time(report_figures, report_data)
+        stage["figures_cached"], _ = _time(report_figures, report_data)
+        stage["first_pages"], _ = _time(lambda: [
+            backend.read_page(csv_file, storage.table_columns(csv_file, free_text=False), limit=25,
+                              rows=rows[csv_file]) for csv_file in TABLE_COLUMNS])
+        end_to_end.append(stage["row_counts"] + stage["report_data"] + stage["figures_built"]
+                          + stage["first_pages"])
+        for name, seconds in stage.items():
+            report.setdefault(name, []).append(seconds)
+    report = {name: _stats(seconds) for name, seconds in report.items()}
+    report["end_to_end"] = _stats(end_to_end)
+    return report
+
+
+def _bench_startup(repeats):
+    # Cold starts, each in a new process on the study in the working folder:
+    # importing the app (and which heavy modules that loaded), then the first
+    # Report tab view with the report recomputed, and read back from the
+    # snapshot the recomputed runs saved
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))] + os.environ.get("PYTHONPATH", "").split(os.pathsep)))
+
+    def runs(mode):
+        results = []
+        for attempt in range(repeats):
+            finished = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, mode], env=env, capture_output=True,
+                                      text=True, check=True)
+            results.append(json.loads(finished.stdout.strip().splitlines()[-1]))
+        return results
+
+    imports = runs("import")
+    return {
+        "app_import": {**_stats([run["import_seconds"] for run in imports]), "modules_loaded": imports[-1]["loaded"]},
+        "first_report_computed": _stats([run["first_report_seconds"] for run in runs("computed")]),
+        "first_report_persisted": _stats([run["first_report_seconds"] for run in runs("persisted")]),
+    }
+
+
+def write_results(results, path=None):
+    text = json.dumps(results, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    sys.stdout.write(text + "\n")
@@ -0,0 +1,40 @@
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Percentile bootstrap intervals for the report's averages and rates.
+#
+# Every metric the report averages takes a handful of distinct values (0-5
+# slider answers, success scores), so a group's answers are fully described by
+# how many times each value was given. Resampling n answers with replacement
+# is then the same as drawing the value counts from a multinomial with the
+# observed proportions, which lets every resample of every group be drawn in
+# one NumPy call (a resamples x groups x values matrix) straight from the
+# aggregate counters, without reading the raw rows.
+RESAMPLES = 2000
+CONFIDENCE_LEVEL = 0.95
+
+# Fixed, so the intervals (and the charts drawn from them) do not move between
+# refreshes when the data has not changed
+SEED = 0
+
+
+def bootstrap_means(distributions, resamples=RESAMPLES, level=CONFIDENCE_LEVEL, seed=SEED):
+    # distributions maps each group to {value: count}. Returns a frame indexed
+    # by group with the observed mean, the bounds of its interval and n; groups
+    # without answers are left out.
+    columns = ["mean", "low", "high", "n"]
+    groups = [group for group, counts in distributions.items() if sum(counts.values())]
+    if not groups:
+        return pd.DataFrame(columns=columns, dtype="float64")
+    values = np.array(sorted({value for group in groups for value in distributions[group]}), dtype="float64")
+    counts = np.array([[distributions[group].get(value, 0) for value in values] for group in groups],
+                      dtype="int64")
+    n = counts.sum(axis=1)
+    rng = np.random.default_rng(seed)
+    samples = rng.multinomial(n, counts / n[:, None], size=(resamples, len(groups)))
+    means = samples @ values / n
+    low, high = np.quantile(means, [(1 - level) / 2, (1 + level) / 2], axis=0)
+    return pd.DataFrame({"mean": counts @ values / n, "low": low, "high": high, "n": n},
+                        index=pd.Index(groups), columns=columns)
@@ -0,0 +1,128 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+
+from metrics import timed
+from storage import AGE_OPTIONS, EDUCATION_OPTIONS
+
+
+class FigureCache:
+    # Built Plotly figures keyed on a fingerprint of the data each chart is drawn
+    # from plus its options. While a series is unchanged every render gets the
+    # same figure object back; when it changes only that chart is rebuilt.
+    # Cached figures are shared between sessions, so they must not be modified
+    # after they are built. Least recently used entries are evicted.
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            figure = self._figures.get(key)
+            if figure is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return figure
+        figure = build()
+        with self._lock:
+            self.misses += 1
+            self._figures[key] = figure
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return figure
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "figures": len(self._figures)}
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self.hits = self.misses = 0
+
+
+def fingerprint(kind, data, **options):
+    # Chart data is aggregated (a handful of rows), so hashing its repr is both
+    # exact and much cheaper than pd.util.hash_pandas_object
+    if isinstance(data, pd.DataFrame):
+        shape = (list(data.columns), data.columns.name)
+    else:
+        shape = data.name
+    key = (kind, sorted(options.items()), data.index.name, shape, data.index.tolist(), data.values.tolist())
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+_figure_cache = FigureCache()
+
+
+def pie_chart(series, title):
+    with timed("chart_build", title):
+        return _figure_cache.get_or_build(
+            fingerprint("pie", series, title=title),
+            lambda: px.pie(series, names=series.index, values=series.values, title=title))
+
+
+def bar_chart(data, title, labels, barmode="relative", showlegend=True, intervals=None):
+    # intervals (a frame with "low" and "high" columns, aligned with a series
+    # of bar heights) draws each bar's confidence interval as an error bar
+    def build():
+        figure = px.bar(data, labels=labels, title=title, barmode=barmode)
+        if intervals is not None:
+            figure.update_traces(error_y={"type": "data", "symmetric": False,
+                                          "array": (intervals["high"] - data).tolist(),
+                                          "arrayminus": (data - intervals["low"]).tolist()})
+        if not showlegend:
+            figure.update_layout(showlegend=False)
+        return figure
+
+    bounds = None if intervals is None else intervals[["low", "high"]].values.tolist()
+    with timed("chart_build", title):
+        return _figure_cache.get_or_build(
+            fingerprint("bar", data, title=title, labels=labels, barmode=barmode, showlegend=showlegend,
+                        intervals=bounds), build)
+
+
+def report_figures(report_data):
+    # Every chart of the usability report, built from the aggregates returned by
+    # report_from_counters(). Shared by the Report tab and 'manage.py report'.
+    return {
+        "gender": pie_chart(report_data["gender_counts"], 'Gender Distribution'),
+        "age": pie_chart(report_data["age_counts"].reindex(AGE_OPTIONS), 'Age Distribution'),
+        "education": pie_chart(report_data["education_counts"].reindex(EDUCATION_OPTIONS),
+                               'Education Level Distribution'),
+        "familiarity": pie_chart(report_data["familiarity_counts"], 'Familiarity Distribution'),
+        "task_success": pie_chart(report_data["task_success_counts"], 'Task Success Distribution'),
+        "success_by_education": bar_chart(report_data["success_by_education"].reindex(EDUCATION_OPTIONS),
+                                          labels={'value':'Count', 'education': 'Education Level'},
+                                          title="Task Success by Education Level",
+                                          barmode="group"),
+        "duration_histogram": bar_chart(report_data["task_duration_histograms"],
+                                        labels={'value': 'Tasks', 'duration': 'Completion Time',
+                                                'variable': 'Task'},
+                                        title="Task Completion Time Distribution",
+                                        barmode="group"),
+        "difficulty_by_age": bar_chart(report_data["avg_difficulty_by_age"].reindex(AGE_OPTIONS),
+                                       labels={'value':'Average Difficulty (0 = Not Difficult, 5 = Very Difficult',
+                                               'age': 'Age Range'},
+                                       title="Average Difficulty by Age",
+                                       showlegend=False,
+                                       intervals=report_data["difficulty_by_age_intervals"].reindex(AGE_OPTIONS)),
+        "confidence_by_gender": bar_chart(report_data["avg_confidence_by_gender"],
+                                          labels={'value':'Average Confidence (0 = Not Confident, 5 = Very Confident',
+                                                  'gender': 'Gender'},
+                                          title="Average Confidence by Gender",
+                                          showlegend=False,
+                                          intervals=report_data["confidence_by_gender_intervals"].reindex(
+                                              report_data["avg_confidence_by_gender"].index)),
+    }
+
+
+def figure_cache_stats():
+    return _figure_cache.stats()
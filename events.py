@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+
+from lazy_imports import lazy_import
+from storage import DATA_FOLDER, file_lock
+from write_queue import WriteBehindQueue
+
+pd = lazy_import("pandas")
+
+# Line-delimited JSON, one interaction per line:
+# {"ts": 1736153012.481, "pid": "<participant ID>", "event": "timer_start", "task": "..."}
+EVENTS_FILE = os.path.join(DATA_FOLDER, "events.jsonl")
+
+# Interactions recorded: task_selected, timer_start, timer_stop, field_edit
+# (with the field's name, never its text) and task_saved
+LOG_EVENTS = True
+
+
+def _write_events(path, events):
+    data = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+    with open(path, "a", encoding="utf-8") as f, file_lock(f):
+        f.write(data)
+
+
+# Events go to disk from a background thread in batches. A full queue drops
+# the event instead of making the participant wait: the log is diagnostic,
+# the form data is what must not be lost.
+_event_queue = WriteBehindQueue(_write_events, max_size=10000, batch_size=1000, put_timeout=0)
+_discarded = 0
+_discarded_lock = threading.Lock()
+
+
+def log_event(participant_id, event, **fields):
+    # Stamped with the wall-clock time the interaction reached the server
+    if not LOG_EVENTS:
+        return
+    record = {"ts": round(time.time(), 3), "pid": participant_id, "event": event}
+    record.update(fields)
+    if not _event_queue.submit(EVENTS_FILE, record):
+        global _discarded
+        # Sessions log from their own script threads
+        with _discarded_lock:
+            _discarded += 1
+
+
+def flush_events(timeout=None):
+    return _event_queue.flush(timeout)
+
+
+def event_log_stats():
+    stats = _event_queue.stats()
+    stats["discarded"] = _discarded
+    return stats
+
+
+def read_events(path=EVENTS_FILE):
+    try:
+        events = pd.read_json(path, lines=True, dtype={"pid": str, "task": str, "field": str})
+    except (FileNotFoundError, ValueError):
+        events = pd.DataFrame()
+    for column in ("ts", "pid", "event", "task", "field"):
+        if column not in events:
+            events[column] = pd.Series(dtype="float64" if column == "ts" else "object")
+    return events
+
+
+def task_timings(events):
+    # One row per attempt at a task (everything a participant did on a task up
+    # to and including saving it) with the times derived from the event log:
+    #   timer_seconds          timer start to stop, as the form records it
+    #   start_to_save_seconds  timer start (or first interaction) to save, also
+    #                          available when Stop was never pressed
+    #   <field>_seconds        from the timer start to the last edit of each
+    #                          answer, i.e. roughly when that step was done
+    # Attempts that were never saved are kept, with saved_at empty.
+    events = events.dropna(subset=["pid", "task", "ts"]).sort_values("ts", kind="stable")
+    if events.empty:
+        return pd.DataFrame(columns=["pid", "task", "attempt", "first_at", "started_at", "stopped_at",
+                                     "saved_at", "timer_seconds", "start_to_save_seconds"])
+    saved = events["event"].eq("task_saved")
+    # Events after a save start the participant's next attempt at that task
+    events = events.assign(attempt=saved.groupby([events["pid"], events["task"]]).cumsum() - saved)
+    keys = ["pid", "task", "attempt"]
+
+    def last(event):
+        rows = events[events["event"] == event]
+        return rows.groupby(keys)["ts"].max()
+
+    timings = pd.DataFrame({
+        "first_at": events.groupby(keys)["ts"].min(),
+        "started_at": last("timer_start"),
+        "stopped_at": last("timer_stop"),
+        "saved_at": last("task_saved"),
+    })
+    start = timings["started_at"].fillna(timings["first_at"])
+    timings["timer_seconds"] = (timings["stopped_at"] - timings["started_at"]).where(
+        timings["stopped_at"] >= timings["started_at"])
+    timings["start_to_save_seconds"] = timings["saved_at"] - start
+
+    edits = events[events["event"] == "field_edit"].dropna(subset=["field"])
+    if not edits.empty:
+        last_edit = edits.groupby(keys + ["field"])["ts"].max().unstack("field")
+        steps = last_edit.sub(start.reindex(last_edit.index), axis=0).add_suffix("_seconds")
+        timings = timings.join(steps)
+    for column in ("first_at", "started_at", "stopped_at", "saved_at"):
+        timings[column] = pd.to_datetime(timings[column], unit="s")
+    return timings.reset_index()
@@ -0,0 +1,158 @@
+import datetime
+import importlib.util
+import io
+import json
+import os
+import secrets
+import zipfile
+
+import pandas as pd
+
+from metrics import timed
+from storage import CHUNK_ROWS, DATA_FOLDER, FREE_TEXT_COLUMNS, TABLE_COLUMNS, _compact, get_backend
+
+# Bundles prepared from the Report tab
+EXPORT_FOLDER = os.path.join(DATA_FOLDER, "exports")
+
+# "csv": one CSV per table in a deflated zip, readable anywhere.
+# "parquet": one zstd-compressed Parquet file per table in a zip, typed and
+# much faster to load back; needs pyarrow.
+EXPORT_FORMATS = ["csv", "parquet"]
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+PARQUET_COMPRESSION = "zstd"
+
+# Describes the bundle: when it was made, with which filters, and the file,
+# columns and row count of every table in it
+BUNDLE_MANIFEST = "export.json"
+
+# Exported as numbers; every other column is exported as text, as it was saved
+NUMERIC_COLUMNS = {"duration_seconds", "satisfaction", "difficulty", "confidence"}
+
+
+def table_name(csv_file):
+    # "tasks_data" for data/tasks_data.csv: the table's name inside a bundle
+    return os.path.splitext(os.path.basename(csv_file))[0]
+
+
+def export_path(file_format, folder=EXPORT_FOLDER):
+    # A new name for every export, so two prepared at once never collide
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(folder, f"study_export_{stamp}-{secrets.token_hex(3)}_{file_format}.zip")
+
+
+def _columns(csv_file, free_text, backend):
+    columns = [column for column in TABLE_COLUMNS[csv_file] if free_text or column not in FREE_TEXT_COLUMNS]
+    # Partitioned data can span several studies; keep track of which is which
+    if hasattr(backend, "manifest"):
+        columns.append("study")
+    return columns
+
+
+def _shape(chunk, columns):
+    # The same columns and types in every chunk, whichever backend it came
+    # from, so all the chunks of a table can go into one file
+    chunk = chunk.reindex(columns=columns)
+    for column in columns:
+        values = chunk[column]
+        if column in NUMERIC_COLUMNS:
+            chunk[column] = pd.to_numeric(values, errors="coerce").astype("float64")
+        else:
+            chunk[column] = values.astype(object).astype(str).where(values.notna(), None)
+    return chunk
+
+
+def _write_csv(f, chunks, columns):
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    rows = 0
+    pd.DataFrame(columns=columns).to_csv(text, index=False)
+    for chunk in chunks:
+        # %.15g writes whole numbers without a trailing ".0" and keeps every
+        # digit a duration was saved with
+        _shape(chunk, columns).to_csv(text, header=False, index=False, float_format="%.15g")
+        rows += len(chunk)
+    text.flush()
+    text.detach()
+    return rows
+
+
+def _write_parquet(f, chunks, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.float64() if column in NUMERIC_COLUMNS else pa.string())
+                        for column in columns])
+    rows = 0
+    with pq.ParquetWriter(f, schema, compression=PARQUET_COMPRESSION) as writer:
+        for chunk in chunks:
+            # Each chunk becomes one row group, so reading back is streamed too
+            writer.write_table(pa.Table.from_pandas(_shape(chunk, columns), schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+
+def export_tables(out, file_format="csv", tables=None, free_text=True, rows=CHUNK_ROWS, backend=None, **scope):
+    # Stream the study tables into one zip bundle at out. Each table is read
+    # from the storage backend rows records at a time and every chunk is
+    # written out before the next is read, so memory stays bounded by the chunk
+    # size however large the tables are. tables limits the export to some
+    # tables (all four by default), free_text=False leaves the typed answers
+    # out, and scope (start and end days, and studies of partitioned data)
+    # narrows the records. Returns the rows written per table.
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {file_format!r}; expected one of {EXPORT_FORMATS}")
+    if file_format == "parquet" and not PARQUET_AVAILABLE:
+        raise RuntimeError("Exporting Parquet needs pyarrow (pip install pyarrow)")
+    backend = backend or get_backend()
+    tables = tables or list(TABLE_COLUMNS)
+    folder = os.path.dirname(out)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    manifest = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "format": file_format,
+        "filters": {**scope, "free_text": free_text},
+        "tables": {},
+    }
+    written = {}
+    # Built under a temporary name, so an interrupted export never leaves a
+    # truncated bundle behind under the real one
+    temporary = out + ".tmp"
+    try:
+        with timed("export", file_format), zipfile.ZipFile(temporary, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for csv_file in tables:
+                columns = _columns(csv_file, free_text, backend)
+                name = f"{table_name(csv_file)}.{file_format}"
+                entry = zipfile.ZipInfo(name, datetime.datetime.now().timetuple()[:6])
+                # Parquet pages are compressed already, so they are stored as they are
+                entry.compress_type = zipfile.ZIP_DEFLATED if file_format == "csv" else zipfile.ZIP_STORED
+                write = _write_csv if file_format == "csv" else _write_parquet
+                with bundle.open(entry, "w", force_zip64=True) as f:
+                    written[csv_file] = write(f, backend.chunks(csv_file, rows, **scope), columns)
+                manifest["tables"][table_name(csv_file)] = {"file": name, "rows": written[csv_file],
+                                                            "columns": columns}
+            bundle.writestr(BUNDLE_MANIFEST, json.dumps(manifest, indent=2))
+        os.replace(temporary, out)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return written
+
+
+def load_bundle(path):
+    # Read an export back as {table name: DataFrame}, with the answers from a
+    # fixed list as categoricals like the app's own tables
+    frames = {}
+    with zipfile.ZipFile(path) as bundle:
+        manifest = json.loads(bundle.read(BUNDLE_MANIFEST))
+        for table, entry in manifest["tables"].items():
+            with bundle.open(entry["file"]) as f:
+                if manifest["format"] == "parquet":
+                    frame = pd.read_parquet(f)
+                else:
+                    frame = pd.read_csv(f, dtype={column: "float64" if column in NUMERIC_COLUMNS else str
+                                                  for column in entry["columns"]},
+                                        engine="pyarrow" if PARQUET_AVAILABLE else "c")
+            frames[table] = _compact(frame)
+    return frames
@@ -1,44 +1,105 @@
 import streamlit as st
-import pandas as pd
 import time
+import datetime
 import os
 import csv
-import plotly.express as px
-
-# Create a folder called data in the main project folder
-DATA_FOLDER = "data"
-if not os.path.exists(DATA_FOLDER):
-    os.makedirs(DATA_FOLDER)
-
-# Define CSV file paths for each part of the usability testing
-CONSENT_CSV = os.path.join(DATA_FOLDER, "consent_data.csv")
-DEMOGRAPHIC_CSV = os.path.join(DATA_FOLDER, "demographic_data.csv")
-TASKS_CSV = os.path.join(DATA_FOLDER, "tasks_data.csv")
-EXIT_CSV = os.path.join(DATA_FOLDER, "exit_data.csv")
-
-def save_to_csv(data_dict, csv_file):
-    # Convert dict to DataFrame with a single row
-    df_new = pd.DataFrame([data_dict])
-    if not os.path.isfile(csv_file):
-        # If CSV doesn't exist, write with headers
-        df_new.to_csv(csv_file, mode='w', header=True, index=False)
-    else:
-        # Else, we need to append without writing the header!
-        df_new.to_csv(csv_file, mode='a', header=False, index=False)
-
-def load_from_csv(csv_file):
-    if os.path.isfile(csv_file):
-        return pd.read_csv(csv_file)
-    else:
-        return pd.DataFrame()
+import json
+import threading
+
+# Only what the participant-facing tabs need is imported here. pandas is
+# loaded on first use, and the report's modules (charts and plotly, the
+# aggregates, search and export) inside the Report tab, so a fresh server
+# process renders the Home tab without importing any of them.
+from lazy_imports import lazy_import
+from storage import (CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, DATA_FOLDER, STORAGE_BACKEND, AGE_OPTIONS,
+                     GENDER_OPTIONS, EDUCATION_OPTIONS, FAMILIARITY_OPTIONS, TASK_NAMES, SUCCESS_OPTIONS,
+                     TABLE_COLUMNS, FREE_TEXT_COLUMNS, save_to_csv, flush_writes, get_backend, csv_cache_stats,
+                     write_queue_stats)
+from participants import new_participant_id
+from submissions import UNCOMPARED_COLUMNS, new_submission_key, get_submission_keys
+from task_registry import get_tasks
+import metrics
+from events import log_event, event_log_stats
+from metrics import timed
+
+pd = lazy_import("pandas")
+
+TABLE_LABELS = {
+    CONSENT_CSV: "Consent Data",
+    DEMOGRAPHIC_CSV: "Demographic Data",
+    TASKS_CSV: "Task Performance Data",
+    EXIT_CSV: "Exit Questionnaire Data",
+}
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+# Free-text answers are cut to this many characters unless expanded
+TEXT_PREVIEW_CHARS = 80
+
+# Matching answers listed under the search box (the counts cover all of them)
+SEARCH_RESULTS = 200
+
+EXPORT_LABELS = {"csv": "CSV files (zip)", "parquet": "Parquet files (zip, faster to load)"}
+
+# The last full (unfiltered) report snapshot, figures included, so the first
+# Report tab view after a restart is read back instead of recomputed. Saved as
+# JSON (data only: nothing in it is executed when it is read back) and used
+# while the aggregates and the table files are unchanged since; bump the
+# version when the snapshot's contents change.
+REPORT_SNAPSHOT_FILE = os.path.join(DATA_FOLDER, "report_snapshot.json")
+REPORT_SNAPSHOT_VERSION = 2
+
+# How long the Report tab waits for queued submissions to reach the tables
+REPORT_FLUSH_TIMEOUT = 5.0
+
+def get_participant_id():
+    # Handed out when consent is given and carried into every record saved in
+    # this session, so a participant's rows can be joined across the tables
+    if "participant_id" not in st.session_state:
+        st.session_state["participant_id"] = new_participant_id()
+    return st.session_state["participant_id"]
+
+def save_submission(form, data_dict, csv_file):
+    # Save a form's record under the form's idempotency key. The key is kept in
+    # the session with the answers it was drawn for, so the same answers sent
+    # again (a double click, a rerun replaying the click) are saved once, and
+    # False is returned. Changed answers get a new key, as does a new attempt
+    # at a task (see start_task_timer). The time saved and the task duration
+    # are not compared: a repeated click saves a new time, and its duration is
+    # empty because the first save reset the timer.
+    answers = tuple(sorted((column, str(value)) for column, value in data_dict.items()
+                           if column not in UNCOMPARED_COLUMNS))
+    keys = st.session_state.setdefault("submission_keys", {})
+    if form not in keys or keys[form][0] != answers:
+        keys[form] = (answers, new_submission_key())
+    saved = save_to_csv(data_dict, csv_file, keys[form][1])
+    if saved:
+        st.session_state["submissions_saved"] = st.session_state.get("submissions_saved", 0) + 1
+    return saved
+
+def log_task_event(event, **fields):
+    log_event(get_participant_id(), event, task=st.session_state.get("selected_task"), **fields)
+
+# Widget callbacks run as soon as the interaction reaches the server, before the
+# script reruns, so the timer and the event log aren't delayed by the rerun
+def start_task_timer():
+    st.session_state["start_time"] = time.time()
+    # A new attempt: its results are saved even if the answers are the same
+    st.session_state.setdefault("submission_keys", {}).pop("task", None)
+    log_task_event("timer_start")
+
+def stop_task_timer():
+    if "start_time" in st.session_state:
+        st.session_state["task_duration"] = time.time() - st.session_state["start_time"]
+    log_task_event("timer_stop")
 
 def main():
     st.title("Usability Testing Tool")
 
     home, consent, demographics, tasks, exit_tab, report = st.tabs(
-        ["Home", "Consent", "Demographics", "Task", "Exit Questionnaire", "Report"])
+        ["Home", "Consent", "Demographics", "Task", "Exit Questionnaire", "Report"], on_change="rerun")
 
-    with home:
+    with home, timed("tab.home"):
         st.header("Introduction")
         st.write("""
         Welcome to the Usability Testing Tool for HCI.
@@ -51,7 +112,7 @@ def main():
         5. View a summary report (for demonstration purposes).
         """)
 
-    with consent:
+    with consent, timed("tab.consent"):
         st.header("Consent Form")
         st.write("""
             Before continuing, please confirm that you meet **all** the following criteria and agree to participate:
@@ -74,32 +135,31 @@ def main():
             if not consent_given:
                 st.warning("You must agree to the consent terms before proceeding.")
             else:
-                st.success("Consent Submitted.")
                 # Save the consent acceptance time
                 data_dict = {
                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "consent_given": consent_given
+                    "consent_given": consent_given,
+                    "participant_id": get_participant_id()
                 }
-                save_to_csv(data_dict, CONSENT_CSV)
+                if save_submission("consent", data_dict, CONSENT_CSV):
+                    st.success("Consent Submitted.")
+                else:
+                    st.info("Your consent was already submitted.")
+                st.caption(f"Your participant ID is {get_participant_id()}.")
 
-    with demographics:
+    with demographics, timed("tab.demographics"):
         st.header("Demographic Questionnaire")
 
         with st.form("demographic_form"):
             name = st.text_input("Name")
-            age = st.radio("Age Range", ["Under 18", "18-24", "25-34", "35-44", "45-54", "55+"])
-            gender = st.radio("Gender", ["Male", "Female", "Non-binary", "Prefer not to say"])
-            education = st.radio("Education Level", ["High School or equivalent", "Some College",
-                                                     "Associate's Degree", "Bachelor's Degree",
-                                                     "Graduate Degree"])
+            age = st.radio("Age Range", AGE_OPTIONS)
+            gender = st.radio("Gender", GENDER_OPTIONS)
+            education = st.radio("Education Level", EDUCATION_OPTIONS)
             occupation = st.text_input("Enter your occupation:")
-            familiarity = st.radio("How familiar are you with technology?", ["Not familiar",
-                                                                             "Somewhat familiar",
-                                                                             "Very familiar"])
+            familiarity = st.radio("How familiar are you with technology?", FAMILIARITY_OPTIONS)
             accessibility = st.text_input("Are there any accessibility needs we should be aware of?")
             submitted = st.form_submit_button("Submit Demographics")
             if submitted:
-                st.success("Demographics Submitted.")
                 data_dict = {
                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
                     "name": name,
@@ -108,11 +168,15 @@ def main():
                     "education": education,
                     "occupation": occupation,
                     "familiarity": familiarity,
-                    "accessibility": accessibility
+                    "accessibility": accessibility,
+                    "participant_id": get_participant_id()
                 }
-                save_to_csv(data_dict, DEMOGRAPHIC_CSV)
+                if save_submission("demographics", data_dict, DEMOGRAPHIC_CSV):
+                    st.success("Demographics Submitted.")
+                else:
+                    st.info("These answers were already submitted.")
 
-    with tasks:
+    with tasks, timed("tab.task"):
         st.header("Task Page")
 
         st.write("Please enter your name and select a task and record your experience completing it.")
@@ -120,222 +184,52 @@ def main():
             "Name",
             placeholder="Enter your name"
         )
-        # For this template, we assume there's only one task, in project 3, we will have to include the actual tasks
-        selected_task = st.selectbox("Select Task", ["Task 1: Astronomy Picture of the Day", "Task 2: Kepler Space Telescope", "Task 3: Space Quiz"])
+        selected_task = st.selectbox("Select Task", TASK_NAMES, key="selected_task",
+                                     on_change=log_task_event, args=("task_selected",))
         
-        if selected_task == "Task 1: Astronomy Picture of the Day":
-            st.write("""
-                ### Task Description: Astronomy Picture of the Day (APOD)
-                
-                Navigate through the app to find the **Astronomy Picture of the Day** section.
-                
-                Please complete the following steps:
-                
-                1. View yesterday’s APOD.
-                2. Use the date selection feature to find and view the APOD from your birthday last year.
-                3. Examine the image and description shown for that date.
-                """)
-
-            # Track success, completion time, etc.
-            st.write("### Start the task timer now.\nWhen you have completed the task, stop the timer and answer the questions below.")
-            # Start/stop task timer
-            start_button = st.button("Start Task Timer")
-            if start_button:
-                st.success("Timer Started.")
-                st.session_state["start_time"] = time.time()
-
-            stop_button = st.button("Stop Task Timer")
-            if stop_button and "start_time" in st.session_state:
-                duration = time.time() - st.session_state["start_time"]
-                st.session_state["task_duration"] = duration
-                st.success(f"Task completed in {duration:.2f} seconds.")
-
-            success = st.radio("Was the task completed successfully?", ["Yes", "No", "Partially"])
-
-            step_one = st.text_area(
-                "What was the title or content of yesterday’s APOD?",
-                placeholder="e.g., 'Star Trails over Mauna Kea'"
-            )
-
-            step_two = st.text_area(
-                "What did you see for the APOD from your birthday last year?",
-                placeholder="e.g., 'A nebula image with a detailed description of its formation'"
-            )
-
-            step_three = st.text_area(
-                "Did the image and description display correctly and make sense?",
-                placeholder="e.g., 'Yes, everything loaded properly and the explanation was clear."
-            )
-
-            feedback = st.text_area(
-                "Was the APOD section easy to find? Was the date selector intuitive? Did anything "
-                "cause confusion or seem difficult to use? Please share any suggestions for improvement.",
-                placeholder="e.g., 'It took a while to find the section, and the date picker was not obvious on mobile.'"
-            )
-
-            if st.button("Save Task Results"):
-
-                st.success("Task Results Saved.")
-                duration_val = st.session_state.get("task_duration", None)
-
-                data_dict = {
-                    "name": name,
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "task_name": selected_task,
-                    "success": success,
-                    "duration_seconds": duration_val if duration_val else "",
-                    "step_one": step_one,
-                    "step_two": step_two,
-                    "step_three": step_three,
-                    "feedback": feedback,
-                }
-
-                save_to_csv(data_dict, TASKS_CSV)
-
-                # Reset any stored time in session_state if you'd like
-                if "start_time" in st.session_state:
-                    del st.session_state["start_time"]
-                if "task_duration" in st.session_state:
-                    del st.session_state["task_duration"]
-        elif selected_task == "Task 2: Kepler Space Telescope":
-            st.write("""
-                ### Task Description: Kepler Space Telescope Exploration
-                
-                Navigate to the **Exoplanet Discovery** section and explore the interactive charts showing planet discoveries.
-                
-                Please complete the following tasks:
-                
-                1. Use the dropdown menu to select Kepler from the telescope list and examine the interactive table.
-                2. Review the Kepler discovery chart and compare it with the total planet discovery chart.
-                3. Reflect on the data shown and Kepler's contribution to exoplanet science.
-                """)
-
-            st.write("### Start the task timer now.\nWhen you have completed the task, stop the timer and answer the questions below.")
-            # Start/stop task timer
-            start_button = st.button("Start Task Timer")
-            if start_button:
-                st.success("Timer Started.")
-                st.session_state["start_time"] = time.time()
-
-            stop_button = st.button("Stop Task Timer")
-            if stop_button and "start_time" in st.session_state:
-                duration = time.time() - st.session_state["start_time"]
-                st.session_state["task_duration"] = duration
-                st.success(f"Task completed in {duration:.2f} seconds.")
-
-            # User response fields
-            success = st.radio("Was the task completed successfully?", ["Yes", "No", "Partially"])
-            step_one = st.text_area(
-                "Approximately how many planets did Kepler discover in 2025?",
-                placeholder="e.g., 130 planets"
-            )
-
-            step_two = st.text_area(
-                "Did you observe any similarities between Kepler’s chart and the overall discovery chart?",
-                placeholder="e.g., Did both charts have similar peaks? Did they have any trending data between years?"
-            )
-
-            step_three = st.text_area(
-                "Did the charts help you understand Kepler’s impact on planet discovery? Why or why not?",
-                placeholder="e.g., Yes — it was clear that Kepler discovered a large portion of planets."
-            )
-
-            feedback = st.text_area(
-                "Was the dropdown easy to use? Were the charts and table intuitive and understandable? Please "
-                "share any confusion or suggestions for improvement.",
-                placeholder="e.g., I found the dropdown a bit small on mobile and the chart labels were hard to read."
-            )
-
-            if st.button("Save Task Results"):
-                st.success("Task Results Saved.")
-                duration_val = st.session_state.get("task_duration", None)
-
-                data_dict = {
-                    "name": name,
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "task_name": selected_task,
-                    "success": success,
-                    "duration_seconds": duration_val if duration_val else "",
-                    "step_one": step_one,
-                    "step_two": step_two,
-                    "step_three": step_three,
-                    "feedback": feedback,
-                }
-
-                save_to_csv(data_dict, TASKS_CSV)
-
-                # Reset any stored time in session_state if you'd like
-                if "start_time" in st.session_state:
-                    del st.session_state["start_time"]
-                if "task_duration" in st.session_state:
-                    del st.session_state["task_duration"]
-        else:
-            st.write("""
-                ### Task Description: Space Quiz
-
-                Navigate to the **Space Quiz** section of the app.
-                
-                Please complete the following steps:
-                
-                1. Enter your name.
-                2. Answer all quiz questions.
-                3. View your final score.
-                """)
-            # Track success, completion time, etc.
-            st.write("### Start the task timer now.\nWhen you have completed the task, stop the timer and answer the questions below.")
-            # Start/stop task timer
-            start_button = st.button("Start Task Timer")
-            if start_button:
-                st.success("Timer Started.")
-                st.session_state["start_time"] = time.time()
-
-            stop_button = st.button("Stop Task Timer")
-            if stop_button and "start_time" in st.session_state:
-                duration = time.time() - st.session_state["start_time"]
-                st.session_state["task_duration"] = duration
-                st.success(f"Task completed in {duration:.2f} seconds.")
-
-            success = st.radio("Was the task completed successfully?", ["Yes", "No", "Partially"])
-
-            step_one = st.text_area(
-                "What name did you enter?",
-                placeholder="e.g., John Smith"
-            )
-
-            step_two = st.text_area(
-                "Describe your experience answering the quiz questions.",
-                placeholder="e.g., Most of the questions were too difficult to understand."
-            )
-
-            step_three = st.text_area(
-                "What was your final score?",
-                placeholder="e.g., 1 out of 3"
-            )
-
-            feedback = st.text_area(
-                "Was it clear how to start and complete the quiz? Did you understand when the quiz ended and how your "
-                "score was presented? Were there any confusing elements or areas for improvement?",
-                placeholder="e.g., It was easy to start the quiz, but the questions were confusing."
-            )
-
-            if st.button("Save Task Results"):
-
+        # Every task's description and questions come from tasks.json, read
+        # once per process; only the selected task's widgets are drawn
+        task = get_tasks()[selected_task]
+        st.write(task.description)
+
+        # Track success, completion time, etc.
+        st.write("### Start the task timer now.\nWhen you have completed the task, stop the timer and answer the questions below.")
+        # Start/stop task timer
+        start_button = st.button("Start Task Timer", on_click=start_task_timer)
+        if start_button:
+            st.success("Timer Started.")
+
+        stop_button = st.button("Stop Task Timer", on_click=stop_task_timer)
+        if stop_button and "start_time" in st.session_state:
+            duration = st.session_state["task_duration"]
+            st.success(f"Task completed in {duration:.2f} seconds.")
+
+        success = st.radio("Was the task completed successfully?", SUCCESS_OPTIONS,
+                           on_change=log_task_event, args=("field_edit",), kwargs={"field": "success"})
+
+        answers = {}
+        for column, label, placeholder in task.questions:
+            answers[column] = st.text_area(label, placeholder=placeholder, on_change=log_task_event,
+                                           args=("field_edit",), kwargs={"field": column})
+
+        if st.button("Save Task Results"):
+            duration_val = st.session_state.get("task_duration", None)
+
+            data_dict = {
+                "name": name,
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "task_name": selected_task,
+                "success": success,
+                "duration_seconds": duration_val if duration_val else "",
+                **task.record(answers),
+                "participant_id": get_participant_id(),
+            }
+
+            if not save_submission("task", data_dict, TASKS_CSV):
+                st.info("These task results were already saved.")
+            else:
                 st.success("Task Results Saved.")
-                duration_val = st.session_state.get("task_duration", None)
-
-                data_dict = {
-                    "name": name,
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "task_name": selected_task,
-                    "success": success,
-                    "duration_seconds": duration_val if duration_val else "",
-                    "step_one": step_one,
-                    "step_two": step_two,
-                    "step_three": step_three,
-                    "feedback": feedback,
-                }
-
-                save_to_csv(data_dict, TASKS_CSV)
+                log_task_event("task_saved", duration_seconds=duration_val)
 
                 # Reset any stored time in session_state if you'd like
                 if "start_time" in st.session_state:
@@ -343,7 +237,7 @@ def main():
                 if "task_duration" in st.session_state:
                     del st.session_state["task_duration"]
 
-    with exit_tab:
+    with exit_tab, timed("tab.exit"):
         st.header("Exit Questionnaire")
 
         with st.form("exit_form"):
@@ -369,200 +263,423 @@ def main():
                     "confidence": confidence,
                     "completion": completion,
                     "improvements": improvements,
-                    "open_feedback": open_feedback
+                    "open_feedback": open_feedback,
+                    "participant_id": get_participant_id()
                 }
-                save_to_csv(data_dict, EXIT_CSV)
-                st.success("Exit questionnaire data saved.")
+                if save_submission("exit", data_dict, EXIT_CSV):
+                    st.success("Exit questionnaire data saved.")
+                else:
+                    st.info("These answers were already saved.")
+
+    # Only the selected tab's body runs, so reruns in the participant-facing
+    # tabs never build the report
+    if report.open:
+        with report, timed("tab.report"):
+            render_report()
+
+
+def load_report_snapshot(scope, refresh=False):
+    # Everything the Report tab shows. The aggregates are kept up to date by the
+    # save path, so this costs the same however many participants there are.
+    # The raw tables are paged through later, up to the row counts taken here.
+    # With a scope (studies and/or days of partitioned data) the aggregates are
+    # counted from the matching partitions only. The full report is read back
+    # from REPORT_SNAPSHOT_FILE while it is current, unless refresh is set.
+    from aggregates import get_aggregate_store
+    from charts import report_figures
+
+    backend = get_backend()
+    if scope:
+        from aggregates import report_from_counters
+        from batch_report import aggregate_tables
+        counters = aggregate_tables(backend.partition_paths(**scope), workers=1)
+        report_data = report_from_counters(counters, {table: n for (metric, table, _), (_, n) in counters.items()
+                                                      if metric == "rows"})
+    else:
+        store = get_aggregate_store()
+        key = {"version": REPORT_SNAPSHOT_VERSION, "aggregates": store.SCHEMA_VERSION, "backend": STORAGE_BACKEND,
+               "generation": store.generation(), "tables": table_stamps()}
+        saved = None if refresh else read_saved_snapshot(key)
+        if saved is not None:
+            return saved
+        report_data = store.report_data()
+    snapshot = {
+        "as_of": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "scope": scope,
+        "rows": {csv_file: backend.count(csv_file, **scope) for csv_file in TABLE_COLUMNS},
+        "report_data": report_data,
+        "figures": report_figures(report_data),
+    }
+    if not scope:
+        save_snapshot(snapshot, key)
+    return snapshot
+
+
+def table_stamps():
+    # Size and modification time of every table file, so a table rewritten in
+    # place (backfill-ids, dedupe) is noticed even when its row count is not
+    # changed
+    stamps = {}
+    for csv_file in TABLE_COLUMNS:
+        try:
+            stat = os.stat(csv_file)
+        except FileNotFoundError:
+            continue
+        stamps[csv_file] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def read_saved_snapshot(key):
+    # The snapshot saved under the same key (report version, storage backend,
+    # aggregate generation and table files, so nothing has been saved or
+    # rewritten since), or None
+    from aggregates import report_from_json
+    import plotly.io
+
+    try:
+        with open(REPORT_SNAPSHOT_FILE, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("key") != key:
+            return None
+        snapshot = saved["snapshot"]
+        return {**snapshot, "report_data": report_from_json(snapshot["report_data"]),
+                "figures": {name: plotly.io.from_json(figure) for name, figure in snapshot["figures"].items()}}
+    except Exception:
+        # Missing, or written by a version of the app that no longer reads it
+        return None
+
+
+def save_snapshot(snapshot, key):
+    # Written under a temporary name and moved into place, so a process
+    # starting up never reads half a snapshot
+    from aggregates import report_to_json
+
+    saved = {**snapshot, "report_data": report_to_json(snapshot["report_data"]),
+             "figures": {name: figure.to_json() for name, figure in snapshot["figures"].items()}}
+    temporary = f"{REPORT_SNAPSHOT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "snapshot": saved}, f)
+    os.replace(temporary, REPORT_SNAPSHOT_FILE)
+
+
+def report_scope():
+    # Study and date filters, shown when the data is partitioned. Returns the
+    # filters that narrow the data ({} for everything).
+    backend = get_backend()
+    if not hasattr(backend, "manifest"):
+        return {}
+    partitions = backend.manifest.partitions()
+    if partitions.empty:
+        return {}
+    studies = sorted(partitions["study"].unique())
+    first = datetime.date.fromisoformat(partitions["day"].min())
+    last = datetime.date.fromisoformat(partitions["day"].max())
+    study_column, date_column = st.columns(2)
+    chosen = study_column.multiselect("Studies", studies, default=studies, key="report_studies")
+    dates = date_column.date_input("Dates", value=(first, last), min_value=first, max_value=last,
+                                   key="report_dates")
+    scope = {}
+    if sorted(chosen) != studies:
+        scope["studies"] = sorted(chosen)
+    # A range being picked has only its first day until the second is chosen
+    if len(dates) == 2 and (dates[0], dates[1]) != (first, last):
+        scope["start"], scope["end"] = dates[0].isoformat(), dates[1].isoformat()
+    return scope
+
+
+def shorten_text(frame, columns, width=TEXT_PREVIEW_CHARS):
+    frame = frame.copy()
+    for column in columns:
+        text = frame[column].astype("string")
+        long = text.str.len() > width
+        frame[column] = text.where(~long, text.str.slice(0, width - 1) + "…")
+    return frame
+
+
+def render_table(csv_file, total_rows, scope):
+    # One page of a raw table. Only the selected columns of the rows on the
+    # page are read and sent to the browser.
+    label = TABLE_LABELS[csv_file]
+    st.write(f"**{label}**")
+    if not total_rows:
+        st.info(f"No {label.lower()} available yet.")
+        return
+
+    all_columns = TABLE_COLUMNS[csv_file]
+    columns = st.multiselect("Columns", all_columns, key=f"columns_{csv_file}",
+                             default=[column for column in all_columns if column not in FREE_TEXT_COLUMNS])
+    sort_column, order_column, size_column, page_column = st.columns(4)
+    sort_by = sort_column.selectbox("Sort by", ["(saved order)"] + all_columns, key=f"sort_{csv_file}")
+    descending = order_column.checkbox("Descending", key=f"descending_{csv_file}")
+    page_size = size_column.selectbox("Rows per page", PAGE_SIZES, key=f"page_size_{csv_file}")
+    pages = (total_rows + page_size - 1) // page_size
+    page = page_column.number_input("Page", min_value=1, max_value=pages, value=1, key=f"page_{csv_file}")
+    if not columns:
+        st.info("Select at least one column to show.")
+        return
+
+    start = (page - 1) * page_size
+    page_df = get_backend().read_page(csv_file, columns, None if sort_by == "(saved order)" else sort_by,
+                                      ascending=not descending, offset=start, limit=page_size, rows=total_rows,
+                                      **scope)
+    text_columns = [column for column in columns if column in FREE_TEXT_COLUMNS and column in page_df]
+    if text_columns and not st.checkbox("Show full free-text answers", key=f"expand_{csv_file}"):
+        page_df = shorten_text(page_df, text_columns)
+    with timed("dataframe", csv_file):
+        st.dataframe(page_df, hide_index=True)
+    st.caption(f"Rows {start + 1}-{start + len(page_df)} of {total_rows} (page {page} of {pages})")
+
+
+def render_metrics():
+    # Admin panel: rolling latency of every instrumented section in this server
+    # process, plus the caches and the write queue
+    with st.expander("Performance Metrics"):
+        summary = metrics.registry.summary()
+        if summary:
+            st.dataframe(pd.DataFrame.from_dict(summary, orient="index").rename_axis("section")
+                         .style.format("{:.2f}", subset=["mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]))
+        else:
+            st.info("No timings recorded yet.")
+        st.caption(f"Percentiles over the last {metrics.WINDOW} samples of each section. "
+                   f"Prometheus histograms are written to {metrics.PROMETHEUS_FILE} "
+                   f"every {metrics.EXPORT_INTERVAL:.0f}s.")
+        from charts import figure_cache_stats
+        st.write({"csv_cache": csv_cache_stats(), "figure_cache": figure_cache_stats(),
+                  "write_queue": write_queue_stats(), "event_log": event_log_stats(),
+                  "submissions": get_submission_keys().stats()})
+        if st.button("Reset Metrics"):
+            metrics.registry.reset()
+        if st.button("Export Now"):
+            metrics.registry.export()
+
+
+def interval_text(intervals, key, number="{:.2f}"):
+    # "2.91-3.10", one row of a bootstrap interval frame
+    if key not in intervals.index:
+        return "n/a"
+    return f"{number.format(intervals.loc[key, 'low'])}-{number.format(intervals.loc[key, 'high'])}"
+
+
+def render_search(query):
+    from search import get_search_index
+
+    with timed("search"):
+        index = get_search_index()
+        counts, participants = index.match_counts(query)
+        matches = index.search(query, limit=SEARCH_RESULTS)
+    if counts.empty:
+        st.info("No answers match that search.")
+        return
+    st.write(f"{counts['answers'].sum()} matching answer(s) from {participants} participant(s)")
+    counts["tbl"] = counts["tbl"].map(TABLE_LABELS)
+    counts.columns = ["Table", "Question", "Answers"]
+    st.dataframe(counts, hide_index=True)
+    matches["tbl"] = matches["tbl"].map(TABLE_LABELS)
+    matches.columns = ["Table", "Question", "Participant ID", "Task", "Timestamp", "Excerpt"]
+    st.caption(f"{len(matches)} matching answer(s), most recent participants first; "
+               "matching words are [bracketed].")
+    st.dataframe(matches, hide_index=True)
+    if st.checkbox("List every matching participant ID"):
+        st.dataframe(pd.DataFrame({"Participant ID": index.participants(query)}), hide_index=True)
+    with st.expander("Most frequent words in all answers"):
+        st.dataframe(index.top_terms(), hide_index=True)
+
+
+def render_export(scope):
+    # The bundle is streamed to a file under data/exports a chunk at a time and
+    # then offered for download, instead of being built in memory
+    from export import EXPORT_FORMATS, PARQUET_AVAILABLE, export_path, export_tables
+
+    with st.expander("Export study data"):
+        formats = [file_format for file_format in EXPORT_FORMATS if file_format != "parquet" or PARQUET_AVAILABLE]
+        format_column, text_column = st.columns(2)
+        file_format = format_column.selectbox("Format", formats, format_func=EXPORT_LABELS.get,
+                                              key="export_format")
+        free_text = text_column.checkbox("Include typed answers", value=True, key="export_free_text")
+        tables = st.multiselect("Tables", list(TABLE_COLUMNS), default=list(TABLE_COLUMNS),
+                                format_func=TABLE_LABELS.get, key="export_tables")
+        if scope:
+            st.caption("Only the studies and dates selected above are exported.")
+        if st.button("Prepare Export", disabled=not tables):
+            previous = st.session_state.pop("export_bundle", None)
+            if previous and os.path.exists(previous["path"]):
+                os.remove(previous["path"])
+            path = export_path(file_format)
+            with st.spinner("Exporting..."):
+                written = export_tables(path, file_format, tables, free_text=free_text, **scope)
+            st.session_state["export_bundle"] = {"path": path, "rows": sum(written.values())}
+        bundle = st.session_state.get("export_bundle")
+        if bundle and os.path.exists(bundle["path"]):
+            with open(bundle["path"], "rb") as f:
+                st.download_button(f"Download {os.path.basename(bundle['path'])} ({bundle['rows']} rows, "
+                                   f"{os.path.getsize(bundle['path']) / 1e6:.1f} MB)", f,
+                                   file_name=os.path.basename(bundle["path"]), mime="application/zip",
+                                   on_click="ignore")
+
+
+def show_chart(figures, name):
+    with timed("chart", name):
+        st.plotly_chart(figures[name], use_container_width=True)
+
+
+# Runs as a fragment so the refresh button reruns only the report
+@st.fragment
+def render_report():
+    import bootstrap
+    import sketch
+
+    st.header("Usability Report - Aggregated Results")
+
+    # The report is only recomputed when asked for, or when this session has
+    # saved something since; until then every rerun shows the snapshot taken
+    # the last time it was refreshed. Submissions still in the write-behind
+    # queue are written out first, so the session always sees its own.
+    scope = report_scope()
+    refresh = st.button("Refresh Report")
+    saved = st.session_state.get("submissions_saved", 0)
+    previous = st.session_state.get("report_snapshot")
+    if refresh or previous is None or previous["scope"] != scope or previous.get("saved") != saved:
+        with timed("report.snapshot"):
+            if not flush_writes(REPORT_FLUSH_TIMEOUT):
+                st.caption("Some submissions are still being written and are not included yet.")
+            st.session_state["report_snapshot"] = {**load_report_snapshot(scope, refresh), "saved": saved}
+    snapshot = st.session_state["report_snapshot"]
+    st.caption(f"Data as of {snapshot['as_of']}")
+
+    for csv_file in TABLE_COLUMNS:
+        render_table(csv_file, snapshot["rows"][csv_file], scope)
+
+    st.write("**Participant Lookup**")
+    lookup_id = st.text_input("Participant ID", placeholder="Enter a participant ID to see all of their records")
+    if lookup_id:
+        # Found through the participant index instead of scanning the tables
+        participant_records = get_backend().participant_records(lookup_id.strip())
+        found = {csv_file: frame for csv_file, frame in participant_records.items() if not frame.empty}
+        if not found:
+            st.info("No records found for that participant ID.")
+        for csv_file, frame in found.items():
+            st.write(TABLE_LABELS[csv_file])
+            st.dataframe(frame)
+
+    st.write("**Search Answers**")
+    query = st.text_input("Search typed answers",
+                          placeholder='e.g. mobile, "date picker", navigat*, menu OR button',
+                          help="Searches the task steps and feedback and the exit questionnaire's written "
+                               "answers. All words must appear; use quotes for an exact phrase.")
+    if query:
+        render_search(query)
+
+    st.write("**Export Data**")
+    render_export(scope)
+
+    # Example of aggregated stats (for demonstration only)
+    report_data = snapshot["report_data"]
+    if report_data["rows"]["exit"]:
+        st.subheader("Exit Questionnaire Averages")
+
+        avg_satisfaction = report_data["avg_satisfaction"]
+        avg_difficulty = report_data["avg_difficulty"]
+        avg_confidence = report_data["avg_confidence"]
+        avg_task_duration = report_data["avg_task_duration"]
+
+        exit_intervals = report_data["exit_intervals"]
+        level = f"{bootstrap.CONFIDENCE_LEVEL:.0%} CI"
+        st.write(f"**Average Satisfaction**: {avg_satisfaction:.2f} "
+                 f"({level} {interval_text(exit_intervals, 'satisfaction')})")
+        st.write(f"**Average Difficulty**: {avg_difficulty:.2f} ({level} {interval_text(exit_intervals, 'difficulty')})")
+        st.write(f"**Average Confidence**: {avg_confidence:.2f} ({level} {interval_text(exit_intervals, 'confidence')})")
+        # One line per task in tasks.json, drawn as a single element however
+        # many tasks the study has
+        st.write("\n\n".join(
+            f"**Average Task Duration - {task.label}**: {avg_task_duration.get(task.name, float('nan')):.2f} Second(s)"
+            for task in get_tasks().values()))
+
+        summary_df = report_data["task_summary"].copy()
+
+        # Format nicely
+        summary_df.columns = ["Task", "Success Rate (%)", "Avg. Completion Time (sec)", "Participants"]
+        success_intervals = report_data["success_rate_intervals"]
+        summary_df[f"Success Rate {level}"] = [interval_text(success_intervals, task, "{:.1f}")
+                                               for task in summary_df["Task"]]
+        st.write("### Task Success Rates and Average Completion Times")
+        st.caption(f"Intervals are {bootstrap.CONFIDENCE_LEVEL:.0%} bootstrap confidence intervals "
+                   f"from {bootstrap.RESAMPLES} resamples; the bars in the charts below show the same intervals.")
+        st.dataframe(
+            summary_df.style.format({"Success Rate (%)": "{:.1f}", "Avg. Completion Time (sec)": "{:.1f}"}))
+
+        # Percentiles come from a quantile sketch kept up to date on every
+        # save, so they cost the same however many tasks have been recorded
+        quantiles_df = report_data["task_duration_quantiles"].reset_index()
+        quantiles_df.columns = ["Task", "Median (sec)", "90th Percentile (sec)", "99th Percentile (sec)",
+                                "Timed Attempts"]
+        st.write("### Task Completion Time Percentiles")
+        st.caption(f"Percentiles are accurate to within {sketch.RELATIVE_ACCURACY:.0%} of the exact value.")
+        st.dataframe(quantiles_df.style.format({column: "{:.1f}" for column in quantiles_df.columns[1:4]},
+                                               na_rep="n/a"))
+
+
+        figures = snapshot["figures"]
+
+        # Data Visuals in Reports page
+        st.subheader("Demographic Distributions")
+        st.write("""
+        The following visualizations provide an overview of the demographic characteristics of the participants.
 
-    with report:
-        st.header("Usability Report - Aggregated Results")
+        - **Gender Distribution** displays the distribution of genders across participants.
+        - **Age Distribution** displays the distribution of ages across participants.
+        - **Education Level Distribution** displays the distribution of education levels across participants.
+        - **Familiarity Distribution** displays the distribution of familiarity across participants.
+        """)
+        # gender distribution pie chart
+        show_chart(figures, "gender")
 
-        st.write("**Consent Data**")
-        consent_df = load_from_csv(CONSENT_CSV)
-        if not consent_df.empty:
-            st.dataframe(consent_df)
-        else:
-            st.info("No consent data available yet.")
+        # age distribution pie chart
+        show_chart(figures, "age")
 
-        st.write("**Demographic Data**")
-        demographic_df = load_from_csv(DEMOGRAPHIC_CSV)
-        if not demographic_df.empty:
-            st.dataframe(demographic_df)
-        else:
-            st.info("No demographic data available yet.")
+        # education level pie chart
+        show_chart(figures, "education")
 
-        st.write("**Task Performance Data**")
-        task_df = load_from_csv(TASKS_CSV)
-        if not task_df.empty:
-            st.dataframe(task_df)
-        else:
-            st.info("No task data available yet.")
+        #familiarity pie chart
+        show_chart(figures, "familiarity")
 
-        st.write("**Exit Questionnaire Data**")
-        exit_df = load_from_csv(EXIT_CSV)
-        if not exit_df.empty:
-            st.dataframe(exit_df)
-        else:
-            st.info("No exit questionnaire data available yet.")
-
-        # Example of aggregated stats (for demonstration only)
-        if not exit_df.empty:
-            st.subheader("Exit Questionnaire Averages")
-
-            avg_satisfaction = exit_df["satisfaction"].mean()
-            avg_difficulty = exit_df["difficulty"].mean()
-            avg_confidence = exit_df["confidence"].mean()
-            avg_task_duration = task_df["duration_seconds"].mean()
-            filtered_task_one = task_df[task_df["task_name"] == "Task 1: Astronomy Picture of the Day"]
-            avg_task_one_duration = filtered_task_one["duration_seconds"].mean()
-            filtered_task_two = task_df[task_df["task_name"] == "Task 2: Kepler Space Telescope"]
-            avg_task_two_duration = filtered_task_two["duration_seconds"].mean()
-            filtered_task_three = task_df[task_df["task_name"] == "Task 3: Space Quiz"]
-            avg_task_three_duration = filtered_task_three["duration_seconds"].mean()
-
-            st.write(f"**Average Satisfaction**: {avg_satisfaction:.2f}")
-            st.write(f"**Average Difficulty**: {avg_difficulty:.2f}")
-            st.write(f"**Average Confidence**: {avg_confidence:.2f}")
-            st.write(f"**Average Task Duration - Task One**: {avg_task_one_duration:.2f} Second(s)")
-            st.write(f"**Average Task Duration - Task Two**: {avg_task_two_duration:.2f} Second(s)")
-            st.write(f"**Average Task Duration - Task Three**: {avg_task_three_duration:.2f} Second(s)")
-
-            # Ordering data
-            education_order = [
-                "High School or equivalent",
-                "Some College",
-                "Associate's Degree",
-                "Bachelor's Degree",
-                "Graduate Degree"
-            ]
-
-            age_order = [
-                "Under 18",
-                "18-24",
-                "25-34",
-                "35-44",
-                "45-54",
-                "55+"
-            ]
-
-            gender_counts = demographic_df["gender"].value_counts()
-            age_counts = demographic_df["age"].value_counts().reindex(age_order)
-            education_counts = demographic_df["education"].value_counts().reindex(education_order)
-            familiarity_counts = demographic_df["familiarity"].value_counts()
-            task_success_counts = task_df["success"].value_counts()
-
-            task_df["success_numeric"] = task_df["success"].map({"Yes": 1, "Partially": 0.5, "No": 0})
-
-            summary_df = task_df.groupby("task_name").agg(
-                success_rate=("success_numeric", lambda x: round((x.sum() / len(x)) * 100, 1)),
-                avg_time_sec=("duration_seconds", "mean"),
-                num_participants=("success", "count")
-            ).reset_index()
-
-            # Format nicely
-            summary_df.columns = ["Task", "Success Rate (%)", "Avg. Completion Time (sec)", "Participants"]
-            st.write("### Task Success Rates and Average Completion Times")
-            st.dataframe(
-                summary_df.style.format({"Success Rate (%)": "{:.1f}", "Avg. Completion Time (sec)": "{:.1f}"}))
-
-
-            merge_demo_exit = pd.merge(exit_df, demographic_df, left_index=True, right_index=True)
-            merge_demo_task = pd.merge(task_df, demographic_df, left_index=True, right_index=True)
-            # st.write(merge_demo_exit) # DEBUG
-            # st.write(merge_demo_task) # DEBUG
-            avg_difficulty_by_age = merge_demo_exit.groupby("age")["difficulty"].mean()
-            # st.write(avg_difficulty_by_age) # DEBUG
-            avg_confidence_by_gender = merge_demo_exit.groupby("gender")["confidence"].mean()
-            # st.write(avg_confidence_by_gender) # DEBUG
-            success_by_education = merge_demo_task.groupby("education")["success"].value_counts().unstack(fill_value=0)
-            # st.write(success_by_education) # DEBUG
-
-            # Data Visuals in Reports page
-            st.subheader("Demographic Distributions")
-            st.write("""
-            The following visualizations provide an overview of the demographic characteristics of the participants.
-
-            - **Gender Distribution** displays the distribution of genders across participants.
-            - **Age Distribution** displays the distribution of ages across participants.
-            - **Education Level Distribution** displays the distribution of education levels across participants.
-            - **Familiarity Distribution** displays the distribution of familiarity across participants.
-            """)
-            # gender distribution pie chart
-            fig_gender_counts = px.pie(gender_counts,
-                                             names=gender_counts.index,
-                                             values=gender_counts.values,
-                                             title='Gender Distribution')
-            st.plotly_chart(fig_gender_counts, use_container_width=True)
-
-            # age distribution pie chart
-            fig_age_counts = px.pie(age_counts,
-                                             names=age_counts.index,
-                                             values=age_counts.values,
-                                             title='Age Distribution')
-            st.plotly_chart(fig_age_counts, use_container_width=True)
-
-            # education level pie chart
-            fig_education_counts = px.pie(education_counts,
-                                          names=education_counts.index,
-                                          values=education_counts.values,
-                                          title='Education Level Distribution')
-            st.plotly_chart(fig_education_counts, use_container_width=True)
-
-            #familiarity pie chart
-            fig_familiarity_counts = px.pie(familiarity_counts,
-                                          names=familiarity_counts.index,
-                                          values=familiarity_counts.values,
-                                          title='Familiarity Distribution')
-            st.plotly_chart(fig_familiarity_counts, use_container_width=True)
-
-
-
-            st.subheader("Task Performance Distribution")
-            st.write("""
-            The following visualizations provide a breakdown of task completion outcomes and how these vary by education level.
-
-            - **Task Success Distribution** displays the overall percentages of successful, partially successful, and unsuccessful task completions.
-            - **Task Success by Education Level** shows how task completion rates differ across education levels.
-            """)
 
-            # task success pie chart total
-            fig_task_success_counts = px.pie(task_success_counts,
-                                             names=task_success_counts.index,
-                                             values=task_success_counts.values,
-                                             title='Task Success Distribution')
-            st.plotly_chart(fig_task_success_counts, use_container_width=True)
-
-            success_by_education = success_by_education.reindex(education_order)
-            # success by education level bar graph
-            fig_success_by_education = px.bar(success_by_education,
-                                              labels={'value':'Count', 'education': 'Education Level'},
-                                              title = "Task Success by Education Level",
-                                              barmode ="group")
-            st.plotly_chart(fig_success_by_education, use_container_width=True)
-
-            st.subheader("User Experience Metrics by Demographics")
-            st.write("""
-            The following visualizations break down usability testing feedback by user age and gender.
-            They provide insights into how different demographic groups experienced the product:
-
-            - **Average Difficulty by Age** shows how easy or difficult participants of different age ranges found the tasks.
-            - **Average Confidence by Gender** indicates how confident each gender group felt while completing the tasks.
-            """)
 
-            avg_difficulty_by_age = avg_difficulty_by_age.reindex(age_order)
-            # difficulty by age level bar graph
-            fig_avg_difficulty_by_age = px.bar(avg_difficulty_by_age,
-                                              labels={'value':'Average Difficulty (0 = Not Difficult, 5 = Very Difficult', 'age': 'Age Range'},
-                                              title = "Average Difficulty by Age")
-            fig_avg_difficulty_by_age.update_layout(showlegend=False)
-            st.plotly_chart(fig_avg_difficulty_by_age, use_container_width=True)
-
-            # confidence by gender bar graph
-            fig_avg_confidence_by_gender = px.bar(avg_confidence_by_gender,
-                                              labels={'value':'Average Confidence (0 = Not Confident, 5 = Very Confident', 'gender': 'Gender'},
-                                              title = "Average Confidence by Gender")
-            fig_avg_confidence_by_gender.update_layout(showlegend=False)
-            st.plotly_chart(fig_avg_confidence_by_gender, use_container_width=True)
+        st.subheader("Task Performance Distribution")
+        st.write("""
+        The following visualizations provide a breakdown of task completion outcomes and how these vary by education level.
+
+        - **Task Success Distribution** displays the overall percentages of successful, partially successful, and unsuccessful task completions.
+        - **Task Success by Education Level** shows how task completion rates differ across education levels.
+        - **Task Completion Time Distribution** shows how long participants took on each task.
+        """)
+
+        # task success pie chart total
+        show_chart(figures, "task_success")
+
+        # success by education level bar graph
+        show_chart(figures, "success_by_education")
+
+        # completion time histogram per task
+        show_chart(figures, "duration_histogram")
+
+        st.subheader("User Experience Metrics by Demographics")
+        st.write("""
+        The following visualizations break down usability testing feedback by user age and gender.
+        They provide insights into how different demographic groups experienced the product:
+
+        - **Average Difficulty by Age** shows how easy or difficult participants of different age ranges found the tasks.
+        - **Average Confidence by Gender** indicates how confident each gender group felt while completing the tasks.
+        """)
+
+        # difficulty by age level bar graph
+        show_chart(figures, "difficulty_by_age")
+
+        # confidence by gender bar graph
+        show_chart(figures, "confidence_by_gender")
+
+    if metrics.ENABLED:
+        render_metrics()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,45 @@
+import importlib
+import sys
+import threading
+import types
+
+# Held while a lazily imported module is really imported, so threads touching
+# it for the first time at once (two sessions rendering the report, and the
+# write-behind thread) wait for one import instead of seeing it half done
+_import_lock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    # Stands in for a module until one of its attributes is used, then imports
+    # it and copies its namespace in, so later lookups are plain attribute reads
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_loaded"] = False
+
+    def __getattr__(self, attribute):
+        if not self._lazy_loaded:
+            with _import_lock:
+                if not self._lazy_loaded:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__.update(module.__dict__)
+                    self.__dict__["_lazy_loaded"] = True
+        # Anything the module only provides through its own __getattr__
+        return getattr(sys.modules[self.__name__], attribute)
+
+
+def lazy_import(name):
+    # The named module, imported on first attribute access instead of now.
+    # pandas and NumPy are imported this way by the modules the participant
+    # tabs and the save path load, so those tabs render (and saves complete)
+    # without paying for either; the Report tab loads them on first use.
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
+
+
+def is_loaded(name):
+    # Whether a module has really been imported; a lazy_import stand-in never
+    # goes into sys.modules
+    return name in sys.modules
@@ -0,0 +1,350 @@
+import argparse
+import os
+import time
+
+import storage
+from submissions import DEDUPE_WINDOW
+
+
+def migrate(args):
+    from sqlite_backend import SqliteBackend
+
+    backend = SqliteBackend(args.db)
+    imported = backend.import_csvs(force=args.force)
+    if imported is None:
+        print(f"CSV data was already imported into {args.db}; use --force to import it again.")
+        return
+    for table, rows in imported.items():
+        print(f"{table}: {rows} row(s)")
+    print(f"Set STORAGE_BACKEND = \"sqlite\" in storage.py to use {args.db}.")
+
+
+def partition(args):
+    from partitioned_backend import PartitionedBackend
+
+    backend = PartitionedBackend(args.folder)
+    if not backend.manifest.partitions().empty:
+        if not args.force:
+            print(f"{args.folder} already holds partitions; use --force to import the CSV files again.")
+            return
+        backend.clear()
+    imported = backend.import_csvs(study=args.study)
+    for csv_file, rows in imported.items():
+        print(f"{csv_file}: {rows} row(s) into study '{args.study}'")
+    print("Set STORAGE_BACKEND = \"partitioned\" in storage.py to use the partitions, then run "
+          "'python manage.py aggregates --rebuild' and 'python manage.py search-index'.")
+
+
+def partitions(args):
+    from partitioned_backend import PartitionedBackend
+
+    backend = PartitionedBackend(args.folder)
+    if args.compact_before:
+        compacted = backend.compact(args.compact_before, args.study)
+        print(f"Compacted {compacted} partition(s) from before {args.compact_before}.")
+    listed = backend.manifest.partitions(None, args.study)
+    if listed.empty:
+        print(f"No partitions in {args.folder}.")
+        return
+    listed["tbl"] = listed["tbl"].map(os.path.basename)
+    listed["mb"] = (listed.pop("bytes") / 1e6).round(2)
+    print(listed.drop(columns="path").to_string(index=False))
+    print(f"{len(listed)} partition(s), {listed['rows'].sum()} row(s), {listed['mb'].sum():.2f} MB")
+
+
+def export(args):
+    from export import export_path, export_tables, table_name
+
+    backend = storage.get_backend()
+    scope = {key: value for key, value in (("start", args.start), ("end", args.end)) if value}
+    if args.study:
+        if not hasattr(backend, "manifest"):
+            print("--study needs the partitioned storage backend.")
+            return
+        scope["studies"] = args.study
+    tables = [csv_file for csv_file in storage.TABLE_COLUMNS if table_name(csv_file) in args.tables]
+    out = args.out or export_path(args.format)
+    start = time.perf_counter()
+    written = export_tables(out, args.format, tables, free_text=not args.no_free_text, rows=args.chunk_rows,
+                            **scope)
+    for csv_file, rows in written.items():
+        print(f"{table_name(csv_file)}: {rows} row(s)")
+    print(f"Wrote {out} ({os.path.getsize(out) / 1e6:.2f} MB) in {time.perf_counter() - start:.1f}s")
+
+
+def aggregates(args):
+    from aggregates import AggregateStore
+
+    store = AggregateStore(args.db)
+    if not store.is_built() and not args.rebuild:
+        # Nothing to compare: every counter would show up as drift
+        print(f"Report aggregates in {args.db} have not been built yet; run with --rebuild to build them.")
+        return
+    drift = store.rebuild(replace=args.rebuild)
+    if not drift:
+        print("Report aggregates match the raw data.")
+    else:
+        print(f"{len(drift)} aggregate(s) differ from the raw data (stored -> rebuilt):")
+        for key, (stored, rebuilt) in sorted(drift.items(), key=lambda item: item[0]):
+            print(f"  {'/'.join(part for part in key if part)}: {stored} -> {rebuilt}")
+    if args.rebuild:
+        print("Report aggregates rebuilt from the raw data.")
+
+
+def search_index(args):
+    from search import SearchIndex
+
+    answers = SearchIndex(args.db).rebuild()
+    print(f"Search index rebuilt: {answers} answer(s) indexed.")
+
+
+def backfill_ids(args):
+    from participants import backfill_participant_ids
+
+    results = backfill_participant_ids()
+    for csv_file, (given, unmatched) in results.items():
+        print(f"{csv_file}: {given} row(s) given a participant ID, {unmatched} left without one")
+    if any(given for given, _ in results.values()):
+        print("Run 'python manage.py aggregates --rebuild' and 'python manage.py search-index' "
+              "so the report picks up the new IDs.")
+
+
+def dedupe(args):
+    from submissions import dedupe_csv_tables
+
+    removed = dedupe_csv_tables(window=args.window * 60, dry_run=args.dry_run)
+    for csv_file, rows in removed.items():
+        print(f"{csv_file}: {rows} repeated submission(s) {'found' if args.dry_run else 'removed'}")
+    if any(removed.values()) and not args.dry_run:
+        print("Run 'python manage.py aggregates --rebuild' and 'python manage.py search-index' "
+              "so the report drops them too.")
+
+
+def dead_letters(args):
+    import json
+
+    try:
+        with open(storage.DEAD_LETTER_FILE, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        print(f"{entry['csv_file']}: {entry['error']}")
+    print(f"{len(entries)} submission(s) set aside in {storage.DEAD_LETTER_FILE}")
+    if args.replay and entries:
+        written, left = storage.replay_dead_letters()
+        print(f"{written} written to their tables, {left} still failing")
+
+
+def memory(args):
+    import tempfile
+
+    import pandas as pd
+
+    from synthetic import generate_study
+
+    def megabytes(frame):
+        return frame.memory_usage(index=True, deep=True).sum() / 1e6
+
+    print(f"In-memory size of the study tables for {args.participants} synthetic participant(s), in MB:")
+    print(f"{'table':<20}{'rows':>10}{'strings':>12}{'compact':>12}{'no free text':>14}")
+    totals = [0.0, 0.0, 0.0]
+    with tempfile.TemporaryDirectory() as folder:
+        written = generate_study(folder, args.participants, seed=args.seed)
+        for path, rows in written.items():
+            # Before: every column as read by pd.read_csv; after: the cache's
+            # categorical columns, with and without the free-text columns
+            sizes = [megabytes(pd.read_csv(path)),
+                     megabytes(storage.CsvCache().load(path)),
+                     megabytes(storage.CsvCache().load(path, free_text=False))]
+            totals = [total + size for total, size in zip(totals, sizes)]
+            print(f"{os.path.basename(path):<20}{rows:>10}" + "".join(
+                f"{size:>{width}.2f}" for size, width in zip(sizes, (12, 12, 14))))
+    print(f"{'total':<30}" + "".join(f"{size:>{width}.2f}" for size, width in zip(totals, (12, 12, 14))))
+
+
+def report(args):
+    from aggregates import TABLE_KEYS, report_from_counters
+    from batch_report import aggregate_tables, write_report
+
+    backend = storage.get_backend()
+    if args.data is None and hasattr(backend, "manifest"):
+        # Partitioned storage: every partition of each table, CSV or Parquet
+        paths = backend.partition_paths(studies=args.study)
+    elif args.study:
+        print("--study needs the partitioned storage backend.")
+        return
+    else:
+        folder = args.data or storage.DATA_FOLDER
+        paths = {csv_file: os.path.join(folder, os.path.basename(csv_file)) for csv_file in TABLE_KEYS}
+    start = time.perf_counter()
+    counters = aggregate_tables(paths, workers=args.workers, chunk_bytes=args.chunk_mb * 1024 * 1024)
+    rows = {table: n for (metric, table, _), (_, n) in counters.items() if metric == "rows"}
+    report_data = report_from_counters(counters, rows)
+    for path in write_report(report_data, args.out, formats=args.format):
+        print(f"Wrote {path}")
+    print(f"Aggregated {sum(rows.values())} row(s) in {time.perf_counter() - start:.1f}s")
+
+
+def generate(args):
+    from synthetic import generate_study
+
+    if os.path.abspath(args.out) == os.path.abspath(storage.DATA_FOLDER) and not args.force:
+        print(f"Refusing to overwrite the study data in {args.out}; use --force to replace it.")
+        return
+    for path, rows in generate_study(args.out, args.participants, args.tasks, seed=args.seed).items():
+        print(f"{path}: {rows} row(s)")
+
+
+def benchmark(args):
+    from benchmark import run_benchmark, write_results
+
+    write_results(run_benchmark(args.participants, saves=args.saves, repeats=args.repeats, seed=args.seed),
+                  args.output)
+
+
+def task_times(args):
+    from events import read_events, task_timings
+
+    timings = task_timings(read_events(args.events))
+    if timings.empty:
+        print(f"No task events in {args.events}.")
+        return
+    if args.output:
+        timings.to_csv(args.output, index=False)
+        print(f"Wrote {len(timings)} task attempt(s) to {args.output}")
+    saved = timings.dropna(subset=["saved_at"])
+    summary = saved.groupby("task").agg(
+        attempts=("attempt", "size"),
+        timer_recorded=("timer_seconds", "count"),
+        median_timer_seconds=("timer_seconds", "median"),
+        median_start_to_save_seconds=("start_to_save_seconds", "median"),
+    )
+    print(summary.to_string())
+    print(f"{len(timings) - len(saved)} attempt(s) were never saved.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the usability testing data.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="Import the CSV files into the SQLite database.")
+    migrate_parser.add_argument("--db", default=storage.SQLITE_DB, help="SQLite database path")
+    migrate_parser.add_argument("--force", action="store_true",
+                                help="Empty the tables and import the CSV files again (rows saved since are lost)")
+    migrate_parser.set_defaults(func=migrate)
+
+    partition_parser = commands.add_parser(
+        "partition", help="Copy the CSV tables into per-study, per-day partitions.")
+    partition_parser.add_argument("--folder", default=os.path.join(storage.DATA_FOLDER, "partitions"),
+                                  help="Partition folder")
+    partition_parser.add_argument("--study", default=storage.STUDY, help="Study the existing records belong to")
+    partition_parser.add_argument("--force", action="store_true",
+                                  help="Delete the partitions and import the CSV files again (rows saved since are lost)")
+    partition_parser.set_defaults(func=partition)
+
+    partitions_parser = commands.add_parser(
+        "partitions", help="List the partitions with their row counts and time ranges, or compact old ones.")
+    partitions_parser.add_argument("--folder", default=os.path.join(storage.DATA_FOLDER, "partitions"),
+                                   help="Partition folder")
+    partitions_parser.add_argument("--study", nargs="+", help="Only these studies")
+    partitions_parser.add_argument("--compact-before", metavar="YYYY-MM-DD",
+                                   help="Compact CSV partitions of earlier days into Parquet archives "
+                                        "(needs pyarrow)")
+    partitions_parser.set_defaults(func=partitions)
+
+    table_names = [os.path.splitext(os.path.basename(csv_file))[0] for csv_file in storage.TABLE_COLUMNS]
+    export_parser = commands.add_parser(
+        "export", help="Stream the study tables into one compressed zip bundle (CSV or Parquet).")
+    export_parser.add_argument("--out", help="Bundle to write (default: data/exports/study_export_<time>.zip)")
+    export_parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                               help="Table format inside the bundle (parquet needs pyarrow)")
+    export_parser.add_argument("--tables", nargs="+", choices=table_names, default=table_names,
+                               help="Tables to export")
+    export_parser.add_argument("--start", metavar="YYYY-MM-DD", help="Only records from this day on")
+    export_parser.add_argument("--end", metavar="YYYY-MM-DD", help="Only records up to this day")
+    export_parser.add_argument("--study", nargs="+", help="Only these studies (partitioned storage)")
+    export_parser.add_argument("--no-free-text", action="store_true", help="Leave the typed answers out")
+    export_parser.add_argument("--chunk-rows", type=int, default=storage.CHUNK_ROWS,
+                               help="Records read and written at a time")
+    export_parser.set_defaults(func=export)
+
+    aggregates_parser = commands.add_parser(
+        "aggregates", help="Check the report aggregates for drift against the raw data.")
+    aggregates_parser.add_argument("--db", default=os.path.join(storage.DATA_FOLDER, "aggregates.db"),
+                                   help="Aggregate store path")
+    aggregates_parser.add_argument("--rebuild", action="store_true",
+                                   help="Replace the stored aggregates with ones rebuilt from the raw data")
+    aggregates_parser.set_defaults(func=aggregates)
+
+    search_parser = commands.add_parser(
+        "search-index", help="Rebuild the full-text index of typed answers from the raw data.")
+    search_parser.add_argument("--db", default=os.path.join(storage.DATA_FOLDER, "search.db"),
+                               help="Search index path")
+    search_parser.set_defaults(func=search_index)
+
+    backfill_parser = commands.add_parser(
+        "backfill-ids", help="Give rows saved before participant IDs existed an ID (CSV storage).")
+    backfill_parser.set_defaults(func=backfill_ids)
+
+    dedupe_parser = commands.add_parser(
+        "dedupe", help="Remove repeated form submissions saved before submissions had keys (CSV storage).")
+    dedupe_parser.add_argument("--window", type=float, default=DEDUPE_WINDOW / 60,
+                               help="Minutes after a submission within which the same answers count as a repeat")
+    dedupe_parser.add_argument("--dry-run", action="store_true", help="Only count the repeats")
+    dedupe_parser.set_defaults(func=dedupe)
+
+    dead_letters_parser = commands.add_parser(
+        "dead-letters", help="List the submissions that could not be written, or write them again.")
+    dead_letters_parser.add_argument("--replay", action="store_true", help="Write them to their tables")
+    dead_letters_parser.set_defaults(func=dead_letters)
+
+    memory_parser = commands.add_parser(
+        "memory", help="Report how much memory the loaded tables take, on a synthetic study.")
+    memory_parser.add_argument("--participants", type=int, default=100000, help="Synthetic participants")
+    memory_parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic study")
+    memory_parser.set_defaults(func=memory)
+
+    report_parser = commands.add_parser(
+        "report", help="Write the usability report as static HTML/JSON without a Streamlit server.")
+    report_parser.add_argument("--data", help="Folder holding the study CSV files (default: the configured storage)")
+    report_parser.add_argument("--study", nargs="+", help="Only these studies (partitioned storage)")
+    report_parser.add_argument("--out", default="report", help="Folder to write the report to")
+    report_parser.add_argument("--format", nargs="+", choices=["html", "json"], default=["html", "json"],
+                               help="Output formats")
+    report_parser.add_argument("--workers", type=int, default=None,
+                               help="Worker processes (default: one per CPU; 1 runs in this process)")
+    report_parser.add_argument("--chunk-mb", type=int, default=16, help="Size of the blocks read from each file")
+    report_parser.set_defaults(func=report)
+
+    generate_parser = commands.add_parser(
+        "generate", help="Write a synthetic study (consent, demographic, task and exit tables).")
+    generate_parser.add_argument("--out", default="synthetic_data", help="Folder to write the CSV files to")
+    generate_parser.add_argument("--participants", type=int, default=1000, help="Participants to generate")
+    generate_parser.add_argument("--tasks", type=int, default=3, help="Task rows per participant")
+    generate_parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    generate_parser.add_argument("--force", action="store_true", help="Allow writing over the real data folder")
+    generate_parser.set_defaults(func=generate)
+
+    benchmark_parser = commands.add_parser(
+        "benchmark", help="Time saves, loads and the report on a synthetic study; prints JSON.")
+    benchmark_parser.add_argument("--participants", type=int, default=10000, help="Synthetic participants")
+    benchmark_parser.add_argument("--saves", type=int, default=1000, help="Task records to save")
+    benchmark_parser.add_argument("--repeats", type=int, default=5, help="Repeats of each read and report stage")
+    benchmark_parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    benchmark_parser.add_argument("--output", help="Also write the JSON results to this file")
+    benchmark_parser.set_defaults(func=benchmark)
+
+    task_times_parser = commands.add_parser(
+        "task-times", help="Derive task durations and time-on-step from the interaction event log.")
+    task_times_parser.add_argument("--events", default=os.path.join(storage.DATA_FOLDER, "events.jsonl"),
+                                   help="Event log to read")
+    task_times_parser.add_argument("--output", help="Write one row per task attempt to this CSV file")
+    task_times_parser.set_defaults(func=task_times)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
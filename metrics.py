@@ -0,0 +1,146 @@
+import contextlib
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Per-section timing of the app (tab bodies, loads and saves, charts, tables).
+# Off unless the server is started with APP_METRICS=1; while off, timed()
+# hands back one shared no-op context manager, so instrumented code pays a
+# function call and nothing else.
+ENABLED = os.environ.get("APP_METRICS", "0") == "1"
+
+# Prometheus text-format file the histograms are written to, for a local
+# scraper (node_exporter's textfile collector or similar), next to the data
+PROMETHEUS_FILE = os.environ.get("APP_METRICS_FILE", os.path.join("data", "metrics.prom"))
+EXPORT_INTERVAL = 15.0
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Samples kept per section for the rolling percentiles in the admin panel
+WINDOW = 1000
+
+
+class Histogram:
+    # Cumulative bucket counts (what Prometheus scrapes) plus the most recent
+    # samples, from which the admin panel's rolling percentiles are computed
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def percentile(q):
+            return recent[min(len(recent) - 1, int(len(recent) * q))] * 1000
+
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000,
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": recent[-1] * 1000,
+        }
+
+
+class Registry:
+    def __init__(self, path=PROMETHEUS_FILE, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._sections = {}
+        self._lock = threading.Lock()
+        self._next_export = time.monotonic() + interval
+
+    def observe(self, section, seconds):
+        with self._lock:
+            histogram = self._sections.get(section)
+            if histogram is None:
+                histogram = self._sections[section] = Histogram()
+            histogram.observe(seconds)
+            due = time.monotonic() >= self._next_export
+            if due:
+                self._next_export = time.monotonic() + self.interval
+        if due:
+            self.export()
+
+    def summary(self):
+        # {section: rolling summary}, sorted by section name
+        with self._lock:
+            return {section: self._sections[section].summary() for section in sorted(self._sections)}
+
+    def reset(self):
+        with self._lock:
+            self._sections.clear()
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP usability_section_seconds Time spent in each instrumented section of the app.",
+            "# TYPE usability_section_seconds histogram",
+        ]
+        with self._lock:
+            for section in sorted(self._sections):
+                histogram = self._sections[section]
+                label = _label(section)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'usability_section_seconds_bucket{{section="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'usability_section_seconds_sum{{section="{label}"}} {histogram.total}')
+                lines.append(f'usability_section_seconds_count{{section="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        # Written to a temporary file and renamed, so a scraper never reads a
+        # half-written file
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Timer:
+    __slots__ = ("section", "start")
+
+    def __init__(self, section):
+        self.section = section
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(self.section, time.perf_counter() - self.start)
+        return False
+
+
+registry = Registry()
+_noop = contextlib.nullcontext()
+
+
+def timed(section, detail=None):
+    # with timed("load_from_csv", csv_file): ... records the time spent in the
+    # block under "load_from_csv/<file name>"
+    if not ENABLED:
+        return _noop
+    if detail is not None:
+        section = f"{section}/{os.path.basename(detail)}"
+    return _Timer(section)
@@ -0,0 +1,215 @@
+import contextlib
+import csv
+import io
+import os
+import sqlite3
+import threading
+import uuid
+
+from lazy_imports import lazy_import
+from storage import CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, DATA_FOLDER, TABLE_COLUMNS, file_lock
+
+pd = lazy_import("pandas")
+
+PARTICIPANT_INDEX_DB = os.path.join(DATA_FOLDER, "participant_index.db")
+
+
+def new_participant_id():
+    return uuid.uuid4().hex
+
+
+def _record_offsets(data):
+    # Byte offset of every CSV record in data, header included. A record can
+    # span several lines when a quoted answer contains newlines; a line ends a
+    # record once the quotes seen so far are balanced.
+    offsets = []
+    position = 0
+    quotes = 0
+    for line in data.splitlines(keepends=True):
+        if quotes % 2 == 0:
+            offsets.append(position)
+            quotes = 0
+        quotes += line.count(b'"')
+        position += len(line)
+    return offsets
+
+
+class ParticipantIndex:
+    # Persistent participant ID -> record index for the CSV tables. For every
+    # record it stores the table and the byte offset the record starts at, so one
+    # participant's records (or a join across the four tables) are a keyed lookup
+    # plus a seek per record instead of a scan of every file. The writer keeps it
+    # up to date while it holds the table's lock; a table whose size no longer
+    # matches what the index last saw (edited or rewritten outside the writer)
+    # is re-indexed on the next lookup.
+
+    def __init__(self, db_path=PARTICIPANT_INDEX_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS records (participant_id TEXT, tbl TEXT, offset INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_records_participant ON records (participant_id);
+            CREATE TABLE IF NOT EXISTS files (tbl TEXT PRIMARY KEY, size INTEGER);
+        """)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def add(self, csv_file, records, offsets):
+        # Called by the writer with the offsets of the records it just appended
+        # (plus the new end of file) while the table is still locked
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            known = connection.execute("SELECT size FROM files WHERE tbl = ?", (csv_file,)).fetchone()
+            if known is None or known[0] != offsets[0]:
+                # The index hasn't seen everything before these records
+                self._reindex(connection, csv_file)
+            else:
+                rows = [(record.get("participant_id"), csv_file, offset)
+                        for record, offset in zip(records, offsets) if record.get("participant_id")]
+                connection.executemany("INSERT INTO records VALUES (?, ?, ?)", rows)
+                connection.execute("UPDATE files SET size = ? WHERE tbl = ?", (offsets[-1], csv_file))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _reindex(self, connection, csv_file):
+        connection.execute("DELETE FROM records WHERE tbl = ?", (csv_file,))
+        try:
+            with open(csv_file, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            connection.execute("DELETE FROM files WHERE tbl = ?", (csv_file,))
+            return
+        offsets = _record_offsets(data)
+        if offsets:
+            header = next(csv.reader([data[:offsets[1] if len(offsets) > 1 else len(data)].decode("utf-8")]))
+            if "participant_id" in header:
+                column = header.index("participant_id")
+                rows = []
+                for start, end in zip(offsets[1:], offsets[2:] + [len(data)]):
+                    values = next(csv.reader(io.StringIO(data[start:end].decode("utf-8"))), [])
+                    if len(values) > column and values[column]:
+                        rows.append((values[column], csv_file, start))
+                connection.executemany("INSERT INTO records VALUES (?, ?, ?)", rows)
+        connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (csv_file, len(data)))
+
+    def _refresh(self, csv_file):
+        connection = self._connection()
+        known = connection.execute("SELECT size FROM files WHERE tbl = ?", (csv_file,)).fetchone()
+        try:
+            size = os.path.getsize(csv_file)
+        except FileNotFoundError:
+            size = None
+        if (known[0] if known else None) == size:
+            return
+        if size is None:
+            self._reindex_locked(connection, csv_file)
+            return
+        # Same lock order as the writer: the table first, then the index
+        with open(csv_file, "rb") as f, file_lock(f, exclusive=False):
+            self._reindex_locked(connection, csv_file)
+
+    def _reindex_locked(self, connection, csv_file):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._reindex(connection, csv_file)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def offsets(self, participant_id):
+        for csv_file in TABLE_COLUMNS:
+            self._refresh(csv_file)
+        found = {csv_file: [] for csv_file in TABLE_COLUMNS}
+        for csv_file, offset in self._connection().execute(
+                "SELECT tbl, offset FROM records WHERE participant_id = ? ORDER BY offset", (participant_id,)):
+            found.setdefault(csv_file, []).append(offset)
+        return {csv_file: offsets for csv_file, offsets in found.items() if offsets}
+
+    def records(self, participant_id):
+        # {csv_file: DataFrame} of the participant's records, read by seeking
+        result = {}
+        for csv_file, offsets in self.offsets(participant_id).items():
+            with open(csv_file, "rb") as f, file_lock(f, exclusive=False):
+                header = f.readline()
+                chunks = []
+                for offset in offsets:
+                    f.seek(offset)
+                    chunks.append(_read_record(f))
+            result[csv_file] = pd.read_csv(io.BytesIO(header + b"".join(chunks)))
+        return result
+
+
+def _read_record(f):
+    record = b""
+    while True:
+        line = f.readline()
+        record += line
+        if not line or record.count(b'"') % 2 == 0:
+            return record
+
+
+def backfill_participant_ids():
+    # Legacy rows were saved before participant IDs existed. Give each
+    # demographic row an ID, and each task row the ID of the one demographic row
+    # with the same name. Rows nothing links for certain (consent and exit rows,
+    # which carry no name, and task rows whose name matches no one or several
+    # people) are left without an ID rather than given a guessed one.
+    # Rows that already have an ID are left alone. All four tables are read and
+    # rewritten while locked, so no record saved meanwhile can be lost. Returns
+    # (rows given an ID, rows still without one) per table.
+    with contextlib.ExitStack() as stack:
+        handles, frames = {}, {}
+        for csv_file in TABLE_COLUMNS:
+            try:
+                f = stack.enter_context(open(csv_file, "r+", newline="", encoding="utf-8"))
+            except FileNotFoundError:
+                frames[csv_file] = pd.DataFrame()
+                continue
+            stack.enter_context(file_lock(f))
+            handles[csv_file] = f
+            try:
+                frames[csv_file] = pd.read_csv(f, dtype=str, keep_default_na=False)
+            except pd.errors.EmptyDataError:
+                frames[csv_file] = pd.DataFrame()
+        for frame in frames.values():
+            if not frame.empty and "participant_id" not in frame:
+                frame["participant_id"] = ""
+
+        updated = dict.fromkeys(TABLE_COLUMNS, 0)
+        demographics = frames[DEMOGRAPHIC_CSV]
+        if not demographics.empty:
+            missing = demographics["participant_id"] == ""
+            demographics.loc[missing, "participant_id"] = [new_participant_id() for _ in range(missing.sum())]
+            updated[DEMOGRAPHIC_CSV] = int(missing.sum())
+
+            people = {}
+            for name, participant_id in zip(demographics["name"], demographics["participant_id"]):
+                people.setdefault(name.strip().lower(), set()).add(participant_id)
+            tasks = frames[TASKS_CSV]
+            if not tasks.empty:
+                for row in tasks.index[tasks["participant_id"] == ""]:
+                    matches = people.get(str(tasks.at[row, "name"]).strip().lower(), set())
+                    if len(matches) == 1:
+                        tasks.at[row, "participant_id"] = next(iter(matches))
+                        updated[TASKS_CSV] += 1
+
+        for csv_file, f in handles.items():
+            if updated[csv_file]:
+                f.seek(0)
+                f.write(frames[csv_file].to_csv(index=False, lineterminator="\n"))
+                f.truncate()
+
+    unmatched = {csv_file: int((frame["participant_id"] == "").sum()) if not frame.empty else 0
+                 for csv_file, frame in frames.items()}
+    return {csv_file: (updated[csv_file], unmatched[csv_file]) for csv_file in TABLE_COLUMNS}
@@ -0,0 +1,283 @@
+import csv
+import datetime
+import importlib.util
+import os
+import re
+import sqlite3
+import threading
+
+from lazy_imports import lazy_import
+from storage import (CHUNK_ROWS, DATA_FOLDER, FREE_TEXT_COLUMNS, FSYNC_EVERY, STUDY, TABLE_COLUMNS, CsvCache,
+                     RecordWriter, StorageBackend, _compact, _csv_chunks, _select, file_lock)
+
+pd = lazy_import("pandas")
+
+PARTITION_FOLDER = os.path.join(DATA_FOLDER, "partitions")
+
+# Compacted partitions are Parquet files, which pandas writes through pyarrow.
+# It is optional: without it partitions simply stay CSV.
+ARCHIVE_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+ARCHIVE_COMPRESSION = "zstd"
+
+# Formats tried after ISO 8601; the first rows of the study were saved as
+# "6/14/2025 11:03"
+TIMESTAMP_FORMATS = ["%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%m/%d/%Y"]
+
+
+def iso_timestamp(timestamp):
+    # A record's timestamp as "YYYY-MM-DD HH:MM:SS", or None when it has no
+    # usable one. ISO timestamps (what the app saves) and the formats above
+    # are parsed without pandas, which only reads anything else.
+    text = "" if timestamp is None else str(timestamp).strip()
+    if not text:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        parsed = None
+        for timestamp_format in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.datetime.strptime(text, timestamp_format)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            parsed = pd.to_datetime(text, errors="coerce")
+            if pd.isna(parsed):
+                return None
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def partition_day(timestamp):
+    # The day a record is filed under: the date of its timestamp, or today for
+    # a record without a usable one
+    return (iso_timestamp(timestamp) or datetime.date.today().isoformat())[:10]
+
+
+def _table_folder(csv_file):
+    return os.path.splitext(os.path.basename(csv_file))[0]
+
+
+def _study_folder(study):
+    return re.sub(r"[^\w.-]+", "_", study) or "_"
+
+
+class Manifest:
+    # Every partition file with what it holds: its table, study and day, its
+    # format ("csv" or "parquet"), row count, first and last timestamp and size.
+    # Kept in SQLite next to the partitions and updated by the writer while it
+    # holds the partition's lock, so reads can pick partitions (and count rows)
+    # without opening any of them.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS partitions (
+                path TEXT PRIMARY KEY, tbl TEXT, study TEXT, day TEXT, format TEXT, rows INTEGER,
+                first_timestamp TEXT, last_timestamp TEXT, bytes INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_partitions_table_day ON partitions (tbl, day);
+        """)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def add(self, path, csv_file, study, day, records, size, file_format="csv"):
+        timestamps = [timestamp for timestamp in map(iso_timestamp, (record.get("timestamp") for record in records))
+                      if timestamp]
+        first, last = (min(timestamps), max(timestamps)) if timestamps else (None, None)
+        self._connection().execute(
+            "INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+            "rows = rows + excluded.rows, bytes = excluded.bytes, "
+            "first_timestamp = coalesce(min(first_timestamp, excluded.first_timestamp), first_timestamp, "
+            "excluded.first_timestamp), "
+            "last_timestamp = coalesce(max(last_timestamp, excluded.last_timestamp), last_timestamp, "
+            "excluded.last_timestamp)",
+            (path, csv_file, study, day, file_format, len(records), first, last, size))
+
+    def replace(self, path, new_path, file_format, frame, size):
+        # Point a partition's entry at the file that now holds its rows (frame)
+        timestamps = frame["timestamp"].map(iso_timestamp).dropna() if "timestamp" in frame else pd.Series(dtype=str)
+        self._connection().execute(
+            "UPDATE partitions SET path = ?, format = ?, rows = ?, first_timestamp = ?, last_timestamp = ?, "
+            "bytes = ? WHERE path = ?",
+            (new_path, file_format, len(frame), timestamps.min() if len(timestamps) else None,
+             timestamps.max() if len(timestamps) else None, size, path))
+
+    def remove(self, path):
+        self._connection().execute("DELETE FROM partitions WHERE path = ?", (path,))
+
+    def partitions(self, csv_file=None, studies=None, start=None, end=None):
+        # The partitions matching the filters (days as "YYYY-MM-DD", both ends
+        # included), in day order
+        clauses, params = [], []
+        if csv_file is not None:
+            clauses.append("tbl = ?")
+            params.append(csv_file)
+        if studies is not None:
+            clauses.append(f"study IN ({', '.join('?' for _ in studies)})")
+            params.extend(studies)
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return pd.read_sql_query(f"SELECT * FROM partitions{where} ORDER BY day, study, format DESC, path",
+                                 self._connection(), params=params)
+
+
+class PartitionedBackend(StorageBackend):
+    # Each table split into one CSV per study and day under PARTITION_FOLDER:
+    #   partitions/<table>/<study>/<YYYY-MM-DD>.csv
+    # New records go to the partition of the configured STUDY and the day of
+    # their timestamp. Reads filtered to some studies or days only open the
+    # matching partitions (found in the manifest), and row counts come from the
+    # manifest alone. Partitions of past days can be compacted into Parquet
+    # archives, which are read alongside the CSVs.
+
+    def __init__(self, folder=PARTITION_FOLDER, study=None, fsync_every=FSYNC_EVERY):
+        self.folder = folder
+        self.study = study or STUDY
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = Manifest(os.path.join(folder, "manifest.db"))
+        self.cache = CsvCache()
+        self.writer = RecordWriter(fsync_every)
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    def partition_path(self, csv_file, study, day, file_format="csv"):
+        return os.path.join(self.folder, _table_folder(csv_file), _study_folder(study), f"{day}.{file_format}")
+
+    def append(self, csv_file, records, after_write=None, study=None):
+        study = study or self.study
+        days = {}
+        for record in records:
+            days.setdefault(partition_day(record.get("timestamp")), []).append(record)
+        for day, day_records in days.items():
+            path = self.partition_path(csv_file, study, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            def written(partition, partition_records, offsets):
+                self.manifest.add(partition, csv_file, study, day, partition_records, offsets[-1])
+                if after_write is not None:
+                    after_write(csv_file, partition_records)
+
+            self.writer.write_many(path, day_records, written, table=csv_file)
+
+    def _read_archive(self, path, free_text):
+        # Archives never change once written, so each is read once per shape
+        key = (path, free_text)
+        with self._lock:
+            frame = self._archives.get(key)
+        if frame is None:
+            frame = pd.read_parquet(path)
+            if not free_text:
+                frame = frame[[column for column in frame.columns if column not in FREE_TEXT_COLUMNS]]
+            frame = _compact(frame)
+            with self._lock:
+                self._archives[key] = frame
+        return frame.copy(deep=False)
+
+    def load(self, csv_file, columns=None, where=None, studies=None, start=None, end=None):
+        free_text = columns is None or any(column in FREE_TEXT_COLUMNS for column in columns)
+        frames = []
+        for path, file_format in self.manifest.partitions(csv_file, studies, start, end)[["path", "format"]].values:
+            frame = self.cache.load(path, free_text) if file_format == "csv" else self._read_archive(path, free_text)
+            if not frame.empty:
+                frames.append(frame)
+        if not frames:
+            frame = pd.DataFrame(columns=TABLE_COLUMNS[csv_file])
+        elif len(frames) == 1:
+            frame = frames[0]
+        else:
+            frame = _compact(pd.concat(frames, ignore_index=True))
+        return _select(frame, columns, where)
+
+    def chunks(self, csv_file, rows=CHUNK_ROWS, studies=None, start=None, end=None):
+        # Partition by partition, every record tagged with the study it belongs to
+        partitions = self.manifest.partitions(csv_file, studies, start, end)
+        for path, study, file_format in partitions[["path", "study", "format"]].values:
+            if file_format == "csv":
+                parts = _csv_chunks(path, rows)
+            else:
+                import pyarrow.parquet as pq
+                parts = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(rows))
+            for chunk in parts:
+                chunk["study"] = study
+                yield chunk
+
+    def count(self, csv_file, studies=None, start=None, end=None):
+        return int(self.manifest.partitions(csv_file, studies, start, end)["rows"].sum())
+
+    def partition_paths(self, studies=None, start=None, end=None):
+        # {table: [partition file, ...]} of the partitions matching the filters
+        partitions = self.manifest.partitions(None, studies, start, end)
+        return {csv_file: partitions.loc[partitions["tbl"] == csv_file, "path"].tolist() for csv_file in TABLE_COLUMNS}
+
+    def compact(self, before, studies=None):
+        # Rewrite the CSV partitions of days before the given day as
+        # compressed Parquet archives. Returns the partitions compacted.
+        if not ARCHIVE_AVAILABLE:
+            raise RuntimeError("Compacting partitions needs pyarrow (pip install pyarrow)")
+        partitions = self.manifest.partitions(None, studies, end=before)
+        partitions = partitions[(partitions["format"] == "csv") & (partitions["day"] < before)]
+        for path, csv_file, study, day in partitions[["path", "tbl", "study", "day"]].values:
+            archive = self.partition_path(csv_file, study, day, "parquet")
+            with open(path, "rb") as f, file_lock(f):
+                frame = pd.read_csv(f)
+                if os.path.exists(archive):
+                    # Rows that arrived for the day after it was compacted
+                    frame = pd.concat([pd.read_parquet(archive), frame], ignore_index=True)
+                    self.manifest.remove(archive)
+                temporary = archive + ".tmp"
+                frame.to_parquet(temporary, compression=ARCHIVE_COMPRESSION, index=False)
+                os.replace(temporary, archive)
+                self.manifest.replace(path, archive, "parquet", frame, os.path.getsize(archive))
+                # Removed while still locked: a writer waiting for the lock
+                # notices and starts a new CSV for the day
+                os.remove(path)
+        with self._lock:
+            self._archives.clear()
+        return len(partitions)
+
+    def clear(self):
+        # Delete every partition and its manifest entry (before importing the
+        # flat CSVs again)
+        for path in self.manifest.partitions()["path"]:
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # Already gone, or the study's folder still holds other days
+                pass
+            self.manifest.remove(path)
+        self.cache.clear()
+        with self._lock:
+            self._archives.clear()
+
+    def import_csvs(self, paths=None, study=None, batch_size=10000):
+        # Copy flat table CSVs (the "csv" backend's files by default) into
+        # partitions of the given study. Returns rows imported per table.
+        imported = {}
+        for csv_file, path in (paths or {csv_file: csv_file for csv_file in TABLE_COLUMNS}).items():
+            imported[csv_file] = 0
+            if not os.path.exists(path):
+                continue
+            with open(path, newline="", encoding="utf-8") as f:
+                batch = []
+                for record in csv.DictReader(f):
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        self.append(csv_file, batch, study=study)
+                        imported[csv_file] += len(batch)
+                        batch = []
+                self.append(csv_file, batch, study=study)
+                imported[csv_file] += len(batch)
+        return imported
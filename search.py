@@ -0,0 +1,294 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from lazy_imports import lazy_import
+from storage import TASKS_CSV, EXIT_CSV, DATA_FOLDER, get_backend
+
+pd = lazy_import("pandas")
+
+SEARCH_DB = os.path.join(DATA_FOLDER, "search.db")
+
+# The typed answers that can be searched, as (table, column); the position in
+# this list is the field's code in the index, so only ever append to it
+SEARCH_FIELDS = [
+    (TASKS_CSV, "step_one"),
+    (TASKS_CSV, "step_two"),
+    (TASKS_CSV, "step_three"),
+    (TASKS_CSV, "feedback"),
+    (EXIT_CSV, "design"),
+    (EXIT_CSV, "improvements"),
+    (EXIT_CSV, "open_feedback"),
+]
+
+# Left out of the most frequent terms; they are still searchable
+STOP_WORDS = {
+    "a", "about", "after", "all", "also", "an", "and", "any", "are", "as", "at", "be", "because", "been", "but",
+    "by", "can", "could", "did", "do", "does", "for", "from", "had", "has", "have", "i", "if", "in", "into", "is",
+    "it", "its", "just", "me", "more", "my", "no", "not", "of", "on", "one", "or", "so", "some", "than", "that",
+    "the", "their", "them", "then", "there", "these", "they", "this", "to", "too", "up", "very", "was", "we",
+    "were", "what", "when", "which", "while", "will", "with", "would", "you", "your",
+}
+
+# Every answer's rowid is (participant number, record of that participant,
+# field code) packed into one integer. Counting matches per field or per
+# participant then only needs the rowids of the matching answers, which come
+# straight from the index, without reading any stored answer.
+FIELD_BITS = 3
+RECORD_BITS = 24
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def terms(text):
+    # Words of text as the index sees them (SQLite's unicode61 tokenizer):
+    # lower case, accents removed, split on anything but letters and digits
+    text = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"[^\W_]+", "".join(ch for ch in text if not unicodedata.combining(ch)))
+
+
+def match_expression(query):
+    # Turn what a researcher types into an FTS5 query: all the words must
+    # appear (in any order, any case), "quoted words" must appear together as a
+    # phrase, a trailing * matches any word starting with it and OR between two
+    # terms accepts either. Punctuation is ignored, so date-picker finds
+    # "date picker" too.
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', query):
+        if word == "OR":
+            if parts and parts[-1] != "OR":
+                parts.append("OR")
+            continue
+        words = terms(phrase or word)
+        if words:
+            parts.append('"' + " ".join(words) + '"' + ("*" if word.endswith("*") else ""))
+    while parts and parts[-1] == "OR":
+        parts.pop()
+    return " ".join(parts)
+
+
+class SearchIndex:
+    # SQLite FTS5 inverted index over the typed answers in SEARCH_FIELDS, kept
+    # next to the data, plus a running count of every word for the frequency
+    # summary. Every non-empty answer is one document. add() is called from the
+    # save path with the records that were just written, so a query only reads
+    # the posting lists of its terms and never the tables.
+
+    # Bump when the tables or their meaning change; older indexes are rebuilt
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path=SEARCH_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            if self.db_path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version[0]) != self.SCHEMA_VERSION:
+            connection.executescript(f"""
+                DROP TABLE IF EXISTS answers_vocab;
+                DROP TABLE IF EXISTS answers;
+                DROP TABLE IF EXISTS participants;
+                DROP TABLE IF EXISTS term_counts;
+                DELETE FROM meta;
+                INSERT INTO meta VALUES ('version', '{self.SCHEMA_VERSION}');
+            """)
+        connection.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS answers USING fts5 (
+                text, task UNINDEXED, timestamp UNINDEXED, tokenize = 'unicode61 remove_diacritics 2');
+            CREATE VIRTUAL TABLE IF NOT EXISTS answers_vocab USING fts5vocab (answers, 'row');
+            CREATE TABLE IF NOT EXISTS participants (number INTEGER PRIMARY KEY, participant_id TEXT UNIQUE,
+                                                     records INTEGER);
+            CREATE TABLE IF NOT EXISTS term_counts (term TEXT PRIMARY KEY, occurrences INTEGER, answers INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_term_counts_occurrences ON term_counts (occurrences);
+        """)
+
+    def is_built(self):
+        return self._connection().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+    def _documents(self, csv_file, records, next_record):
+        # (rowid, text, task, timestamp) of every answer in records;
+        # next_record(participant_id) numbers each participant's records
+        fields = [(code, column) for code, (table, column) in enumerate(SEARCH_FIELDS) if table == csv_file]
+        for record in records:
+            answers = [(code, _text(record.get(column))) for code, column in fields]
+            answers = [(code, text) for code, text in answers if text is not None]
+            if not answers:
+                continue
+            number, seq = next_record(_text(record.get("participant_id")) or "")
+            for code, text in answers:
+                rowid = (number << (RECORD_BITS + FIELD_BITS)) | (seq << FIELD_BITS) | code
+                yield rowid, text, _text(record.get("task_name")), _text(record.get("timestamp"))
+
+    def add(self, csv_file, records):
+        if not records or all(table != csv_file for table, _ in SEARCH_FIELDS):
+            return
+        connection = self._connection()
+
+        def next_record(participant_id):
+            connection.execute("INSERT OR IGNORE INTO participants (participant_id, records) VALUES (?, 0)",
+                               (participant_id,))
+            number, seq = connection.execute("SELECT number, records FROM participants WHERE participant_id = ?",
+                                             (participant_id,)).fetchone()
+            connection.execute("UPDATE participants SET records = records + 1 WHERE number = ?", (number,))
+            return number, seq
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            documents = list(self._documents(csv_file, records, next_record))
+            connection.executemany("INSERT INTO answers (rowid, text, task, timestamp) VALUES (?, ?, ?, ?)",
+                                   documents)
+            counts = {}
+            for _, text, _, _ in documents:
+                words = terms(text)
+                for word in set(words):
+                    occurrences, answers = counts.get(word, (0, 0))
+                    counts[word] = (occurrences + words.count(word), answers + 1)
+            connection.executemany(
+                "INSERT INTO term_counts VALUES (?, ?, ?) ON CONFLICT (term) DO UPDATE SET "
+                "occurrences = occurrences + excluded.occurrences, answers = answers + excluded.answers",
+                [(word, occurrences, answers) for word, (occurrences, answers) in counts.items()])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def rebuild(self, backend=None):
+        # Index every answer in the tables again; returns the answers indexed
+        backend = backend or get_backend()
+        connection = self._connection()
+        numbers = {}
+
+        def next_record(participant_id):
+            number, seq = numbers.get(participant_id, (len(numbers) + 1, 0))
+            numbers[participant_id] = (number, seq + 1)
+            return number, seq
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("answers", "participants", "term_counts"):
+                connection.execute(f"DELETE FROM {table}")
+            for csv_file in dict.fromkeys(table for table, _ in SEARCH_FIELDS):
+                columns = ["participant_id", "timestamp"] + (["task_name"] if csv_file == TASKS_CSV else [])
+                columns += [column for table, column in SEARCH_FIELDS if table == csv_file]
+                frame = backend.load(csv_file, columns)
+                if not frame.empty:
+                    records = frame.astype(object).where(frame.notna(), None).to_dict("records")
+                    connection.executemany("INSERT INTO answers (rowid, text, task, timestamp) VALUES (?, ?, ?, ?)",
+                                           self._documents(csv_file, records, next_record))
+            connection.executemany("INSERT INTO participants VALUES (?, ?, ?)",
+                                   [(number, participant_id, seq)
+                                    for participant_id, (number, seq) in numbers.items()])
+            connection.execute("INSERT INTO term_counts SELECT term, cnt, doc FROM answers_vocab")
+            connection.execute("INSERT INTO answers (answers) VALUES ('optimize')")
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('built', datetime('now'))")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return connection.execute("SELECT count(*) FROM answers").fetchone()[0]
+
+    def _participant_ids(self, numbers):
+        connection = self._connection()
+        found = {}
+        numbers = [int(number) for number in numbers]
+        # In batches below SQLite's limit on bound parameters
+        for start in range(0, len(numbers), 10000):
+            batch = numbers[start:start + 10000]
+            placeholders = ", ".join("?" for _ in batch)
+            found.update(connection.execute(
+                f"SELECT number, participant_id FROM participants WHERE number IN ({placeholders})", batch))
+        return found
+
+    def search(self, query, limit=100):
+        # Answers matching query (see match_expression()), the most recently
+        # seen participants first, with the matching words marked [like this]
+        # in a short excerpt
+        columns = ["tbl", "field", "participant_id", "task", "timestamp", "excerpt"]
+        expression = match_expression(query)
+        if not expression:
+            return pd.DataFrame(columns=columns)
+        rows = self._connection().execute(
+            "SELECT rowid, task, timestamp, snippet(answers, 0, '[', ']', '...', 16) FROM answers "
+            "WHERE answers MATCH ? ORDER BY rowid DESC LIMIT ?", (expression, limit)).fetchall()
+        ids = self._participant_ids({rowid >> (RECORD_BITS + FIELD_BITS) for rowid, *_ in rows})
+        return pd.DataFrame(
+            [SEARCH_FIELDS[rowid & ((1 << FIELD_BITS) - 1)]
+             + (ids.get(rowid >> (RECORD_BITS + FIELD_BITS)) or None, task, timestamp, excerpt)
+             for rowid, task, timestamp, excerpt in rows], columns=columns)
+
+    def match_counts(self, query):
+        # (answers matching query per table and field, distinct participants
+        # with a matching answer). Both are worked out from the rowids alone.
+        columns = ["tbl", "field", "answers"]
+        expression = match_expression(query)
+        if not expression:
+            return pd.DataFrame(columns=columns), 0
+        connection = self._connection()
+        shift = RECORD_BITS + FIELD_BITS
+        rows = connection.execute(
+            f"SELECT rowid & {(1 << FIELD_BITS) - 1}, count(*) FROM answers WHERE answers MATCH ? "
+            "GROUP BY 1 ORDER BY 2 DESC", (expression,)).fetchall()
+        participants = connection.execute(f"SELECT count(DISTINCT rowid >> {shift}) FROM answers WHERE answers MATCH ?",
+                                          (expression,)).fetchone()[0]
+        # Answers saved without a participant ID share one number; it is not a participant
+        anonymous = connection.execute("SELECT number FROM participants WHERE participant_id = ''").fetchone()
+        if anonymous and connection.execute(
+                "SELECT 1 FROM answers WHERE answers MATCH ? AND rowid BETWEEN ? AND ? LIMIT 1",
+                (expression, anonymous[0] << shift, ((anonymous[0] + 1) << shift) - 1)).fetchone():
+            participants -= 1
+        return pd.DataFrame([SEARCH_FIELDS[code] + (n,) for code, n in rows], columns=columns), participants
+
+    def participants(self, query):
+        # IDs of every participant with at least one answer matching query
+        expression = match_expression(query)
+        if not expression:
+            return []
+        return [participant_id for (participant_id,) in self._connection().execute(
+            f"SELECT participant_id FROM participants WHERE participant_id != '' AND number IN ("
+            f"SELECT rowid >> {RECORD_BITS + FIELD_BITS} FROM answers WHERE answers MATCH ?) "
+            "ORDER BY participant_id", (expression,))]
+
+    def top_terms(self, limit=20):
+        # The most frequent words over all answers: how often each occurs and
+        # in how many answers, stop words left out
+        placeholders = ", ".join("?" for _ in STOP_WORDS)
+        rows = self._connection().execute(
+            f"SELECT term, occurrences, answers FROM term_counts WHERE term NOT IN ({placeholders}) "
+            "AND length(term) > 1 ORDER BY occurrences DESC LIMIT ?", (*sorted(STOP_WORDS), limit)).fetchall()
+        return pd.DataFrame(rows, columns=["term", "occurrences", "answers"])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    # The first use indexes whatever data already exists
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = SearchIndex()
+                if not index.is_built():
+                    index.rebuild()
+                _index = index
+    return _index
@@ -0,0 +1,89 @@
+import math
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Quantile sketch for task durations, in the style of DDSketch (Masson et al.,
+# "DDSketch: A Fast and Fully-Mergeable Quantile Sketch with Relative-Error
+# Guarantees", VLDB 2019). A value x > 0 is counted in bucket ceil(log_g(x))
+# with g = (1 + a) / (1 - a); every bucket covers (g^(i-1), g^i] and is read
+# back as 2 g^i / (g + 1), which is within a relative error a of any value
+# in it. So:
+#
+#   * every quantile returned is within RELATIVE_ACCURACY (1%) of the true
+#     quantile of the data (the value of rank floor(q * (n - 1)) in sorted
+#     order), whatever the distribution, skew or number of values;
+#   * values of ZERO_THRESHOLD (1 ms) or less are counted together and read
+#     back as 0;
+#   * the number of buckets only depends on the range of the data: durations
+#     from 1 ms to a week need at most ~1000 buckets per task, so adding a
+#     value and reading a quantile cost the same for 10 or 10 million tasks;
+#   * sketches are merged by adding bucket counts, so per-process, per-chunk
+#     or per-site sketches combine without losing accuracy.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+ZERO_THRESHOLD = 0.001
+ZERO_BUCKET = "zero"
+
+# Bins of the duration histogram in the report, in seconds
+HISTOGRAM_EDGES = [0, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, math.inf]
+
+
+def bucket_key(value):
+    # Key of the bucket value falls in, as stored in the aggregate counters
+    if value <= ZERO_THRESHOLD:
+        return ZERO_BUCKET
+    return str(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def bucket_keys(values):
+    # bucket_key() for a Series of values (missing values stay missing)
+    values = pd.to_numeric(values, errors="coerce")
+    keys = pd.Series(ZERO_BUCKET, index=values.index, dtype=object)
+    positive = values > ZERO_THRESHOLD
+    indexes = np.ceil(np.log(values[positive].to_numpy(dtype="float64")) / LOG_GAMMA).astype("int64")
+    keys[positive] = indexes.astype(str)
+    return keys.where(values.notna())
+
+
+def bucket_value(key):
+    if key == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+
+def quantiles(buckets, qs):
+    # Quantiles of the values counted in buckets ({bucket key: count}); NaN for
+    # an empty sketch
+    ordered = sorted((bucket_value(key), n) for key, n in buckets.items() if n)
+    total = sum(n for _, n in ordered)
+    result = []
+    for q in qs:
+        if not total:
+            result.append(float("nan"))
+            continue
+        rank = q * (total - 1)
+        seen = 0
+        for value, n in ordered:
+            seen += n
+            if seen > rank:
+                result.append(value)
+                break
+    return result
+
+
+def histogram(buckets):
+    # Counts per HISTOGRAM_EDGES bin, labelled "0-5s", ..., "600s+"
+    labels = [f"{low:g}-{high:g}s" if high != math.inf else f"{low:g}s+"
+              for low, high in zip(HISTOGRAM_EDGES, HISTOGRAM_EDGES[1:])]
+    counts = dict.fromkeys(labels, 0)
+    for key, n in buckets.items():
+        value = bucket_value(key)
+        for label, high in zip(labels, HISTOGRAM_EDGES[1:]):
+            if value < high:
+                counts[label] += n
+                break
+    return pd.Series(counts, dtype="int64")
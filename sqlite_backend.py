@@ -0,0 +1,193 @@
+import math
+import sqlite3
+import threading
+
+from lazy_imports import lazy_import
+from storage import (CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, TABLE_COLUMNS,
+                     COLUMN_VOCABULARIES, CHUNK_ROWS, StorageBackend)
+
+pd = lazy_import("pandas")
+
+# SQLite table backing each CSV-named table
+TABLE_NAMES = {
+    CONSENT_CSV: "consent",
+    DEMOGRAPHIC_CSV: "demographics",
+    TASKS_CSV: "tasks",
+    EXIT_CSV: "exit_questionnaire",
+}
+
+# Declared column types; everything else is TEXT
+COLUMN_TYPES = {
+    "consent_given": "BOOLEAN",
+    "duration_seconds": "REAL",
+    "satisfaction": "INTEGER",
+    "difficulty": "INTEGER",
+    "confidence": "INTEGER",
+}
+
+# Columns the report filters, groups or joins on, plus the participant name
+INDEXES = {
+    "consent": ["timestamp", "participant_id"],
+    "demographics": ["timestamp", "name", "participant_id"],
+    "tasks": ["timestamp", "task_name", "name", "participant_id"],
+    "exit_questionnaire": ["timestamp", "participant_id"],
+}
+
+sqlite3.register_converter("BOOLEAN", lambda value: value == b"1")
+
+
+def _sql_value(column, value):
+    # Form values arrive as strings, so an empty duration means "no value"
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if value == "" and column in COLUMN_TYPES:
+        return None
+    return value
+
+
+class SqliteBackend(StorageBackend):
+    # All four tables in one SQLite database running in WAL mode, so readers
+    # never block the writer and several Streamlit processes can write safely.
+    # Filters and aggregations the report needs are answered with SQL.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        connection = self._connection()
+        with connection:
+            for csv_file, table in TABLE_NAMES.items():
+                columns = ", ".join(f'"{column}" {COLUMN_TYPES.get(column, "TEXT")}'
+                                    for column in TABLE_COLUMNS[csv_file])
+                connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+                # Databases created before a column existed get it added
+                existing = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+                for column in TABLE_COLUMNS[csv_file]:
+                    if column not in existing:
+                        connection.execute(
+                            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {COLUMN_TYPES.get(column, "TEXT")}')
+                for column in INDEXES[table]:
+                    connection.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON "{table}" ("{column}")')
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _table(self, csv_file):
+        try:
+            return TABLE_NAMES[csv_file]
+        except KeyError:
+            raise ValueError(f"{csv_file} is not a table known to the SQLite backend")
+
+    def append(self, csv_file, records, after_write=None):
+        # after_write runs before the rows are committed, so (as with the CSV
+        # writer's lock) no reader sees them before it has run
+        connection = self._connection()
+        with connection:
+            self._insert(connection, csv_file, records)
+            if after_write is not None:
+                after_write(csv_file, records)
+
+    def _insert(self, connection, csv_file, records):
+        columns = TABLE_COLUMNS[csv_file]
+        unknown = set().union(*records) - set(columns)
+        if unknown:
+            raise ValueError(f"Unknown column(s) for {csv_file}: {sorted(unknown)}")
+        rows = [[_sql_value(column, record.get(column)) for column in columns] for record in records]
+        placeholders = ", ".join("?" for _ in columns)
+        names = ", ".join(f'"{column}"' for column in columns)
+        connection.executemany(f'INSERT INTO "{self._table(csv_file)}" ({names}) VALUES ({placeholders})', rows)
+
+    def _where(self, where):
+        if not where:
+            return "", []
+        clause = " AND ".join(f'"{column}" = ?' for column in where)
+        return f" WHERE {clause}", list(where.values())
+
+    def _query(self, sql, params=()):
+        return pd.read_sql_query(sql, self._connection(), params=params)
+
+    def load(self, csv_file, columns=None, where=None):
+        names = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+        clause, params = self._where(where)
+        return self._query(f'SELECT {names} FROM "{self._table(csv_file)}"{clause} ORDER BY rowid', params)
+
+    def chunks(self, csv_file, rows=CHUNK_ROWS, start=None, end=None):
+        # One query read rows at a time; the day filter uses the timestamp index
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < date(?, '+1 day')")
+            params.append(end)
+        clause = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        yield from pd.read_sql_query(f'SELECT * FROM "{self._table(csv_file)}"{clause} ORDER BY rowid',
+                                     self._connection(), params=params, chunksize=rows)
+
+    def count(self, csv_file):
+        return self._connection().execute(f'SELECT COUNT(*) FROM "{self._table(csv_file)}"').fetchone()[0]
+
+    def read_page(self, csv_file, columns, sort_by=None, ascending=True, offset=0, limit=50, rows=None):
+        # Only the page itself is read from the database
+        table = self._table(csv_file)
+        names = ", ".join(f'"{column}"' for column in columns)
+        params = []
+        clause = ""
+        if rows is not None:
+            clause = f' WHERE rowid IN (SELECT rowid FROM "{table}" ORDER BY rowid LIMIT ?)'
+            params.append(rows)
+        order = []
+        if sort_by:
+            direction = "ASC" if ascending else "DESC"
+            # Same order as the CSV backend: empty values last, answers from a
+            # fixed list in form order, then the original row order
+            order.append(f'"{sort_by}" IS NULL')
+            vocabulary = COLUMN_VOCABULARIES.get(sort_by)
+            if vocabulary:
+                cases = " ".join("WHEN ? THEN ?" for _ in vocabulary)
+                order.append(f'CASE "{sort_by}" {cases} ELSE ? END {direction}')
+                for position, value in enumerate(vocabulary):
+                    params += [value, position]
+                params.append(len(vocabulary))
+            order.append(f'"{sort_by}" {direction}')
+        order.append("rowid")
+        params += [limit, offset]
+        return self._query(f'SELECT {names} FROM "{table}"{clause} ORDER BY {", ".join(order)} LIMIT ? OFFSET ?',
+                           params)
+
+    def import_csvs(self, force=False, chunksize=10000):
+        # One-shot migration of the CSV tables into the database. Returns the
+        # number of rows imported per table, or None when it already ran. With
+        # force the tables are emptied and imported again; it all happens in
+        # one transaction, so a failed import leaves the database as it was.
+        connection = self._connection()
+        done = connection.execute("SELECT value FROM meta WHERE key = 'csv_import'").fetchone()
+        if done and not force:
+            return None
+
+        imported = {}
+        with connection:
+            for csv_file, table in TABLE_NAMES.items():
+                imported[table] = 0
+                if force:
+                    connection.execute(f'DELETE FROM "{table}"')
+                try:
+                    chunks = pd.read_csv(csv_file, chunksize=chunksize)
+                except (FileNotFoundError, pd.errors.EmptyDataError):
+                    continue
+                for chunk in chunks:
+                    records = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+                    self._insert(connection, csv_file, records)
+                    imported[table] += len(records)
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_import', datetime('now'))")
+        return imported
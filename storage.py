@@ -0,0 +1,662 @@
+import csv
+import functools
+import io
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lazy_imports import lazy_import
+from metrics import timed
+from task_registry import get_tasks
+from write_queue import WriteBehindQueue
+
+pd = lazy_import("pandas")
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; writes are then only serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Create a folder called data in the main project folder
+DATA_FOLDER = "data"
+if not os.path.exists(DATA_FOLDER):
+    os.makedirs(DATA_FOLDER)
+
+# Define CSV file paths for each part of the usability testing
+CONSENT_CSV = os.path.join(DATA_FOLDER, "consent_data.csv")
+DEMOGRAPHIC_CSV = os.path.join(DATA_FOLDER, "demographic_data.csv")
+TASKS_CSV = os.path.join(DATA_FOLDER, "tasks_data.csv")
+EXIT_CSV = os.path.join(DATA_FOLDER, "exit_data.csv")
+
+# Fixed column order of each table, used when a file is created. Every record
+# carries the participant ID handed out at consent time.
+TABLE_COLUMNS = {
+    CONSENT_CSV: ["timestamp", "consent_given", "participant_id"],
+    DEMOGRAPHIC_CSV: ["timestamp", "name", "age", "gender", "education", "occupation", "familiarity",
+                      "accessibility", "participant_id"],
+    TASKS_CSV: ["name", "timestamp", "task_name", "success", "duration_seconds", "step_one", "step_two",
+                "step_three", "feedback", "participant_id"],
+    EXIT_CSV: ["timestamp", "satisfaction", "design", "difficulty", "confidence", "completion", "improvements",
+               "open_feedback", "participant_id"],
+}
+
+# Where study data lives: "csv" (one file per table in DATA_FOLDER), "sqlite",
+# or "partitioned" (one CSV per table, study and day; see partitioned_backend.py)
+STORAGE_BACKEND = "csv"
+SQLITE_DB = os.path.join(DATA_FOLDER, "study.db")
+
+# Study (or round of a study) new records belong to. The partitioned backend
+# keeps each study's records apart; start the app with APP_STUDY set when a new
+# round begins.
+STUDY = os.environ.get("APP_STUDY", "main")
+
+# Answer choices offered by the forms, in display order
+AGE_OPTIONS = ["Under 18", "18-24", "25-34", "35-44", "45-54", "55+"]
+GENDER_OPTIONS = ["Male", "Female", "Non-binary", "Prefer not to say"]
+EDUCATION_OPTIONS = ["High School or equivalent", "Some College", "Associate's Degree", "Bachelor's Degree",
+                     "Graduate Degree"]
+FAMILIARITY_OPTIONS = ["Not familiar", "Somewhat familiar", "Very familiar"]
+# In the order tasks.json lists them (see task_registry.py)
+TASK_NAMES = list(get_tasks())
+SUCCESS_OPTIONS = ["Yes", "No", "Partially"]
+
+# Numeric score of each answer to "Was the task completed successfully?"
+SUCCESS_SCORES = {"Yes": 1, "Partially": 0.5, "No": 0}
+
+# Columns answered from a fixed list. Loaded tables hold them as categoricals
+# (one small integer code per row) instead of a Python string per row; a value
+# outside the list (older data) is kept as an extra category.
+COLUMN_VOCABULARIES = {
+    "age": AGE_OPTIONS,
+    "gender": GENDER_OPTIONS,
+    "education": EDUCATION_OPTIONS,
+    "familiarity": FAMILIARITY_OPTIONS,
+    "task_name": TASK_NAMES,
+    "success": SUCCESS_OPTIONS,
+}
+
+# Long answers typed by participants. Nothing the report computes reads them,
+# so they are only parsed when a view asks for them.
+FREE_TEXT_COLUMNS = {"occupation", "accessibility", "step_one", "step_two", "step_three", "feedback", "design",
+                     "completion", "improvements", "open_feedback"}
+
+# Hand submissions to a background thread instead of writing on the script thread
+WRITE_BEHIND = True
+
+# Submissions the write-behind thread could not write to their table (the disk
+# kept failing), one per line: {"ts": ..., "csv_file": ..., "error": ..., "record": {...}}.
+# 'python manage.py dead-letters --replay' writes them to their tables.
+DEAD_LETTER_FILE = os.path.join(DATA_FOLDER, "dead_letter.jsonl")
+
+# fsync the data file after every N records written (0 leaves flushing to the OS)
+FSYNC_EVERY = 0
+
+# Records per chunk when a whole table is streamed out (StorageBackend.chunks)
+CHUNK_ROWS = 50000
+
+
+@contextmanager
+def file_lock(f, exclusive=True):
+    # Advisory lock shared by every process writing to or reading from data/
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CsvCache:
+    # Process-wide cache of parsed CSV files. Every entry remembers the size and
+    # mtime of the file it was parsed from, so an unchanged file is never parsed
+    # twice. When a file has only grown (new rows appended at the end), just the
+    # appended bytes are parsed and concatenated onto the cached frame. Anything
+    # else (file shrank, header changed, bytes before the old end changed) falls
+    # back to a full reload. Files are parsed without their free-text columns
+    # unless a caller asks for them; the two shapes are cached separately.
+
+    # How many bytes before the previous end of file are compared to make sure
+    # the file was appended to rather than rewritten.
+    BOUNDARY_BYTES = 256
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.appends = 0
+
+    def load(self, csv_file, free_text=True):
+        try:
+            stat = os.stat(csv_file)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop((csv_file, True), None)
+                self._entries.pop((csv_file, False), None)
+            return pd.DataFrame()
+
+        with self._lock:
+            entry = self._entries.get((csv_file, free_text))
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.hits += 1
+            elif entry is not None and self._extend(csv_file, entry, stat):
+                self.appends += 1
+            else:
+                self.misses += 1
+                entry = self._full_load(csv_file, stat, free_text)
+                self._entries[(csv_file, free_text)] = entry
+            # Shallow copy so callers can add columns without touching the cache
+            return entry["frame"].copy(deep=False)
+
+    def holds(self, csv_file):
+        # Whether the file has been parsed before, in either shape
+        with self._lock:
+            return (csv_file, True) in self._entries or (csv_file, False) in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "appends": self.appends,
+                    "files": len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.appends = 0
+
+    def _full_load(self, csv_file, stat, free_text=True):
+        with open(csv_file, "rb") as f, file_lock(f, exclusive=False):
+            data = f.read()
+        header = data.split(b"\n", 1)[0] + b"\n"
+        names = next(csv.reader([header.decode("utf-8")]), [])
+        usecols = None if free_text else [column for column in names if column not in FREE_TEXT_COLUMNS]
+        try:
+            frame = _compact(pd.read_csv(io.BytesIO(data), usecols=usecols))
+        except pd.errors.EmptyDataError:
+            frame = pd.DataFrame()
+        # A file that does not end on a newline has a partial last line, so we
+        # cannot safely pick up from its end next time.
+        offset = len(data) if data.endswith(b"\n") else None
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "offset": offset,
+            "header": header,
+            "names": names,
+            "boundary": data[-self.BOUNDARY_BYTES:] if offset else b"",
+            "frame": frame,
+        }
+
+    def _extend(self, csv_file, entry, stat):
+        # Returns True when the entry was brought up to date by parsing only the
+        # bytes appended since the last read, False when a full reload is needed.
+        offset = entry["offset"]
+        if offset is None or stat.st_size < offset or len(entry["frame"].columns) == 0:
+            return False
+        with open(csv_file, "rb") as f, file_lock(f, exclusive=False):
+            if f.read(len(entry["header"])) != entry["header"]:
+                return False
+            boundary = entry["boundary"]
+            f.seek(offset - len(boundary))
+            if f.read(len(boundary)) != boundary:
+                return False
+            appended = f.read()
+
+        # Only parse complete lines; a trailing partial line is picked up next time
+        complete = appended[:appended.rfind(b"\n") + 1]
+        if complete:
+            frame = entry["frame"]
+            new_rows = _parse_rows(complete, frame, entry["names"])
+            if new_rows is None:
+                return False
+            entry["frame"] = _concat(frame, new_rows)
+            entry["offset"] = offset + len(complete)
+            entry["boundary"] = (boundary + complete)[-self.BOUNDARY_BYTES:]
+        entry["size"] = stat.st_size
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+
+def _compact(frame):
+    # Store the fixed-vocabulary columns as categoricals, categories in form order
+    for column, vocabulary in COLUMN_VOCABULARIES.items():
+        if column in frame and not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            values = frame[column]
+            extra = sorted({str(value) for value in values.dropna().unique()} - set(vocabulary))
+            if extra:
+                values = values.where(values.isna(), values.astype(str))
+            frame[column] = pd.Categorical(values, categories=vocabulary + extra)
+    return frame
+
+
+def _concat(frame, new_rows):
+    # Categoricals only survive a concat when both sides have the same
+    # categories; a new value turns the column back into strings, so recode it
+    return _compact(pd.concat([frame, new_rows], ignore_index=True))
+
+
+def _parse_rows(data, like_frame, names=None):
+    # Parse header-less CSV bytes into rows shaped like like_frame, or None if
+    # they don't fit its columns. names lists every column in the data when
+    # like_frame holds only some of them.
+    try:
+        new_rows = pd.read_csv(io.BytesIO(data), header=None, names=names or list(like_frame.columns),
+                               usecols=list(like_frame.columns))
+    except (pd.errors.ParserError, ValueError):
+        return None
+    _compact(new_rows)
+    # A column that is empty in every new row parses as float NaN; give it the
+    # existing column's type so a concat doesn't fall back to object
+    for column in new_rows.columns:
+        if new_rows[column].isna().all() and new_rows[column].dtype != like_frame[column].dtype:
+            try:
+                new_rows[column] = new_rows[column].astype(like_frame[column].dtype)
+            except (TypeError, ValueError):
+                pass
+    return new_rows
+
+
+class _FilePrefix(io.RawIOBase):
+    # The first size bytes of an open file, so a table can be parsed up to the
+    # end of its last complete record while writers keep appending to it
+
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._f.read(min(len(buffer), self._left))
+        self._left -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _csv_chunks(csv_file, rows=CHUNK_ROWS, dtype=str, usecols=None):
+    # Parse a CSV file rows records at a time, every value as text unless a
+    # dtype is given. Writers append whole records while holding the lock, so
+    # the size seen under it ends on a record boundary; the open handle keeps
+    # reading the same file even if it is archived and removed meanwhile.
+    try:
+        f = open(csv_file, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        with file_lock(f, exclusive=False):
+            size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        yield from pd.read_csv(io.BufferedReader(_FilePrefix(f, size)), dtype=dtype, usecols=usecols,
+                               chunksize=rows)
+
+
+def _in_days(frame, start=None, end=None):
+    # Rows whose timestamp falls on the given days ("YYYY-MM-DD", both ends
+    # included); rows without a timestamp are left out once a day is given
+    if start is None and end is None:
+        return frame
+    day = frame["timestamp"].astype("string").str.slice(0, 10)
+    keep = pd.Series(True, index=frame.index)
+    if start is not None:
+        keep &= day >= start
+    if end is not None:
+        keep &= day <= end
+    return frame[keep.fillna(False).astype(bool)]
+
+
+def _format_rows(columns, records, header=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue()
+
+
+def _add_columns(csv_file, columns, new_columns):
+    # Rewrite a table in place with extra (empty) columns at the end. The
+    # caller holds the exclusive lock, so rewriting through a second handle on
+    # the same file is safe; replacing the file would orphan other processes'
+    # locks on the old one.
+    columns = columns + new_columns
+    with open(csv_file, "r+", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(row + [""] * len(new_columns) for row in rows[1:])
+        f.seek(0)
+        f.write(buffer.getvalue())
+        f.truncate()
+    return columns
+
+
+class RecordWriter:
+    # Appends records to the table CSVs with the stdlib csv module. Each batch is
+    # formatted in memory and written with a single write() while holding an
+    # exclusive lock on the file, so concurrent writers (threads or separate
+    # Streamlit processes) can never interleave partial lines, and the "is the
+    # file empty, then write the header" check happens under the same lock.
+
+    def __init__(self, fsync_every=FSYNC_EVERY):
+        self.fsync_every = fsync_every
+        # flock() does not serialize threads sharing a process on every platform
+        self._lock = threading.Lock()
+        self._unsynced = {}
+
+    def write(self, csv_file, record):
+        self.write_many(csv_file, [record])
+
+    def write_many(self, csv_file, records, after_write=None, table=None):
+        # after_write(csv_file, records, offsets) runs while the file is still
+        # locked, so anything kept in step with the file sees writes in file
+        # order. offsets holds the byte offset each record starts at, followed
+        # by the new end of the file. table names the table whose columns the
+        # file has when csv_file is one partition of it.
+        if not records:
+            return
+        with self._lock:
+            self._write_many(csv_file, records, after_write, TABLE_COLUMNS.get(table or csv_file, []))
+
+    def _write_many(self, csv_file, records, after_write, table_columns):
+        with open(csv_file, "a+", newline="", encoding="utf-8") as f, file_lock(f):
+            if os.fstat(f.fileno()).st_nlink == 0:
+                # Archived and removed while we waited for the lock; this
+                # opens a new file in its place
+                return self._write_many(csv_file, records, after_write, table_columns)
+            f.seek(0)
+            header = f.readline()
+            if header:
+                # Keep whatever column order the existing file already uses
+                columns = next(csv.reader([header]))
+                missing = [column for column in table_columns if column not in columns]
+                if missing and any(column in record for record in records for column in missing):
+                    columns = _add_columns(csv_file, columns, missing)
+            else:
+                columns = table_columns or list(records[0])
+
+            rows = [_format_rows(columns, [record]) for record in records]
+            data = ("" if header else _format_rows(columns, [], header=True)) + "".join(rows)
+            end = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            self._sync(f, csv_file, len(records))
+
+            if after_write is not None:
+                offset = end + (len(data.encode("utf-8")) - sum(len(row.encode("utf-8")) for row in rows))
+                offsets = [offset]
+                for row in rows:
+                    offset += len(row.encode("utf-8"))
+                    offsets.append(offset)
+                after_write(csv_file, records, offsets)
+
+    def _sync(self, f, csv_file, count):
+        if not self.fsync_every:
+            return
+        unsynced = self._unsynced.get(csv_file, 0) + count
+        if unsynced >= self.fsync_every:
+            os.fsync(f.fileno())
+            unsynced = 0
+        self._unsynced[csv_file] = unsynced
+
+
+class StorageBackend:
+    # Interface shared by the storage backends. Tables are identified by their
+    # CSV path (CONSENT_CSV, DEMOGRAPHIC_CSV, ...) so callers keep using the
+    # same names whichever backend is configured. The helpers below are
+    # answered from loaded DataFrames; a backend that can read less than a
+    # whole table (SQLite, the partitions) overrides them.
+
+    def append(self, csv_file, records, after_write=None):
+        raise NotImplementedError
+
+    def load(self, csv_file, columns=None, where=None):
+        raise NotImplementedError
+
+    def count(self, csv_file):
+        return len(self.load(csv_file, []))
+
+    def read_page(self, csv_file, columns, sort_by=None, ascending=True, offset=0, limit=50, rows=None, **scope):
+        # One page of a table for display: only the given columns, rows
+        # [offset, offset + limit) after an optional sort on one column. With
+        # rows set, only the table's first rows rows are paged through, so a view
+        # can stay on the rows that existed when it was opened. Categorical
+        # columns sort in form order and empty values always sort last. scope
+        # (studies, start, end) is passed on to a backend that partitions data.
+        wanted = columns + [sort_by] if sort_by and sort_by not in columns else columns
+        frame = self.load(csv_file, wanted, **scope)
+        if rows is not None:
+            frame = frame.iloc[:rows]
+        if sort_by in frame:
+            frame = frame.sort_values(sort_by, ascending=ascending, kind="stable", na_position="last")
+        return frame.iloc[offset:offset + limit][[column for column in columns if column in frame]]
+
+    def chunks(self, csv_file, rows=CHUNK_ROWS, start=None, end=None, **scope):
+        # The table's records rows at a time, for streaming a whole table out
+        # (export) without holding it in memory; start and end keep only the
+        # records of those days. This fallback slices a full load; the
+        # backends override it to read incrementally.
+        frame = _in_days(self.load(csv_file, **scope), start, end)
+        for offset in range(0, len(frame), rows):
+            yield frame.iloc[offset:offset + rows]
+
+    def participant_records(self, participant_id):
+        # Every record of one participant, as {csv_file: DataFrame}
+        return {csv_file: self.load(csv_file, where={"participant_id": participant_id})
+                for csv_file in TABLE_COLUMNS}
+
+
+def table_columns(csv_file, free_text=True):
+    return [column for column in TABLE_COLUMNS[csv_file] if free_text or column not in FREE_TEXT_COLUMNS]
+
+
+def _select(frame, columns=None, where=None):
+    if where:
+        for column, value in where.items():
+            frame = frame[frame[column] == value]
+    if columns is not None:
+        frame = frame[[column for column in columns if column in frame]]
+    return frame
+
+
+class CsvBackend(StorageBackend):
+    # One CSV file per table in DATA_FOLDER, read through the CSV cache and
+    # appended to with the locked record writer
+
+    def __init__(self, fsync_every=FSYNC_EVERY):
+        from participants import ParticipantIndex
+
+        self.cache = CsvCache()
+        self.writer = RecordWriter(fsync_every)
+        self.index = ParticipantIndex()
+
+    def append(self, csv_file, records, after_write=None):
+        def written(csv_file, records, offsets):
+            # The records are on disk by now. The participant index is derived
+            # data that re-indexes a table whose size it doesn't match, so a
+            # failure here (a locked index database) must not fail the write
+            try:
+                self.index.add(csv_file, records, offsets)
+            except Exception:
+                logger.exception("Could not update the participant index; it re-indexes %s on next use", csv_file)
+            if after_write is not None:
+                after_write(csv_file, records)
+
+        self.writer.write_many(csv_file, records, written)
+
+    def load(self, csv_file, columns=None, where=None):
+        free_text = columns is None or any(column in FREE_TEXT_COLUMNS for column in columns)
+        return _select(self.cache.load(csv_file, free_text), columns, where)
+
+    def read_page(self, csv_file, columns, sort_by=None, ascending=True, offset=0, limit=50, rows=None):
+        # Until a table has been parsed, a page near its start in saved order
+        # is read from the head of the file alone, so the first report view
+        # after a restart doesn't wait for every table to be parsed whole
+        if sort_by is None and offset + limit <= CHUNK_ROWS and not self.cache.holds(csv_file):
+            wanted = set(columns)
+            end = offset + limit if rows is None else min(offset + limit, rows)
+            head = next(_csv_chunks(csv_file, max(end, 1), dtype=None, usecols=lambda column: column in wanted),
+                        None)
+            if head is None:
+                return pd.DataFrame(columns=columns)
+            return _compact(head.iloc[offset:end])[[column for column in columns if column in head]]
+        return super().read_page(csv_file, columns, sort_by, ascending, offset, limit, rows)
+
+    def chunks(self, csv_file, rows=CHUNK_ROWS, start=None, end=None):
+        for chunk in _csv_chunks(csv_file, rows):
+            chunk = _in_days(chunk, start, end)
+            if len(chunk):
+                yield chunk
+
+    def participant_records(self, participant_id):
+        # Found through the participant index: only that participant's lines
+        # are read, not whole tables
+        return self.index.records(participant_id)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STORAGE_BACKEND == "sqlite":
+                    from sqlite_backend import SqliteBackend
+                    _backend = SqliteBackend(SQLITE_DB)
+                elif STORAGE_BACKEND == "partitioned":
+                    from partitioned_backend import PartitionedBackend
+                    _backend = PartitionedBackend()
+                else:
+                    _backend = CsvBackend()
+    return _backend
+
+
+def _update_aggregates(csv_file, records):
+    # The report aggregates are derived data: a failure here must not fail (and
+    # with write-behind, retry) a write that already reached the table
+    from aggregates import get_aggregate_store
+    try:
+        get_aggregate_store().apply(csv_file, records)
+    except Exception:
+        logger.exception("Could not update report aggregates; run 'python manage.py aggregates --rebuild'")
+
+
+def _update_search_index(csv_file, records):
+    # Derived data as well, rebuilt with 'python manage.py search-index'
+    from search import get_search_index
+    try:
+        get_search_index().add(csv_file, records)
+    except Exception:
+        logger.exception("Could not update the search index; run 'python manage.py search-index'")
+
+
+def _update_derived(csv_file, records):
+    _update_aggregates(csv_file, records)
+    _update_search_index(csv_file, records)
+
+
+def _append(csv_file, records):
+    from aggregates import get_aggregate_store
+    from search import get_search_index
+    # Opened before the table is locked; building them reads the tables
+    get_aggregate_store()
+    get_search_index()
+    # Timed separately from save_to_csv, which with write-behind only queues
+    with timed("write", csv_file):
+        get_backend().append(csv_file, records, after_write=_update_derived)
+
+
+def _spill(csv_file, records, error):
+    data = "".join(json.dumps({"ts": round(time.time(), 3), "csv_file": csv_file, "error": str(error),
+                               "record": record}, default=str) + "\n" for record in records)
+    with open(DEAD_LETTER_FILE, "a", encoding="utf-8") as f, file_lock(f):
+        f.write(data)
+
+
+def replay_dead_letters():
+    # Write the set-aside submissions to their tables. Those that still fail
+    # stay in the file; returns (written, left).
+    try:
+        f = open(DEAD_LETTER_FILE, "r+", encoding="utf-8")
+    except FileNotFoundError:
+        return 0, 0
+    with f, file_lock(f):
+        left = []
+        written = 0
+        for line in f.read().splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            try:
+                _append(entry["csv_file"], [entry["record"]])
+            except Exception as error:
+                logger.exception("Could not write a set-aside record to %s", entry["csv_file"])
+                left.append(json.dumps({**entry, "error": str(error)}, default=str) + "\n")
+            else:
+                written += 1
+        f.seek(0)
+        f.write("".join(left))
+        f.truncate()
+    return written, len(left)
+
+
+_write_queue = WriteBehindQueue(_append, spill=_spill)
+
+
+def save_to_csv(data_dict, csv_file, submission_key=None):
+    # Append a single record; the header is written when the file is new.
+    # With write-behind on, this returns as soon as the record is queued and
+    # only writes synchronously if the queue stays full. A form submission
+    # passes its idempotency key (submissions.new_submission_key): a repeat of a
+    # submission already accepted is dropped and False is returned. The key is
+    # given back if the record is never written (the write fails, or the
+    # write-behind queue drops it), so the participant can submit again.
+    with timed("save_to_csv", csv_file):
+        release = None
+        if submission_key is not None:
+            from submissions import get_submission_keys
+            keys = get_submission_keys()
+            if not keys.claim(submission_key):
+                return False
+            release = functools.partial(keys.release, submission_key)
+        try:
+            if not WRITE_BEHIND or not _write_queue.submit(csv_file, data_dict, on_drop=release):
+                _append(csv_file, [data_dict])
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        return True
+
+
+def load_from_csv(csv_file, free_text=True):
+    # Reads go through the configured backend (the CSV backend only parses new
+    # rows after a save). Records still in the write-behind queue are not in
+    # it; call flush_writes() first to read them too. Without free_text the
+    # long typed answers (FREE_TEXT_COLUMNS) are left out.
+    with timed("load_from_csv", csv_file):
+        return get_backend().load(csv_file, None if free_text else table_columns(csv_file, free_text=False))
+
+
+def flush_writes(timeout=None):
+    return _write_queue.flush(timeout)
+
+
+def csv_cache_stats():
+    backend = get_backend()
+    return backend.cache.stats() if isinstance(backend, CsvBackend) else {}
+
+
+def write_queue_stats():
+    return _write_queue.stats()
@@ -0,0 +1,177 @@
+import datetime
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from lazy_imports import lazy_import
+from storage import DATA_FOLDER, FREE_TEXT_COLUMNS, TABLE_COLUMNS, file_lock
+
+pd = lazy_import("pandas")
+
+SUBMISSION_KEYS_DB = os.path.join(DATA_FOLDER, "submission_keys.db")
+
+# How long an accepted submission's key is remembered: the same submission sent
+# again within this time is dropped
+SUBMISSION_KEY_TTL = 24 * 60 * 60
+
+# Expired keys are deleted from the database once every this many claims
+PURGE_EVERY = 500
+
+# Rows saved before submissions carried keys can only be matched on content:
+# the same participant's same answers, saved less than this many seconds apart
+DEDUPE_WINDOW = 5 * 60
+
+# Not compared when matching rows on content: a repeated click saves a new
+# time, and its task duration is empty because the first save reset the timer
+UNCOMPARED_COLUMNS = {"timestamp", "duration_seconds"}
+
+
+def new_submission_key():
+    # Idempotency key for one form as shown to a participant: a random 63-bit
+    # integer (it fits SQLite's INTEGER). The app keeps it in the session until
+    # the form is saved, then draws a new one for the next submission.
+    return secrets.randbits(63)
+
+
+class SubmissionKeys:
+    # Keys of recently accepted submissions with the time each expires. Kept in
+    # SQLite, keyed on the integer key itself (the table's rowid), so a
+    # submission accepted by another server process or before a restart is
+    # still recognised. The keys this process accepted are also kept in a dict,
+    # oldest first, so a repeat reaching the same process is one O(1) lookup
+    # and expired keys are dropped from its front as new ones arrive. Keys
+    # held by other processes are not copied into it: their owner may give
+    # them back.
+
+    def __init__(self, db_path=SUBMISSION_KEYS_DB, ttl=SUBMISSION_KEY_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+        self.accepted = 0
+        self.duplicates = 0
+        self.released = 0
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS submission_keys (key INTEGER PRIMARY KEY, expires REAL)")
+        connection.execute("DELETE FROM submission_keys WHERE expires <= ?", (time.time(),))
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def claim(self, key, now=None):
+        # Record the key of a submission about to be saved. Returns False when
+        # it was already accepted and has not expired, i.e. this is a repeat.
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._keys and next(iter(self._keys.values())) <= now:
+                self._keys.popitem(last=False)
+            expires = self._keys.get(key)
+            if expires is not None and expires > now:
+                self.duplicates += 1
+                return False
+            # Claimed in the database too, unless another process holds it
+            connection = self._connection()
+            claimed = connection.execute(
+                "INSERT INTO submission_keys VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET expires = excluded.expires "
+                "WHERE expires <= ?", (key, now + self.ttl, now)).rowcount
+            if not claimed:
+                # Not remembered here: the process holding it may give it back
+                self.duplicates += 1
+                return False
+            self._keys[key] = now + self.ttl
+            self.accepted += 1
+            if self.accepted % PURGE_EVERY == 0:
+                connection.execute("DELETE FROM submission_keys WHERE expires <= ?", (now,))
+            return True
+
+    def release(self, key):
+        # Forget a claimed key whose record never reached the table, so the
+        # same submission is accepted when it is sent again
+        with self._lock:
+            if self._keys.pop(key, None) is not None:
+                self.accepted -= 1
+            self._connection().execute("DELETE FROM submission_keys WHERE key = ?", (key,))
+            self.released += 1
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._keys), "accepted": self.accepted, "duplicates": self.duplicates,
+                    "released": self.released}
+
+
+_submission_keys = None
+_submission_keys_lock = threading.Lock()
+
+
+def get_submission_keys():
+    global _submission_keys
+    if _submission_keys is None:
+        with _submission_keys_lock:
+            if _submission_keys is None:
+                _submission_keys = SubmissionKeys()
+    return _submission_keys
+
+
+def _duplicate_rows(frame, window):
+    # Rows repeating an earlier kept row: the same values in every column but
+    # UNCOMPARED_COLUMNS (the participant ID included), saved less than window
+    # seconds after it, with the same duration or none (a repeated click after
+    # the timer was reset). A timed second attempt has a duration of its own,
+    # so it is kept. Rows saved before participant IDs existed are matched on
+    # their content alone, so only when it says who answered: a name or a
+    # typed answer. Two participants consenting a minute apart save the same
+    # row. Rows without a readable timestamp are always kept.
+    compared = [column for column in frame.columns if column not in UNCOMPARED_COLUMNS]
+    contents = pd.util.hash_pandas_object(frame[compared], index=False)
+    times = pd.to_datetime(frame["timestamp"], format="mixed", errors="coerce")
+    durations = frame["duration_seconds"] if "duration_seconds" in frame else pd.Series("", index=frame.index)
+    identified = pd.Series(False, index=frame.index)
+    for column in ["participant_id", "name", *sorted(FREE_TEXT_COLUMNS)]:
+        if column in frame:
+            identified |= frame[column].str.strip() != ""
+    eligible = identified & times.notna() & contents.duplicated(keep=False)
+    window = datetime.timedelta(seconds=window)
+    kept, duplicates = {}, []
+    for row in frame.index[eligible]:
+        content, when, duration = contents[row], times[row], durations[row]
+        earlier = kept.get(content)
+        if (earlier is not None and earlier[0] <= when < earlier[0] + window
+                and duration in ("", earlier[1])):
+            duplicates.append(row)
+        else:
+            kept[content] = (when, duration)
+    return duplicates
+
+
+def dedupe_csv_tables(window=DEDUPE_WINDOW, dry_run=False):
+    # Remove repeated submissions saved before submissions carried keys (see
+    # _duplicate_rows). Each table is read and rewritten while it is locked,
+    # so no save can land in between. Returns rows removed per table.
+    removed = dict.fromkeys(TABLE_COLUMNS, 0)
+    for csv_file in TABLE_COLUMNS:
+        if not os.path.exists(csv_file):
+            continue
+        with open(csv_file, "r+", newline="", encoding="utf-8") as f, file_lock(f):
+            try:
+                frame = pd.read_csv(f, dtype=str, keep_default_na=False)
+            except pd.errors.EmptyDataError:
+                continue
+            if frame.empty or "timestamp" not in frame:
+                continue
+            duplicates = _duplicate_rows(frame, window)
+            removed[csv_file] = len(duplicates)
+            if duplicates and not dry_run:
+                f.seek(0)
+                f.write(frame.drop(index=duplicates).to_csv(index=False, lineterminator="\n"))
+                f.truncate()
+    return removed
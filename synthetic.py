@@ -0,0 +1,146 @@
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from storage import (CONSENT_CSV, DEMOGRAPHIC_CSV, TASKS_CSV, EXIT_CSV, AGE_OPTIONS, GENDER_OPTIONS,
+                     EDUCATION_OPTIONS, FAMILIARITY_OPTIONS, TASK_NAMES, SUCCESS_OPTIONS, TABLE_COLUMNS)
+
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn",
+               "Maria", "Wei", "Priya", "Omar", "Elena", "Kofi", "Yuki", "Lucas", "Fatima", "Noah"]
+LAST_NAMES = ["Smith", "Garcia", "Nguyen", "Patel", "Johnson", "Kim", "Brown", "Lopez", "Chen", "Okafor",
+              "Silva", "Müller", "Rossi", "Cohen", "Haddad", "Ivanova", "Tanaka", "Dubois", "Moore", "Ali"]
+OCCUPATIONS = ["Student", "Software Engineer", "Teacher", "Nurse", "Retired", "Designer", "Accountant",
+               "Sales Associate", "Researcher", "Unemployed"]
+ACCESSIBILITY = ["None", "None", "None", "", "Color blindness", "Uses a screen reader", "Prefers larger text"]
+
+# Sentences typed answers are put together from; two or three per answer gives
+# lengths in the range real participants write
+SENTENCES = [
+    "I found the navigation menu pretty quickly.",
+    "The date picker was confusing on mobile.",
+    "It took me a while to notice the search button at the top.",
+    "Loading the picture took longer than I expected.",
+    "The layout looked cluttered on my phone.",
+    "Everything was labelled clearly and I knew where to click.",
+    "I was not sure whether my answer had been saved.",
+    "The quiz questions were fun but the timer felt rushed.",
+    "Scrolling back to the top of the page was annoying.",
+    "The Kepler section had a lot of text to read before getting to the data.",
+    "Buttons were too small to tap comfortably.",
+    "I liked the dark theme, it suited the space content.",
+    "The description under the picture was really interesting.",
+    "I expected the back button to take me to the previous task.",
+    "Some links opened in a new tab, which surprised me.",
+]
+
+
+def _choice(rng, options, size, p=None):
+    return np.asarray(options, dtype=object)[rng.choice(len(options), size=size, p=p)]
+
+
+def _sentences(rng, size):
+    # Free-text answers of two or three sentences
+    answers = _choice(rng, SENTENCES, size) + " " + _choice(rng, SENTENCES, size)
+    third = rng.random(size) < 0.5
+    answers[third] = answers[third] + " " + _choice(rng, SENTENCES, int(third.sum()))
+    return answers
+
+
+def _timestamps(start, seconds):
+    return (pd.Timestamp(start) + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def generate_tables(participants, tasks_per_participant=3, rng=None, start="2025-01-06 09:00:00", first_second=0):
+    # The four study tables for participants synthetic participants, as
+    # {csv_file: DataFrame}. Every participant gives consent, answers the
+    # demographics, completes tasks_per_participant tasks and fills in the
+    # exit questionnaire; sessions start first_second seconds after start or
+    # later. Returns the tables and the second the last session started.
+    rng = rng or np.random.default_rng()
+    n = participants
+    random_bytes = rng.bytes(16 * n)
+    ids = np.array([uuid.UUID(bytes=random_bytes[i:i + 16], version=4).hex for i in range(0, 16 * n, 16)],
+                   dtype=object)
+    names = _choice(rng, FIRST_NAMES, n) + " " + _choice(rng, LAST_NAMES, n)
+    # Sessions start a couple of minutes apart and take a few minutes each
+    session_start = first_second + np.cumsum(rng.integers(30, 240, size=n))
+    task_count = n * tasks_per_participant
+
+    tables = {
+        CONSENT_CSV: pd.DataFrame({
+            "timestamp": _timestamps(start, session_start),
+            "consent_given": True,
+            "participant_id": ids,
+        }),
+        DEMOGRAPHIC_CSV: pd.DataFrame({
+            "timestamp": _timestamps(start, session_start + 60),
+            "name": names,
+            "age": _choice(rng, AGE_OPTIONS, n, p=[0.05, 0.35, 0.3, 0.15, 0.1, 0.05]),
+            "gender": _choice(rng, GENDER_OPTIONS, n, p=[0.46, 0.46, 0.05, 0.03]),
+            "education": _choice(rng, EDUCATION_OPTIONS, n),
+            "occupation": _choice(rng, OCCUPATIONS, n),
+            "familiarity": _choice(rng, FAMILIARITY_OPTIONS, n, p=[0.1, 0.5, 0.4]),
+            "accessibility": _choice(rng, ACCESSIBILITY, n),
+            "participant_id": ids,
+        }),
+    }
+
+    durations = np.round(rng.lognormal(mean=3.5, sigma=0.6, size=task_count), 2)
+    task_offsets = (np.repeat(session_start, tasks_per_participant) + 120
+                    + 90 * np.tile(np.arange(tasks_per_participant), n))
+    tables[TASKS_CSV] = pd.DataFrame({
+        "name": np.repeat(names, tasks_per_participant),
+        "timestamp": _timestamps(start, task_offsets),
+        "task_name": np.asarray(TASK_NAMES, dtype=object)[np.arange(task_count) % len(TASK_NAMES)],
+        "success": _choice(rng, SUCCESS_OPTIONS, task_count, p=[0.7, 0.1, 0.2]),
+        "duration_seconds": durations,
+        "step_one": _sentences(rng, task_count),
+        "step_two": _sentences(rng, task_count),
+        "step_three": _sentences(rng, task_count),
+        "feedback": _sentences(rng, task_count),
+        "participant_id": np.repeat(ids, tasks_per_participant),
+    })
+    tables[EXIT_CSV] = pd.DataFrame({
+        "timestamp": _timestamps(start, session_start + 120 + 90 * (tasks_per_participant + 1)),
+        "satisfaction": rng.integers(1, 6, size=n),
+        "design": _sentences(rng, n),
+        "difficulty": rng.integers(1, 6, size=n),
+        "confidence": rng.integers(1, 6, size=n),
+        "completion": _sentences(rng, n),
+        "improvements": _sentences(rng, n),
+        "open_feedback": _sentences(rng, n),
+        "participant_id": ids,
+    })
+    for csv_file, frame in tables.items():
+        tables[csv_file] = frame[TABLE_COLUMNS[csv_file]]
+    return tables, int(session_start[-1]) if n else first_second
+
+
+def sample_records(csv_file, count, seed=0):
+    # count synthetic records for one table, shaped like the forms submit them
+    participants = -(-count // 3) if csv_file == TASKS_CSV else count
+    tables, _ = generate_tables(participants, rng=np.random.default_rng(seed))
+    return tables[csv_file].head(count).to_dict("records")
+
+
+def generate_study(folder, participants, tasks_per_participant=3, seed=0, batch_size=100000):
+    # Write the four study tables for a synthetic study into folder, using the
+    # same file names, columns and answer vocabularies as the forms. Large
+    # studies are generated and appended batch_size participants at a time, so
+    # memory stays flat from a thousand rows to tens of millions.
+    # Returns the number of rows written per file.
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = {csv_file: os.path.join(folder, os.path.basename(csv_file)) for csv_file in TABLE_COLUMNS}
+    written = dict.fromkeys(paths.values(), 0)
+    last_second = 0
+    for first in range(0, participants, batch_size):
+        tables, last_second = generate_tables(min(batch_size, participants - first), tasks_per_participant, rng,
+                                              first_second=last_second)
+        for csv_file, frame in tables.items():
+            frame.to_csv(paths[csv_file], mode="w" if first == 0 else "a", header=first == 0, index=False,
+                         lineterminator="\n")
+            written[paths[csv_file]] += len(frame)
+    return written
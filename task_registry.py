@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+
+# The study's tasks: what each asks the participant to do and the questions
+# answered afterwards. Kept beside the code (not in the data folder), and can
+# be swapped for another study's with APP_TASKS_FILE.
+TASKS_FILE = os.environ.get("APP_TASKS_FILE",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks.json"))
+
+# Columns of tasks_data.csv a task's questions can be answered in, in order. A
+# task may ask fewer questions; the columns it leaves out are saved empty.
+QUESTION_COLUMNS = ["step_one", "step_two", "step_three", "feedback"]
+
+
+class Task:
+    # One task of the study, as described in the tasks file
+
+    def __init__(self, name, label, description, questions):
+        self.name = name
+        # Short name used by the report, e.g. "Task One"
+        self.label = label
+        self.description = description
+        # (column, label, placeholder) of each question, in the order asked
+        self.questions = questions
+
+    def record(self, answers):
+        # The task columns of a tasks_data.csv record, from {column: answer}
+        return {column: answers.get(column, "") for column in QUESTION_COLUMNS}
+
+
+def _text(entry, field, where, problems, required=True):
+    value = entry.get(field)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value.strip():
+        problems.append(f"{where}: '{field}' must be a non-empty string")
+        return None
+    return value
+
+
+def parse_tasks(config, source="tasks file"):
+    # Check a parsed tasks file and build its tasks, as {name: Task} in the
+    # order they are listed. Every problem found is reported at once.
+    problems = []
+    entries = config.get("tasks") if isinstance(config, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{source}: expected an object with a non-empty 'tasks' list")
+
+    tasks = {}
+    for number, entry in enumerate(entries, start=1):
+        where = f"task {number}"
+        if not isinstance(entry, dict):
+            problems.append(f"{where}: must be an object")
+            continue
+        name = _text(entry, "name", where, problems)
+        if name is not None:
+            where = f"task {number} ({name!r})"
+            if name in tasks:
+                problems.append(f"{where}: listed more than once")
+        label = _text(entry, "label", where, problems, required=False)
+        description = _text(entry, "description", where, problems)
+
+        questions = []
+        listed = entry.get("questions")
+        if not isinstance(listed, list) or not listed:
+            problems.append(f"{where}: 'questions' must be a non-empty list")
+            listed = []
+        for question in listed:
+            if not isinstance(question, dict):
+                problems.append(f"{where}: every question must be an object")
+                continue
+            column = question.get("column")
+            if column not in QUESTION_COLUMNS:
+                problems.append(f"{where}: question column {column!r} is not one of {QUESTION_COLUMNS}")
+            elif column in [asked[0] for asked in questions]:
+                problems.append(f"{where}: column {column!r} is asked more than once")
+            text = _text(question, "label", f"{where}, question {column!r}", problems)
+            placeholder = question.get("placeholder", "")
+            if not isinstance(placeholder, str):
+                problems.append(f"{where}, question {column!r}: 'placeholder' must be a string")
+            questions.append((column, text, placeholder))
+
+        if name is not None and name not in tasks:
+            tasks[name] = Task(name, label or name, description, questions)
+
+    if problems:
+        raise ValueError(f"{source} is not valid:\n  " + "\n  ".join(problems))
+    return tasks
+
+
+def load_tasks(path=TASKS_FILE):
+    with open(path, encoding="utf-8") as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"{path} is not valid JSON: {error}") from None
+    return parse_tasks(config, path)
+
+
+_tasks = None
+_tasks_lock = threading.Lock()
+
+
+def get_tasks():
+    # The study's tasks, read and checked once per process. Every rerun of the
+    # Task tab and the report share the same Task objects, so listing dozens of
+    # tasks costs nothing per rerun beyond drawing the selected one.
+    global _tasks
+    if _tasks is None:
+        with _tasks_lock:
+            if _tasks is None:
+                _tasks = load_tasks()
+    return _tasks
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # Run in an empty folder: the app's data paths are relative to the working
+    # directory, so nothing a test writes lands in the repository's data/
+    # (the stores opened on first use are dropped too, so they open here).
+    import aggregates
+    import search
+    import storage
+    import submissions
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    monkeypatch.setattr(storage, "_backend", None)
+    monkeypatch.setattr(aggregates, "_store", None)
+    monkeypatch.setattr(search, "_index", None)
+    monkeypatch.setattr(submissions, "_submission_keys", None)
+    return tmp_path
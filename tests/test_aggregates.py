@@ -0,0 +1,78 @@
+import sys
+
+import pytest
+
+import aggregates
+import manage
+import storage
+from aggregates import AggregateStore
+
+
+def task(participant, success, duration):
+    return {"name": participant, "timestamp": "2025-06-14 10:00:00", "task_name": "Find the report",
+            "success": success, "duration_seconds": duration, "participant_id": participant}
+
+
+@pytest.fixture
+def study(data_dir):
+    backend = storage.CsvBackend()
+    store = AggregateStore(str(data_dir / "aggregates.db"))
+    store.rebuild(backend)
+    backend.append(storage.TASKS_CSV, [task("p1", "Yes", 30), task("p2", "No", 45)], after_write=store.apply)
+    return backend, store
+
+
+def test_saves_keep_the_store_in_step(study):
+    backend, store = study
+    assert store.is_built()
+    assert store.rebuild(backend, replace=False) == {}
+    assert store.row_counts()["tasks"] == 2
+
+
+def test_drift_is_reported_and_repaired(study):
+    backend, store = study
+    # A save the store never heard about
+    backend.append(storage.TASKS_CSV, [task("p3", "Yes", 60)])
+    drift = store.rebuild(backend, replace=False)
+    assert drift[("rows", "tasks", "")] == ((0.0, 2), (0.0, 3))
+    generation = store.generation()
+    assert store.rebuild(backend) == drift
+    assert store.generation() == generation + 1
+    assert store.rebuild(backend, replace=False) == {}
+
+
+class SavingDuringCount:
+    # A backend that saves a task record (updating the store), as another
+    # session would, once the rebuild has read the tasks table
+    def __init__(self, backend, store, saves=1):
+        self.backend, self.store, self.saves = backend, store, saves
+
+    def load(self, csv_file, columns=None):
+        if csv_file == storage.EXIT_CSV and self.saves:
+            self.saves -= 1
+            self.backend.append(storage.TASKS_CSV, [task("late", "Partially", 20)], after_write=self.store.apply)
+        return self.backend.load(csv_file, columns)
+
+
+def test_a_save_during_the_count_is_neither_lost_nor_counted_twice(study):
+    backend, store = study
+    store.rebuild(SavingDuringCount(backend, store))
+    assert store.row_counts()["tasks"] == 3
+    assert store.rebuild(backend, replace=False) == {}
+
+
+def test_rebuild_holds_off_saves_after_its_attempts(study, monkeypatch):
+    backend, store = study
+    monkeypatch.setattr(aggregates, "REBUILD_ATTEMPTS", 0)
+    backend.append(storage.TASKS_CSV, [task("p3", "Yes", 60)])
+    assert store.rebuild(backend) != {}
+    assert store.row_counts()["tasks"] == 3
+    assert not store._connection().in_transaction
+
+
+def test_an_unbuilt_store_is_not_reported_as_drift(data_dir, monkeypatch, capsys):
+    path = str(data_dir / "never_built.db")
+    monkeypatch.setattr(sys, "argv", ["manage.py", "aggregates", "--db", path])
+    manage.main()
+    assert "have not been built yet" in capsys.readouterr().out
+    assert not AggregateStore(path).is_built()
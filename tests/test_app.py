@@ -0,0 +1,69 @@
+import csv
+import os
+
+import pytest
+
+import events
+import storage
+from conftest import ROOT
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+
+@pytest.fixture
+def app(data_dir):
+    app = AppTest.from_file(os.path.join(ROOT, "hci_project.py"), default_timeout=60).run()
+    yield app
+    # Written from background threads; finished before the folder goes away
+    storage.flush_writes(5)
+    events.flush_events(5)
+
+
+def button(app, label):
+    return next(widget for widget in app.button if widget.label == label)
+
+
+def saved_rows(csv_file):
+    assert storage.flush_writes(5)
+    if not os.path.exists(csv_file):
+        return []
+    with open(csv_file, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_the_same_task_results_are_saved_once(app):
+    app.selectbox(key="selected_task").set_value(storage.TASK_NAMES[1]).run()
+    button(app, "Start Task Timer").click().run()
+    button(app, "Stop Task Timer").click().run()
+    app.text_area[0].input("about 130").run()
+    # A double click: two complete reruns with the same answers
+    button(app, "Save Task Results").click().run()
+    button(app, "Save Task Results").click().run()
+    assert [info.value for info in app.info] == ["These task results were already saved."]
+    rows = saved_rows(storage.TASKS_CSV)
+    assert len(rows) == 1
+    assert rows[0]["step_one"] == "about 130"
+
+    # Changed answers are a new submission
+    app.text_area[0].input("about 140").run()
+    button(app, "Save Task Results").click().run()
+    assert [row["step_one"] for row in saved_rows(storage.TASKS_CSV)] == ["about 130", "about 140"]
+
+
+def test_a_new_attempt_at_a_task_is_saved_again(app):
+    for _ in range(2):
+        button(app, "Start Task Timer").click().run()
+        button(app, "Stop Task Timer").click().run()
+        button(app, "Save Task Results").click().run()
+        assert [success.value for success in app.success][-1] == "Task Results Saved."
+    rows = saved_rows(storage.TASKS_CSV)
+    assert len(rows) == 2
+    assert all(row["duration_seconds"] for row in rows)
+
+
+def test_consent_is_saved_once(app):
+    app.checkbox[0].check().run()
+    button(app, "Submit Consent").click().run()
+    button(app, "Submit Consent").click().run()
+    assert [info.value for info in app.info] == ["Your consent was already submitted."]
+    assert len(saved_rows(storage.CONSENT_CSV)) == 1
@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+
+from bootstrap import bootstrap_means
+
+
+def test_means_and_counts_match_the_answers():
+    result = bootstrap_means({"A": {1: 2, 5: 2}, "B": {0: 1, 1: 3}})
+    assert result.loc["A", "mean"] == pytest.approx(3.0)
+    assert result.loc["B", "mean"] == pytest.approx(0.75)
+    assert result["n"].tolist() == [4, 4]
+
+
+def test_intervals_contain_the_mean():
+    result = bootstrap_means({"A": {0: 3, 1: 7}, "B": {1: 5, 3: 10, 5: 2}})
+    assert (result["low"] <= result["mean"]).all()
+    assert (result["mean"] <= result["high"]).all()
+
+
+def test_a_success_rate_interval_matches_the_normal_approximation():
+    # 200 of 400: the 95% interval is about 0.5 +/- 1.96 * sqrt(0.25 / 400)
+    result = bootstrap_means({"task": {0: 200, 1: 200}}, resamples=20000)
+    margin = 1.96 * math.sqrt(0.25 / 400)
+    assert result.loc["task", "low"] == pytest.approx(0.5 - margin, abs=0.005)
+    assert result.loc["task", "high"] == pytest.approx(0.5 + margin, abs=0.005)
+
+
+def test_intervals_narrow_as_answers_accumulate():
+    result = bootstrap_means({"few": {0: 5, 1: 5}, "many": {0: 500, 1: 500}})
+    widths = result["high"] - result["low"]
+    assert widths["many"] < widths["few"] / 5
+
+
+def test_every_answer_the_same_gives_no_spread():
+    result = bootstrap_means({"A": {4: 12}})
+    assert result.loc["A", ["mean", "low", "high"]].tolist() == [4.0, 4.0, 4.0]
+
+
+def test_the_same_seed_gives_the_same_intervals():
+    distributions = {"A": {0: 3, 1: 7}, "B": {1: 5, 3: 10, 5: 2}}
+    first, second = bootstrap_means(distributions), bootstrap_means(distributions)
+    assert np.array_equal(first.to_numpy(), second.to_numpy())
+
+
+def test_another_seed_draws_other_resamples():
+    distributions = {"A": {0: 333, 1: 667}}
+    assert bootstrap_means(distributions).loc["A", "low"] != bootstrap_means(distributions, seed=1).loc["A", "low"]
+
+
+def test_groups_without_answers_are_left_out():
+    result = bootstrap_means({"A": {}, "B": {1: 0}, "C": {2: 1}})
+    assert result.index.tolist() == ["C"]
+    empty = bootstrap_means({"A": {}})
+    assert empty.empty
+    assert empty.columns.tolist() == ["mean", "low", "high", "n"]
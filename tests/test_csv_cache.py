@@ -0,0 +1,107 @@
+import os
+
+from storage import CsvCache
+
+
+def write(path, text, mode="w"):
+    with open(path, mode, encoding="utf-8", newline="") as f:
+        f.write(text)
+
+
+def touch(path):
+    # A new mtime even when the file is rewritten within the same clock tick
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+
+def test_unchanged_file_is_a_hit(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    assert len(cache.load(str(path))) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_appended_rows_are_parsed_alone(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    write(path, "b,2\nc,3\n", "a")
+    frame = cache.load(str(path))
+    assert frame["name"].tolist() == ["a", "b", "c"]
+    assert frame["duration_seconds"].tolist() == [1, 2, 3]
+    assert cache.stats()["appends"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_partial_last_line_waits_for_its_newline(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    # A writer caught halfway through a row
+    write(path, "b,2\nc,", "a")
+    assert cache.load(str(path))["name"].tolist() == ["a", "b"]
+    write(path, "3\n", "a")
+    frame = cache.load(str(path))
+    assert frame["name"].tolist() == ["a", "b", "c"]
+    assert frame["duration_seconds"].tolist() == [1, 2, 3]
+    assert cache.stats()["misses"] == 1
+
+
+def test_file_without_final_newline_is_reloaded(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1")
+    cache = CsvCache()
+    assert len(cache.load(str(path))) == 1
+    write(path, "\nb,2\n", "a")
+    assert cache.load(str(path))["name"].tolist() == ["a", "b"]
+    assert cache.stats()["misses"] == 2
+
+
+def test_rewritten_rows_are_detected(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1\nb,2\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    # Same header, an earlier row changed and a row added: not an append
+    write(path, "name,duration_seconds\nx,1\nb,2\nc,3\n")
+    touch(path)
+    assert cache.load(str(path))["name"].tolist() == ["x", "b", "c"]
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["appends"] == 0
+
+
+def test_shrunk_file_and_new_header_are_reloaded(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,duration_seconds\na,1\nb,2\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    write(path, "name,duration_seconds\na,1\n")
+    touch(path)
+    assert len(cache.load(str(path))) == 1
+    write(path, "name,duration_seconds,feedback\na,1,ok\nb,2,fine\n")
+    touch(path)
+    assert cache.load(str(path)).columns.tolist() == ["name", "duration_seconds", "feedback"]
+    assert cache.stats()["misses"] == 3
+
+
+def test_free_text_columns_are_left_out_unless_asked_for(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name,feedback\na,long answer\n")
+    cache = CsvCache()
+    assert "feedback" not in cache.load(str(path), free_text=False)
+    assert cache.load(str(path))["feedback"].tolist() == ["long answer"]
+
+
+def test_deleted_file_loads_empty(tmp_path):
+    path = tmp_path / "t.csv"
+    write(path, "name\na\n")
+    cache = CsvCache()
+    cache.load(str(path))
+    os.remove(path)
+    assert cache.load(str(path)).empty
+    assert not cache.holds(str(path))
@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+
+import storage
+from export import PARQUET_AVAILABLE, export_path, export_tables, load_bundle
+
+needs_pyarrow = pytest.mark.skipif(not PARQUET_AVAILABLE, reason="Parquet exports need pyarrow")
+
+
+def task(participant, day, duration, feedback):
+    return {"name": participant, "timestamp": f"{day} 09:10:00", "task_name": "Find the report", "success": "Yes",
+            "duration_seconds": duration, "step_one": "", "step_two": "", "step_three": "", "feedback": feedback,
+            "participant_id": participant}
+
+
+def exit_answers(participant, day, satisfaction):
+    return {"timestamp": f"{day} 09:20:00", "satisfaction": satisfaction, "design": "Clean", "difficulty": 2,
+            "confidence": 4, "completion": "Yes", "improvements": "", "open_feedback": "",
+            "participant_id": participant}
+
+
+@pytest.fixture
+def backend(data_dir):
+    backend = storage.CsvBackend()
+    backend.append(storage.TASKS_CSV, [
+        task("p1", "2025-06-13", 12.345678901, 'Said "fine", then\nleft'),
+        task("p2", "2025-06-14", 60, "Café menu: ☕"),
+        task("p3", "2025-06-14", 7.5, ""),
+        task("p4", "2025-06-15", 30, "late"),
+    ])
+    backend.append(storage.EXIT_CSV, [exit_answers("p1", "2025-06-13", 4), exit_answers("p2", "2025-06-14", 5)])
+    return backend
+
+
+@pytest.mark.parametrize("file_format", ["csv", pytest.param("parquet", marks=needs_pyarrow)])
+def test_a_bundle_loads_back_as_it_was_saved(backend, file_format):
+    out = export_path(file_format)
+    # Two rows per chunk, so the tasks table is written in several
+    written = export_tables(out, file_format, rows=2, backend=backend)
+    assert written[storage.TASKS_CSV] == 4
+    assert written[storage.CONSENT_CSV] == 0
+
+    frames = load_bundle(out)
+    assert set(frames) == {"consent_data", "demographic_data", "tasks_data", "exit_data"}
+    tasks = frames["tasks_data"]
+    assert tasks.columns.tolist() == storage.TABLE_COLUMNS[storage.TASKS_CSV]
+    assert tasks["duration_seconds"].tolist() == [12.345678901, 60, 7.5, 30]
+    assert tasks["feedback"].fillna("").tolist() == ['Said "fine", then\nleft', "Café menu: ☕", "", "late"]
+    assert tasks["participant_id"].tolist() == ["p1", "p2", "p3", "p4"]
+    assert frames["exit_data"]["satisfaction"].tolist() == [4, 5]
+    assert frames["consent_data"].empty
+    assert frames["consent_data"].columns.tolist() == storage.TABLE_COLUMNS[storage.CONSENT_CSV]
+
+
+def test_a_bundle_can_be_limited_to_some_days_and_tables(backend):
+    out = export_path("csv")
+    written = export_tables(out, tables=[storage.TASKS_CSV], start="2025-06-14", end="2025-06-14",
+                            backend=backend)
+    assert written == {storage.TASKS_CSV: 2}
+    frames = load_bundle(out)
+    assert list(frames) == ["tasks_data"]
+    assert frames["tasks_data"]["participant_id"].tolist() == ["p2", "p3"]
+
+
+def test_typed_answers_can_be_left_out(backend):
+    out = export_path("csv")
+    export_tables(out, free_text=False, backend=backend)
+    frames = load_bundle(out)
+    assert "feedback" not in frames["tasks_data"]
+    assert "design" not in frames["exit_data"]
+    assert frames["tasks_data"]["success"].tolist() == ["Yes"] * 4
+    with zipfile.ZipFile(out) as bundle:
+        assert "Café" not in bundle.read("tasks_data.csv").decode("utf-8")
+
+
+def test_a_failed_export_leaves_no_bundle(backend, monkeypatch):
+    out = export_path("csv")
+
+    def broken(csv_file, rows, **scope):
+        yield from storage.CsvBackend.chunks(backend, csv_file, rows, **scope)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(backend, "chunks", broken)
+    with pytest.raises(OSError):
+        export_tables(out, backend=backend)
+    assert os.listdir(os.path.dirname(out)) == []
+    with pytest.raises(ValueError):
+        export_tables(out, "xlsx", backend=backend)
@@ -0,0 +1,88 @@
+import sqlite3
+
+import storage
+from participants import ParticipantIndex, _record_offsets, backfill_participant_ids
+
+
+def task(participant, feedback="fine"):
+    return {"name": participant, "timestamp": "2025-06-14 10:00:00", "task_name": "Find the report",
+            "success": "Yes", "feedback": feedback, "participant_id": participant}
+
+
+def exit_answers(participant):
+    return {"timestamp": "2025-06-14 10:20:00", "satisfaction": 4, "participant_id": participant}
+
+
+def test_record_offsets_follow_quoted_newlines():
+    data = b'name,feedback\nann,"two\nlines"\nbob,one\n'
+    assert _record_offsets(data) == [0, 14, 30]
+
+
+def test_a_participants_records_are_found_across_tables(data_dir):
+    backend = storage.CsvBackend()
+    backend.append(storage.TASKS_CSV, [task("p1", "multi\nline, quoted"), task("p2"), task("p1", "again")])
+    backend.append(storage.EXIT_CSV, [exit_answers("p2"), exit_answers("p1")])
+
+    found = backend.participant_records("p1")
+    assert found[storage.TASKS_CSV]["feedback"].tolist() == ["multi\nline, quoted", "again"]
+    assert found[storage.EXIT_CSV]["participant_id"].tolist() == ["p1"]
+    assert storage.CONSENT_CSV not in found
+    assert backend.participant_records("nobody") == {}
+
+
+def test_a_table_changed_outside_the_writer_is_reindexed(data_dir):
+    backend = storage.CsvBackend()
+    backend.append(storage.TASKS_CSV, [task("p1"), task("p2")])
+    assert backend.participant_records("p2")[storage.TASKS_CSV]["name"].tolist() == ["p2"]
+    # Rewritten by hand: p1's row removed, so every offset moved
+    with open(storage.TASKS_CSV, encoding="utf-8") as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(storage.TASKS_CSV, "w", encoding="utf-8") as f:
+        f.write(lines[0] + lines[2])
+    assert backend.participant_records("p2")[storage.TASKS_CSV]["name"].tolist() == ["p2"]
+    assert backend.participant_records("p1") == {}
+
+
+def test_a_failed_index_update_is_caught_up_on_next_use(data_dir, monkeypatch):
+    backend = storage.CsvBackend()
+    backend.append(storage.TASKS_CSV, [task("p1")])
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(backend.index, "add", locked)
+    applied = []
+    # The write itself still succeeds and the derived data is still updated
+    backend.append(storage.TASKS_CSV, [task("p2")], after_write=lambda csv_file, records: applied.append(records))
+    assert len(applied) == 1
+    monkeypatch.delattr(backend.index, "add")
+    assert backend.participant_records("p2")[storage.TASKS_CSV]["name"].tolist() == ["p2"]
+
+
+def test_the_index_persists_between_processes(data_dir):
+    storage.CsvBackend().append(storage.TASKS_CSV, [task("p1")])
+    assert list(ParticipantIndex().offsets("p1")) == [storage.TASKS_CSV]
+
+
+def test_backfill_only_gives_ids_where_certain(data_dir):
+    with open(storage.DEMOGRAPHIC_CSV, "w", encoding="utf-8") as f:
+        f.write("timestamp,name,age\n2025-06-14 10:00:00,Ann,25-34\n2025-06-14 10:05:00,Sam,25-34\n"
+                "2025-06-14 10:06:00,sam ,35-44\n")
+    with open(storage.TASKS_CSV, "w", encoding="utf-8") as f:
+        f.write("name,timestamp,task_name\nann,2025-06-14 10:10:00,Task 1\nSam,2025-06-14 10:11:00,Task 1\n"
+                "Zoe,2025-06-14 10:12:00,Task 1\n")
+    with open(storage.EXIT_CSV, "w", encoding="utf-8") as f:
+        f.write("timestamp,satisfaction\n2025-06-14 10:20:00,4\n")
+
+    results = backfill_participant_ids()
+    assert results[storage.DEMOGRAPHIC_CSV] == (3, 0)
+    # Two people called Sam, and no Zoe: only Ann's task row is certain
+    assert results[storage.TASKS_CSV] == (1, 2)
+    assert results[storage.EXIT_CSV] == (0, 1)
+
+    demographics = storage.CsvCache().load(storage.DEMOGRAPHIC_CSV)
+    tasks = storage.CsvCache().load(storage.TASKS_CSV)
+    assert tasks["participant_id"].iloc[0] == demographics["participant_id"].iloc[0]
+    assert tasks["participant_id"].iloc[1:].isna().all()
+    # A second run has nothing left to give
+    assert backfill_participant_ids()[storage.DEMOGRAPHIC_CSV] == (0, 0)
@@ -0,0 +1,158 @@
+import os
+import sys
+
+import pytest
+
+import manage
+
+from aggregates import TABLE_KEYS, AggregateStore, _same
+from batch_report import aggregate_tables
+from partitioned_backend import ARCHIVE_AVAILABLE, PartitionedBackend, iso_timestamp, partition_day
+from storage import CONSENT_CSV, DEMOGRAPHIC_CSV, EXIT_CSV, TASKS_CSV
+
+needs_pyarrow = pytest.mark.skipif(not ARCHIVE_AVAILABLE, reason="compaction needs pyarrow")
+
+
+def consent(participant, day):
+    return {"timestamp": f"{day} 08:59:00", "consent_given": True, "participant_id": participant}
+
+
+def demographic(participant, day, education):
+    return {"timestamp": f"{day} 09:00:00", "name": participant, "age": "25-34", "gender": "Female",
+            "education": education, "occupation": "", "familiarity": "Very familiar", "accessibility": "",
+            "participant_id": participant}
+
+
+def task(participant, day, success, duration):
+    return {"name": participant, "timestamp": f"{day} 09:10:00", "task_name": "Find the report",
+            "success": success, "duration_seconds": duration, "step_one": "", "step_two": "", "step_three": "",
+            "feedback": "", "participant_id": participant}
+
+
+def exit_answers(participant, day, satisfaction):
+    return {"timestamp": f"{day} 09:20:00", "satisfaction": satisfaction, "design": "", "difficulty": 2,
+            "confidence": 4, "completion": "Yes", "improvements": "", "open_feedback": "",
+            "participant_id": participant}
+
+
+def save(backend, store, csv_file, records):
+    # What a save does: the partition is written, then the store updated
+    backend.append(csv_file, records, after_write=store.apply)
+
+
+@pytest.fixture
+def study(data_dir):
+    backend = PartitionedBackend(str(data_dir / "partitions"), study="pilot")
+    store = AggregateStore(str(data_dir / "aggregates.db"))
+    for n, day in enumerate(["2025-01-01", "2025-01-02"]):
+        people = [f"p{n}a", f"p{n}b"]
+        save(backend, store, CONSENT_CSV, [consent(people[0], day), consent(people[1], day)])
+        save(backend, store, DEMOGRAPHIC_CSV, [demographic(people[0], day, "Some College"),
+                                               demographic(people[1], day, "Graduate Degree")])
+        save(backend, store, TASKS_CSV, [task(people[0], day, "Yes", 30.5), task(people[1], day, "Partially", 61)])
+        save(backend, store, EXIT_CSV, [exit_answers(people[0], day, 4), exit_answers(people[1], day, 5)])
+    return backend, store
+
+
+def assert_in_step(backend, store):
+    # The stored aggregates match both a rebuild from the backend and the
+    # batch counters read straight from the partition files
+    assert store.rebuild(backend, replace=False) == {}
+    counters = aggregate_tables(backend.partition_paths(), workers=1)
+    # A table nothing was saved to has no row count stored; the report reads it as 0
+    stored = {("rows", table, ""): (0.0, rows) for table, rows in store.row_counts().items()}
+    stored.update(store.counters())
+    differ = {key: (counters.get(key), stored.get(key)) for key in counters.keys() | stored.keys()
+              if not _same(counters.get(key), stored.get(key))}
+    assert differ == {}
+    for csv_file, table in TABLE_KEYS.items():
+        assert backend.count(csv_file) == store.row_counts()[table]
+
+
+def formats(backend):
+    return sorted(set(backend.manifest.partitions()["format"]))
+
+
+@needs_pyarrow
+def test_compaction_keeps_the_aggregates_in_step(study):
+    backend, store = study
+    assert_in_step(backend, store)
+    compacted = backend.compact("2025-01-02")
+    assert compacted == 4
+    assert formats(backend) == ["csv", "parquet"]
+    assert_in_step(backend, store)
+    backend.compact("2025-01-03")
+    assert formats(backend) == ["parquet"]
+    assert_in_step(backend, store)
+
+
+@needs_pyarrow
+def test_records_arriving_after_compaction_are_kept(study):
+    backend, store = study
+    backend.compact("2025-01-03")
+    # A late submission for a day that is already an archive
+    save(backend, store, TASKS_CSV, [task("p0a", "2025-01-01", "No", 12)])
+    assert formats(backend) == ["csv", "parquet"]
+    assert_in_step(backend, store)
+    backend.compact("2025-01-03")
+    assert formats(backend) == ["parquet"]
+    assert backend.count(TASKS_CSV) == 5
+    assert_in_step(backend, store)
+
+
+def run(monkeypatch, *arguments):
+    monkeypatch.setattr(sys, "argv", ["manage.py", *arguments])
+    manage.main()
+
+
+def test_forced_import_replaces_the_partitions(data_dir, monkeypatch, capsys):
+    with open(TASKS_CSV, "w", encoding="utf-8", newline="") as f:
+        f.write("name,timestamp,task_name,success,participant_id\n"
+                "ann,2025-06-14 10:00:00,Task 1,Yes,p1\nbob,2025-06-15 10:00:00,Task 1,No,p2\n")
+    folder = str(data_dir / "partitions")
+    run(monkeypatch, "partition", "--folder", folder, "--study", "pilot")
+    run(monkeypatch, "partition", "--folder", folder, "--study", "pilot")
+    assert "already holds partitions" in capsys.readouterr().out
+    run(monkeypatch, "partition", "--folder", folder, "--study", "main", "--force")
+
+    backend = PartitionedBackend(folder)
+    listed = backend.manifest.partitions()
+    assert listed["study"].tolist() == ["main", "main"]
+    assert listed["rows"].tolist() == [1, 1]
+    assert backend.count(TASKS_CSV) == 2
+    # The first import's files are gone too
+    assert sorted(os.listdir(os.path.join(folder, "tasks_data"))) == ["main"]
+
+
+def test_timestamps_in_the_older_format_are_filed_by_their_date():
+    assert partition_day("6/14/2025 11:03") == "2025-06-14"
+    assert partition_day("2025-06-14 16:34:46") == "2025-06-14"
+    assert iso_timestamp("6/14/2025 9:05") == "2025-06-14 09:05:00"
+    assert iso_timestamp("2025-06-14T16:34:46") == "2025-06-14 16:34:46"
+    assert iso_timestamp("June 14, 2025 4pm") == "2025-06-14 16:00:00"
+    assert iso_timestamp("") is None
+    assert iso_timestamp("not a time") is None
+
+
+@needs_pyarrow
+def test_mixed_timestamp_formats_are_compacted_by_day(data_dir):
+    backend = PartitionedBackend(str(data_dir / "partitions"), study="pilot")
+    store = AggregateStore(str(data_dir / "aggregates.db"))
+    save(backend, store, TASKS_CSV, [task("p1", "2025-06-14", "Yes", 30)])
+    old = task("p2", "2025-06-14", "No", 20)
+    old["timestamp"] = "6/14/2025 9:05"
+    later = task("p3", "2025-06-20", "Yes", 10)
+    later["timestamp"] = "6/20/2025 10:00"
+    save(backend, store, TASKS_CSV, [old, later])
+
+    listed = backend.manifest.partitions(TASKS_CSV)
+    assert listed["day"].tolist() == ["2025-06-14", "2025-06-20"]
+    assert listed["first_timestamp"].tolist() == ["2025-06-14 09:05:00", "2025-06-20 10:00:00"]
+    assert listed["last_timestamp"].tolist() == ["2025-06-14 09:10:00", "2025-06-20 10:00:00"]
+    assert backend.count(TASKS_CSV, start="2025-06-15") == 1
+
+    assert backend.compact("2025-06-15") == 1
+    listed = backend.manifest.partitions(TASKS_CSV)
+    assert listed["format"].tolist() == ["parquet", "csv"]
+    assert listed["first_timestamp"].tolist()[0] == "2025-06-14 09:05:00"
+    assert_in_step(backend, store)
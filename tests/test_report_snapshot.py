@@ -0,0 +1,99 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+from aggregates import AggregateStore, report_from_json, report_to_json
+
+
+def task(participant, success, duration):
+    return {"name": participant, "timestamp": "2025-06-14 09:10:00", "task_name": storage.TASK_NAMES[0],
+            "success": success, "duration_seconds": duration, "step_one": "", "step_two": "", "step_three": "",
+            "feedback": "", "participant_id": participant}
+
+
+def exit_answers(participant, satisfaction):
+    return {"timestamp": "2025-06-14 09:20:00", "satisfaction": satisfaction, "design": "", "difficulty": 2,
+            "confidence": 4, "completion": "Yes", "improvements": "", "open_feedback": "",
+            "participant_id": participant}
+
+
+@pytest.fixture
+def app(data_dir, monkeypatch):
+    # The app module with a few saves in the tables, and a count of how often
+    # the report is computed rather than read back
+    import hci_project
+
+    monkeypatch.setattr(storage, "WRITE_BEHIND", False)
+    storage.save_to_csv(task("p1", "Yes", 42.5), storage.TASKS_CSV)
+    storage.save_to_csv(exit_answers("p1", 4), storage.EXIT_CSV)
+    computed = []
+    report_data = AggregateStore.report_data
+    monkeypatch.setattr(AggregateStore, "report_data", lambda store: computed.append(1) or report_data(store))
+    monkeypatch.setattr(hci_project, "computed", computed, raising=False)
+    return hci_project
+
+
+def same(first, second):
+    if isinstance(first, pd.DataFrame):
+        pd.testing.assert_frame_equal(first, second)
+    elif isinstance(first, pd.Series):
+        pd.testing.assert_series_equal(first, second)
+    elif isinstance(first, dict):
+        assert first.keys() == second.keys()
+        for key in first:
+            same(first[key], second[key])
+    else:
+        assert first == second or (first != first and second != second)
+
+
+def test_the_report_is_read_back_while_nothing_changes(app):
+    computed = app.load_report_snapshot({})
+    assert os.path.exists(app.REPORT_SNAPSHOT_FILE)
+    restored = app.load_report_snapshot({})
+    assert len(app.computed) == 1
+    assert restored["rows"] == computed["rows"]
+    assert restored["as_of"] == computed["as_of"]
+    same(computed["report_data"], restored["report_data"])
+    assert restored["figures"].keys() == computed["figures"].keys()
+    # Refresh always recomputes
+    app.load_report_snapshot({}, refresh=True)
+    assert len(app.computed) == 2
+
+
+def test_a_save_makes_the_snapshot_stale(app):
+    app.load_report_snapshot({})
+    storage.save_to_csv(task("p2", "No", 10), storage.TASKS_CSV)
+    snapshot = app.load_report_snapshot({})
+    assert len(app.computed) == 2
+    assert snapshot["rows"][storage.TASKS_CSV] == 2
+
+
+def test_a_table_rewritten_in_place_makes_the_snapshot_stale(app):
+    app.load_report_snapshot({})
+    # As backfill-ids or dedupe would: the same rows, the file rewritten
+    with open(storage.TASKS_CSV, encoding="utf-8") as f:
+        text = f.read()
+    with open(storage.TASKS_CSV, "w", encoding="utf-8") as f:
+        f.write(text.replace("p1", "p01"))
+    app.load_report_snapshot({})
+    assert len(app.computed) == 2
+
+
+def test_a_snapshot_of_another_version_is_not_read(app, monkeypatch):
+    app.load_report_snapshot({})
+    monkeypatch.setattr(app, "REPORT_SNAPSHOT_VERSION", app.REPORT_SNAPSHOT_VERSION + 1)
+    app.load_report_snapshot({})
+    assert len(app.computed) == 2
+    with open(app.REPORT_SNAPSHOT_FILE, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert app.read_saved_snapshot({}) is None
+
+
+def test_report_data_survives_a_json_round_trip(app):
+    storage.save_to_csv(task("p2", "Partially", 130), storage.TASKS_CSV)
+    storage.save_to_csv(exit_answers("p2", 5), storage.EXIT_CSV)
+    report_data = AggregateStore().report_data()
+    same(report_data, report_from_json(json.loads(json.dumps(report_to_json(report_data)))))
@@ -0,0 +1,82 @@
+import storage
+from search import FIELD_BITS, RECORD_BITS, SEARCH_FIELDS, SearchIndex, match_expression
+
+
+def task(participant, feedback=None, step_one=None):
+    return {"name": participant, "timestamp": "2025-06-14 10:00:00", "task_name": "Find the report",
+            "success": "Yes", "step_one": step_one, "feedback": feedback, "participant_id": participant}
+
+
+def exit_answers(participant, design=None):
+    return {"timestamp": "2025-06-14 10:20:00", "design": design, "participant_id": participant}
+
+
+def saved_answers():
+    return [
+        (storage.TASKS_CSV, [task("p1", feedback="The date picker was slow", step_one="Opened the menu"),
+                             task("p2", feedback="Could not find the picker"),
+                             task("", feedback="Picker is hidden")]),
+        (storage.EXIT_CSV, [exit_answers("p1", design="Clean, but the picker is small")]),
+    ]
+
+
+def rows(frame):
+    return sorted(map(tuple, frame.fillna("").to_numpy().tolist()))
+
+
+def test_every_field_code_fits_in_its_bits():
+    assert len(SEARCH_FIELDS) <= 1 << FIELD_BITS
+
+
+def test_rowids_give_back_the_field_and_participant(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    for csv_file, records in saved_answers():
+        index.add(csv_file, records)
+
+    found = index.search("picker")
+    # The most recently seen participant first
+    assert list(zip(found["tbl"], found["field"], found["participant_id"].fillna(""))) == [
+        (storage.TASKS_CSV, "feedback", ""),
+        (storage.TASKS_CSV, "feedback", "p2"),
+        (storage.EXIT_CSV, "design", "p1"),
+        (storage.TASKS_CSV, "feedback", "p1"),
+    ]
+    assert found["excerpt"].iloc[-1] == "The date [picker] was slow"
+
+    counts, participants = index.match_counts("picker")
+    assert dict(zip(counts["field"], counts["answers"])) == {"feedback": 3, "design": 1}
+    # Answers saved without a participant ID are not a participant
+    assert participants == 2
+    assert index.participants("picker") == ["p1", "p2"]
+    assert index.search("menu")["field"].tolist() == ["step_one"]
+
+
+def test_a_participants_records_get_their_own_rowids(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    index.add(storage.TASKS_CSV, [task("p1", feedback=f"answer {n}") for n in range(20)])
+    rowids = [rowid for (rowid,) in index._connection().execute("SELECT rowid FROM answers")]
+    assert len(set(rowids)) == 20
+    assert {rowid >> (RECORD_BITS + FIELD_BITS) for rowid in rowids} == {1}
+    assert sorted((rowid >> FIELD_BITS) & ((1 << RECORD_BITS) - 1) for rowid in rowids) == list(range(20))
+
+
+def test_a_rebuild_finds_what_the_saves_added(data_dir):
+    backend = storage.CsvBackend()
+    added = SearchIndex(storage.DATA_FOLDER + "/added.db")
+    for csv_file, records in saved_answers():
+        backend.append(csv_file, records)
+        added.add(csv_file, records)
+    rebuilt = SearchIndex(storage.DATA_FOLDER + "/rebuilt.db")
+    assert rebuilt.rebuild(backend) == 5
+
+    for query in ("picker", "date-picker", "pick*", "slow OR hidden", '"the picker"'):
+        assert rows(rebuilt.search(query)) == rows(added.search(query))
+        assert rebuilt.match_counts(query)[1] == added.match_counts(query)[1]
+    assert rebuilt.top_terms(1)["term"].tolist() == ["picker"]
+
+
+def test_typed_queries_become_fts_expressions():
+    assert match_expression("Date-Picker") == '"date picker"'
+    assert match_expression('"date picker" slow*') == '"date picker" "slow"*'
+    assert match_expression("OR slow OR OR fast OR") == '"slow" OR "fast"'
+    assert match_expression("  ...  ") == ""
@@ -0,0 +1,63 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketch import RELATIVE_ACCURACY, ZERO_BUCKET, bucket_key, bucket_keys, histogram, quantiles
+
+QS = [0.0, 0.1, 0.5, 0.9, 0.99, 1.0]
+
+
+def sketch(values):
+    return Counter(bucket_key(value) for value in values)
+
+
+def exact(values, q):
+    # The rank the sketch's guarantee is stated for
+    return sorted(values)[math.floor(q * (len(values) - 1))]
+
+
+@pytest.mark.parametrize("values", [
+    np.random.default_rng(0).lognormal(4, 1, 20000),
+    np.random.default_rng(1).pareto(1.2, 20000) + 0.5,
+    np.random.default_rng(2).uniform(1, 3600, 20000),
+    [42.0] * 100,
+])
+def test_quantiles_are_within_the_relative_accuracy(values):
+    values = list(values)
+    for q, estimate in zip(QS, quantiles(sketch(values), QS)):
+        assert abs(estimate - exact(values, q)) <= RELATIVE_ACCURACY * exact(values, q) + 1e-12
+
+
+def test_series_and_single_values_use_the_same_buckets():
+    values = pd.Series([0.0, 0.0005, 0.001, 0.0011, 1.0, 29.5, 3600.0, None, "12.5", "n/a"])
+    expected = [bucket_key(float(value)) if value not in (None, "n/a") else None for value in values]
+    assert bucket_keys(values).where(lambda keys: keys.notna(), None).tolist() == expected
+
+
+def test_merged_sketches_equal_the_sketch_of_all_values():
+    rng = np.random.default_rng(3)
+    first, second = list(rng.lognormal(3, 1, 5000)), list(rng.lognormal(5, 0.5, 5000))
+    assert sketch(first) + sketch(second) == sketch(first + second)
+
+
+def test_tiny_values_count_as_zero_and_empty_sketches_are_nan():
+    assert bucket_key(0.0005) == ZERO_BUCKET
+    assert quantiles({ZERO_BUCKET: 3, bucket_key(10.0): 1}, [0.5]) == [0.0]
+    assert all(math.isnan(value) for value in quantiles({}, QS))
+
+
+def test_size_depends_on_the_range_not_the_count():
+    # 1 ms to a week
+    values = np.geomspace(0.002, 7 * 24 * 3600, 200000)
+    assert len(sketch(values)) < 1000
+
+
+def test_histogram_counts_every_value():
+    values = [1, 4.9, 5.5, 30, 59, 61, 700, 10000]
+    counts = histogram(sketch(values))
+    assert counts.sum() == len(values)
+    assert counts["0-5s"] == 2
+    assert counts["600s+"] == 2
@@ -0,0 +1,48 @@
+import pytest
+
+import storage
+from sqlite_backend import SqliteBackend
+
+
+@pytest.fixture
+def backend(data_dir):
+    with open(storage.CONSENT_CSV, "w", encoding="utf-8") as f:
+        f.write("timestamp,consent_given\n2025-06-14 10:39:38,True\n2025-06-14 11:34:49,True\n")
+    with open(storage.EXIT_CSV, "w", encoding="utf-8") as f:
+        f.write("timestamp,satisfaction,design\n2025-06-14 11:03:00,5,Fine\n")
+    return SqliteBackend(str(data_dir / "study.db"))
+
+
+def test_import_runs_once(backend):
+    assert backend.import_csvs() == {"consent": 2, "demographics": 0, "tasks": 0, "exit_questionnaire": 1}
+    assert backend.import_csvs() is None
+    assert backend.count(storage.CONSENT_CSV) == 2
+
+
+def test_forced_import_replaces_the_rows(backend):
+    backend.import_csvs()
+    backend.append(storage.CONSENT_CSV, [{"timestamp": "2025-06-15 09:00:00", "consent_given": True}])
+    assert backend.import_csvs(force=True)["consent"] == 2
+    assert backend.count(storage.CONSENT_CSV) == 2
+    assert backend.count(storage.EXIT_CSV) == 1
+
+
+def test_failed_import_changes_nothing(backend):
+    backend.import_csvs()
+    with open(storage.EXIT_CSV, "a", encoding="utf-8") as f:
+        f.write("2025-06-14 11:04:00,5,Fine\n")
+    with open(storage.TASKS_CSV, "w", encoding="utf-8") as f:
+        f.write("name,not_a_column\nann,1\n")
+    with pytest.raises(ValueError):
+        backend.import_csvs(force=True)
+    assert backend.count(storage.CONSENT_CSV) == 2
+    assert backend.count(storage.EXIT_CSV) == 1
+
+
+def test_page_reads_sort_empty_values_last(backend):
+    backend.import_csvs()
+    backend.append(storage.EXIT_CSV, [{"timestamp": "2025-06-14 12:00:00", "satisfaction": 2},
+                                      {"timestamp": "2025-06-14 12:01:00"}])
+    page = backend.read_page(storage.EXIT_CSV, ["satisfaction"], sort_by="satisfaction")
+    assert page["satisfaction"].tolist()[:2] == [2, 5]
+    assert page["satisfaction"].isna().tolist() == [False, False, True]
@@ -0,0 +1,144 @@
+import pytest
+
+import storage
+import submissions
+from submissions import SubmissionKeys, new_submission_key
+from write_queue import WriteBehindQueue
+
+
+@pytest.fixture
+def keys(data_dir, monkeypatch):
+    keys = SubmissionKeys(str(data_dir / "keys.db"))
+    monkeypatch.setattr(submissions, "_submission_keys", keys)
+    return keys
+
+
+def test_a_key_is_accepted_once(tmp_path):
+    keys = SubmissionKeys(str(tmp_path / "keys.db"))
+    key = new_submission_key()
+    assert keys.claim(key)
+    assert not keys.claim(key)
+    assert keys.claim(new_submission_key())
+    assert keys.stats() == {"keys": 2, "accepted": 2, "duplicates": 1, "released": 0}
+
+
+def test_a_released_key_can_be_claimed_again(tmp_path):
+    keys = SubmissionKeys(str(tmp_path / "keys.db"))
+    assert keys.claim(1)
+    keys.release(1)
+    assert keys.claim(1)
+    assert keys.stats()["released"] == 1
+
+
+def test_keys_expire(tmp_path):
+    keys = SubmissionKeys(str(tmp_path / "keys.db"), ttl=10)
+    assert keys.claim(1, now=100)
+    assert not keys.claim(1, now=109)
+    assert keys.claim(1, now=111)
+
+
+def test_keys_are_shared_through_the_database(tmp_path):
+    # Another server process (or this one after a restart) sees the claim
+    path = str(tmp_path / "keys.db")
+    first, second = SubmissionKeys(path), SubmissionKeys(path)
+    assert first.claim(1)
+    assert not second.claim(1)
+    first.release(1)
+    assert second.claim(1)
+    assert not SubmissionKeys(path).claim(1)
+
+
+def record():
+    return {"timestamp": "2025-01-01 10:00:00", "consent_given": True, "participant_id": "p1"}
+
+
+def rows(csv_file):
+    return len(storage.CsvCache().load(csv_file))
+
+
+def test_a_repeated_submission_is_saved_once(keys, monkeypatch):
+    monkeypatch.setattr(storage, "WRITE_BEHIND", False)
+    assert storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert not storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert rows(storage.CONSENT_CSV) == 1
+
+
+def test_a_failed_write_gives_its_key_back(keys, monkeypatch):
+    monkeypatch.setattr(storage, "WRITE_BEHIND", False)
+    append = storage._append
+    failures = [PermissionError("read-only file system")]
+
+    def failing_once(csv_file, records):
+        if failures:
+            raise failures.pop()
+        append(csv_file, records)
+
+    monkeypatch.setattr(storage, "_append", failing_once)
+    with pytest.raises(PermissionError):
+        storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert keys.stats()["released"] == 1
+    assert storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert rows(storage.CONSENT_CSV) == 1
+
+
+def test_a_record_the_queue_drops_gives_its_key_back(keys, monkeypatch):
+    def failing(csv_file, records):
+        raise ValueError("unknown column")
+
+    monkeypatch.setattr(storage, "_write_queue", WriteBehindQueue(failing))
+    assert storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert storage.flush_writes(5)
+    assert keys.stats()["released"] == 1
+    assert keys.claim(7)
+
+
+def test_a_spilled_record_gives_its_key_back_and_can_be_replayed(keys, monkeypatch):
+    def full(csv_file, records):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(storage, "_write_queue", WriteBehindQueue(full, retry_delay=0, max_retries=1,
+                                                                  spill=storage._spill))
+    assert storage.save_to_csv(record(), storage.CONSENT_CSV, 7)
+    assert storage.flush_writes(5)
+    assert keys.stats()["released"] == 1
+    assert rows(storage.CONSENT_CSV) == 0
+    assert storage.replay_dead_letters() == (1, 0)
+    assert rows(storage.CONSENT_CSV) == 1
+    assert storage.replay_dead_letters() == (0, 0)
+
+
+def write_table(csv_file, text):
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+
+
+def test_dedupe_removes_repeats_without_participant_ids(data_dir):
+    write_table(storage.EXIT_CSV,
+                "timestamp,satisfaction,design,open_feedback\n"
+                "6/14/2025 11:03,5,The sidebar,I liked it\n"
+                "6/14/2025 11:03,5,The sidebar,I liked it\n"
+                "6/14/2025 11:41,5,No,I like the app.\n"
+                # Too long after the first to be a repeated click
+                "6/14/2025 11:50,5,The sidebar,I liked it\n")
+    write_table(storage.CONSENT_CSV,
+                "timestamp,consent_given\n2025-06-14 10:39:38,True\n2025-06-14 10:39:40,True\n")
+    assert submissions.dedupe_csv_tables(dry_run=True)[storage.EXIT_CSV] == 1
+    removed = submissions.dedupe_csv_tables()
+    assert removed[storage.EXIT_CSV] == 1
+    # Nothing in a consent row says who gave it
+    assert removed[storage.CONSENT_CSV] == 0
+    with open(storage.EXIT_CSV, encoding="utf-8") as f:
+        assert [line[:15] for line in f.read().splitlines()[1:]] == [
+            "6/14/2025 11:03", "6/14/2025 11:41", "6/14/2025 11:50"]
+
+
+def test_dedupe_keeps_a_timed_second_attempt(data_dir):
+    write_table(storage.TASKS_CSV,
+                "name,timestamp,task_name,success,duration_seconds,step_one,participant_id\n"
+                "ann,2025-06-14 10:00:00,Task 1,Yes,30,ok,p1\n"
+                "ann,2025-06-14 10:00:01,Task 1,Yes,,ok,p1\n"
+                "ann,2025-06-14 10:02:00,Task 1,Yes,41,ok,p1\n"
+                "bob,2025-06-14 10:00:02,Task 1,Yes,,ok,p2\n")
+    assert submissions.dedupe_csv_tables()[storage.TASKS_CSV] == 1
+    with open(storage.TASKS_CSV, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 4
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from task_registry import QUESTION_COLUMNS, TASKS_FILE, load_tasks, parse_tasks
+
+
+def entry(name, *columns, **fields):
+    return {"name": name, "description": f"Do {name}.",
+            "questions": [{"column": column, "label": f"{column}?"} for column in columns or ["feedback"]],
+            **fields}
+
+
+def problems(config):
+    with pytest.raises(ValueError) as error:
+        parse_tasks(config, "study.json")
+    return str(error.value).splitlines()
+
+
+def test_the_shipped_tasks_file_is_valid():
+    tasks = load_tasks(TASKS_FILE)
+    assert tasks
+    for task in tasks.values():
+        assert task.questions
+        assert {column for column, _, _ in task.questions} <= set(QUESTION_COLUMNS)
+
+
+def test_tasks_keep_their_order_and_default_label():
+    tasks = parse_tasks({"tasks": [entry("Search", "step_one", label="Task One"), entry("Sort")]})
+    assert list(tasks) == ["Search", "Sort"]
+    assert tasks["Search"].label == "Task One"
+    assert tasks["Sort"].label == "Sort"
+    assert tasks["Search"].questions == [("step_one", "step_one?", "")]
+
+
+def test_every_problem_is_reported_at_once():
+    found = problems({"tasks": [
+        entry("Search"),
+        entry("Search"),
+        {"name": "Sort", "questions": [{"column": "step_nine", "label": "?"}]},
+        entry("Filter", "step_one", "step_one"),
+        {"name": "", "description": "x", "questions": []},
+        "not a task",
+        {"name": "Rate", "description": "x", "questions": [{"column": "feedback", "label": "?", "placeholder": 3}]},
+    ]})
+    assert found == [
+        "study.json is not valid:",
+        "  task 2 ('Search'): listed more than once",
+        "  task 3 ('Sort'): 'description' must be a non-empty string",
+        f"  task 3 ('Sort'): question column 'step_nine' is not one of {QUESTION_COLUMNS}",
+        "  task 4 ('Filter'): column 'step_one' is asked more than once",
+        "  task 5: 'name' must be a non-empty string",
+        "  task 5: 'questions' must be a non-empty list",
+        "  task 6: must be an object",
+        "  task 7 ('Rate'), question 'feedback': 'placeholder' must be a string",
+    ]
+
+
+@pytest.mark.parametrize("config", [{}, {"tasks": []}, {"tasks": "Search"}, []])
+def test_a_file_without_tasks_is_rejected(config):
+    assert problems(config) == ["study.json: expected an object with a non-empty 'tasks' list"]
+
+
+def test_a_file_that_is_not_json_is_rejected(tmp_path):
+    path = tmp_path / "tasks.json"
+    path.write_text('{"tasks": [', encoding="utf-8")
+    with pytest.raises(ValueError, match="is not valid JSON"):
+        load_tasks(str(path))
+    path.write_text(json.dumps({"tasks": [entry("Search")]}), encoding="utf-8")
+    assert list(load_tasks(str(path))) == ["Search"]
+
+
+def test_unasked_columns_are_saved_empty():
+    task = parse_tasks({"tasks": [entry("Search", "step_one", "feedback")]})["Search"]
+    assert task.record({"step_one": "the menu", "feedback": "easy"}) == {
+        "step_one": "the menu", "step_two": "", "step_three": "", "feedback": "easy"}
@@ -0,0 +1,127 @@
+import threading
+
+from write_queue import WriteBehindQueue
+
+
+class Table:
+    # Stands in for write_many: keeps what was written, and fails records
+    # marked bad or, while the disk is "full", every write
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+        self.disk_full = False
+
+    def write_many(self, csv_file, records):
+        self.calls += 1
+        if self.disk_full:
+            raise OSError("No space left on device")
+        if any(record.get("bad") for record in records):
+            raise ValueError("unknown column")
+        self.rows.extend((csv_file, record["n"]) for record in records)
+
+
+def test_records_are_written_in_order():
+    table = Table()
+    queue = WriteBehindQueue(table.write_many)
+    for n in range(50):
+        assert queue.submit("a.csv" if n % 2 else "b.csv", {"n": n})
+    assert queue.flush(5)
+    assert [n for csv_file, n in table.rows if csv_file == "a.csv"] == list(range(1, 50, 2))
+    assert [n for csv_file, n in table.rows if csv_file == "b.csv"] == list(range(0, 50, 2))
+    stats = queue.stats()
+    assert stats["flushed"] == 50
+    assert stats["pending"] == 0
+    assert stats["dropped"] == 0
+
+
+def test_one_bad_record_is_dropped_alone():
+    table = Table()
+    dropped = []
+    gate = threading.Event()
+    # Hold the first write back so the rest arrive as one batch
+    queue = WriteBehindQueue(lambda csv_file, records: gate.wait(5) and table.write_many(csv_file, records))
+    for n in range(5):
+        queue.submit("a.csv", {"n": n, "bad": n == 2}, on_drop=lambda n=n: dropped.append(n))
+    gate.set()
+    assert queue.flush(5)
+    assert [n for _, n in table.rows] == [0, 1, 3, 4]
+    assert dropped == [2]
+    assert queue.stats()["dropped"] == 1
+    assert queue.stats()["flushed"] == 4
+
+
+def test_failing_disk_is_retried_then_spilled():
+    table = Table()
+    table.disk_full = True
+    spilled, dropped = [], []
+    queue = WriteBehindQueue(table.write_many, retry_delay=0, max_retries=3,
+                             spill=lambda csv_file, records, error: spilled.extend(records))
+    queue.submit("a.csv", {"n": 1}, on_drop=lambda: dropped.append(1))
+    assert queue.flush(5)
+    assert spilled == [{"n": 1}]
+    assert dropped == [1]
+    assert table.calls == 4
+    stats = queue.stats()
+    assert stats["retries"] == 3
+    assert stats["spilled"] == 1
+    assert stats["dropped"] == 0
+
+    # The queue keeps going once the disk recovers
+    table.disk_full = False
+    queue.submit("a.csv", {"n": 2})
+    assert queue.flush(5)
+    assert table.rows == [("a.csv", 2)]
+
+
+def test_disk_trouble_that_clears_loses_nothing():
+    table = Table()
+    attempts = []
+
+    def flaky(csv_file, records):
+        attempts.append(len(records))
+        if len(attempts) < 3:
+            raise OSError("I/O error")
+        table.write_many(csv_file, records)
+
+    queue = WriteBehindQueue(flaky, retry_delay=0, max_retries=5)
+    queue.submit("a.csv", {"n": 1})
+    assert queue.flush(5)
+    assert table.rows == [("a.csv", 1)]
+    assert queue.stats()["retries"] == 2
+
+
+def test_without_spill_failed_records_are_dropped():
+    table = Table()
+    table.disk_full = True
+    dropped = []
+    queue = WriteBehindQueue(table.write_many, retry_delay=0, max_retries=1)
+    queue.submit("a.csv", {"n": 1}, on_drop=lambda: dropped.append(1))
+    assert queue.flush(5)
+    assert dropped == [1]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_full_queue_gives_up_and_flush_times_out():
+    gate = threading.Event()
+    queue = WriteBehindQueue(lambda csv_file, records: gate.wait(5), max_size=1, batch_size=1, put_timeout=0.05)
+    queue.submit("a.csv", {"n": 1})
+    # One record held by the writer, one filling the queue, one turned away
+    results = [queue.submit("a.csv", {"n": n}) for n in range(2, 5)]
+    assert results.count(False) >= 1
+    assert not queue.flush(0.05)
+    gate.set()
+    assert queue.flush(5)
+    assert queue.stats()["pending"] == 0
+
+
+def test_a_failing_on_drop_does_not_stop_the_queue():
+    table = Table()
+
+    def broken():
+        raise RuntimeError("release failed")
+
+    queue = WriteBehindQueue(table.write_many)
+    queue.submit("a.csv", {"n": 1, "bad": True}, on_drop=broken)
+    queue.submit("a.csv", {"n": 2})
+    assert queue.flush(5)
+    assert table.rows == [("a.csv", 2)]
@@ -0,0 +1,195 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    # In-process write-behind buffer for form submissions. submit() only puts
+    # the record on a bounded queue and returns; a single background thread
+    # drains the queue in batches and hands each table's records to
+    # write_many(csv_file, records) in submission order. flush() waits until
+    # everything submitted so far is on disk, which is how a reader sees its own
+    # writes. A full queue blocks the submitter (backpressure) for up to
+    # put_timeout seconds before submit() gives up and returns False.
+    #
+    # A write that fails with OSError (disk trouble) is retried up to
+    # max_retries times, retry_delay seconds apart; after that the records are
+    # handed to spill(csv_file, records, error), if given, so they can be kept
+    # somewhere else instead of holding up the queue. Any other error means
+    # something in the records is bad: they are written again one at a time,
+    # and only the ones that still fail are dropped. A record that is never
+    # written to its table (spilled or dropped) calls the on_drop given with it.
+
+    def __init__(self, write_many, max_size=1000, batch_size=200, put_timeout=5.0, retry_delay=0.5,
+                 max_retries=5, spill=None):
+        self._write_many = write_many
+        self._spill = spill
+        self._queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+
+        self._state_lock = threading.Lock()
+        self._idle = threading.Condition(self._state_lock)
+        self._outstanding = 0
+        self._thread = None
+
+        # Counters
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.retries = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def submit(self, csv_file, record, on_drop=None):
+        self._ensure_started()
+        with self._state_lock:
+            self._outstanding += 1
+        item = (csv_file, record, on_drop)
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self._forget([item])
+            return False
+        with self._state_lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self, timeout=None):
+        # Wait until everything submitted so far is on disk; False on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._state_lock:
+            return {
+                "depth": self._queue.qsize(),
+                "pending": self._outstanding,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "retries": self.retries,
+                "last_flush_seconds": self.last_flush_seconds,
+                "max_flush_seconds": self.max_flush_seconds,
+                "avg_flush_seconds": self.total_flush_seconds / self.batches if self.batches else 0.0,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._state_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+                # Give queued submissions a chance to reach disk when the server exits
+                atexit.register(self.flush, 10.0)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        by_file = {}
+        for item in batch:
+            by_file.setdefault(item[0], []).append(item)
+
+        written = 0
+        started = time.perf_counter()
+        for csv_file, items in by_file.items():
+            written += self._write(csv_file, items)
+        elapsed = time.perf_counter() - started
+
+        with self._state_lock:
+            self.batches += 1
+            self.flushed += written
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+        self._forget(batch)
+
+    def _write(self, csv_file, items):
+        # Write items to csv_file; returns how many reached it
+        records = [item[1] for item in items]
+        attempts = 0
+        while True:
+            try:
+                self._write_many(csv_file, records)
+                return len(records)
+            except OSError as error:
+                # Disk trouble: try again a few times, then set the records aside
+                attempts += 1
+                if attempts > self.max_retries:
+                    self._give_up(csv_file, items, error)
+                    return 0
+                logger.exception("Writing to %s failed, retrying (%d of %d)", csv_file, attempts, self.max_retries)
+                with self._state_lock:
+                    self.retries += 1
+                time.sleep(self.retry_delay)
+            except Exception:
+                if len(items) > 1:
+                    # One bad record (e.g. an unknown column) fails the whole
+                    # batch; write them one by one so only it is lost
+                    logger.exception("Writing %d record(s) to %s failed, writing them one at a time",
+                                     len(items), csv_file)
+                    return sum(self._write(csv_file, [item]) for item in items)
+                logger.exception("Dropping a record that could not be written to %s", csv_file)
+                with self._state_lock:
+                    self.dropped += 1
+                self._dropped(items)
+                return 0
+
+    def _give_up(self, csv_file, items, error):
+        records = [item[1] for item in items]
+        if self._spill is not None:
+            try:
+                self._spill(csv_file, records, error)
+            except Exception:
+                logger.exception("Could not set aside %d record(s) for %s", len(records), csv_file)
+            else:
+                logger.error("Set aside %d record(s) that could not be written to %s", len(records), csv_file)
+                with self._state_lock:
+                    self.spilled += len(records)
+                self._dropped(items)
+                return
+        logger.error("Dropping %d record(s) that could not be written to %s", len(records), csv_file)
+        with self._state_lock:
+            self.dropped += len(records)
+        self._dropped(items)
+
+    def _dropped(self, items):
+        for item in items:
+            on_drop = item[2]
+            if on_drop is not None:
+                try:
+                    on_drop()
+                except Exception:
+                    logger.exception("on_drop of a dropped record failed")
+
+    def _forget(self, items):
+        with self._idle:
+            self._outstanding -= len(items)
+            if not self._outstanding:
+                self._idle.notify_all()